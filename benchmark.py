@@ -0,0 +1,203 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import detector
+from corpus_generator import CorpusGenerator
+from extractor import CodeParser, FunctionExtractor
+from metrics import Metrics
+
+
+def _measure(stage, measure_memory, repeat=5):
+    """Runs stage() repeat times and keeps the fastest run, the one least disturbed by the rest of the
+    machine (garbage collection is off while timing, as in timeit), then, if asked, once more under
+    tracemalloc for its peak memory. Returns (result, seconds, peak_bytes)."""
+    timings = []
+    for _ in range(repeat):
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = stage()
+            timings.append(time.perf_counter() - start)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+    seconds = min(timings)
+    peak = None
+    if measure_memory:
+        tracemalloc.start()
+        stage()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+class PipelineBenchmark:
+    """Times each pipeline stage separately on a corpus and checks planted duplicate recall.
+
+    Stages: parse (CodeParser), extract (FunctionExtractor.extract_functions), smells
+    (detect_code_smells) and one duplicates stage per duplicate_mode, run over all corpus
+    functions at once. Duplicate stages report the pairs each mode actually scored (its
+    pairs_considered counter), so lsh throughput is not credited with the pairs it pruned.
+    Every stage is timed repeat times and reports its fastest run (see _measure)."""
+
+    def __init__(self, files, clusters, modes=('exact',), measure_memory=True, repeat=5):
+        self.files = files
+        self.clusters = clusters
+        self.modes = modes
+        self.measure_memory = measure_memory
+        self.repeat = repeat
+
+    def _planted_pairs(self):
+        pairs = set()
+        for members in self.clusters:
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    pairs.add(frozenset((members[i], members[j])))
+        return pairs
+
+    def run(self):
+        stages = {}
+
+        def record(name, seconds, peak, units, unit_name):
+            stages[name] = {
+                'seconds': round(seconds, 6),
+                unit_name: units,
+                f"{unit_name}_per_second": round(units / seconds, 1) if seconds else None,
+                'peak_bytes': peak,
+            }
+
+        def measure(stage):
+            return _measure(stage, self.measure_memory, self.repeat)
+
+        parsers, seconds, peak = measure(lambda: [CodeParser(path) for path in self.files])
+        line_count = sum(len(p.get_source().lines) for p in parsers)
+        record('parse', seconds, peak, line_count, 'lines')
+
+        def extract():
+            functions = []
+            for parser in parsers:
+                extractor = FunctionExtractor(parser.get_ASTree(), parser.file_path, parser.get_source())
+                functions.extend(extractor.extract_functions())
+            return functions
+
+        functions, seconds, peak = measure(extract)
+        record('extract', seconds, peak, len(functions), 'functions')
+
+        _, seconds, peak = measure(lambda: detector.CodeSmellDetector(functions).detect_code_smells())
+        record('smells', seconds, peak, len(functions), 'functions')
+
+        n = len(functions)
+        planted = self._planted_pairs()
+        quality = {}
+        reference = None
+        for mode in self.modes:
+            runs = []
+
+            def find_duplicates():
+                metrics = Metrics()
+                runs.append(metrics)
+                return detector.CodeSmellDetector(functions, duplicate_mode=mode, metrics=metrics) \
+                    .duplicate_code_detector()
+
+            duplicates, seconds, peak = measure(find_duplicates)
+            record(f'duplicates[{mode}]', seconds, peak, runs[0].counters['pairs_considered'], 'pairs')
+
+            found = {frozenset(d[:2]) for d in duplicates}
+            reference = found if reference is None else reference
+            quality[mode] = {
+                'duplicates': len(found),
+                'planted_recall': round(len(found & planted) / len(planted), 4) if planted else None,
+                'planted_precision': round(len(found & planted) / len(found), 4) if found else None,
+                f'agreement_with_{self.modes[0]}': round(len(found & reference) / len(reference), 4)
+                if reference else None,
+            }
+
+        return {
+            'python': platform.python_version(),
+            'files': len(self.files),
+            'functions': n,
+            'stages': stages,
+            'quality': quality,
+        }
+
+
+def compare_with_baseline(results, baseline, tolerance, min_delta=0.005):
+    """Returns (lines, regressed): one line per stage present in both runs, flagging stages that got
+    slower by more than tolerance (a fraction) and by more than min_delta seconds, so that the jitter
+    of millisecond stages is not taken for a regression, or lost planted-duplicate recall."""
+    lines, regressed = [], False
+    for name, stage in results['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if not old or not old['seconds']:
+            continue
+        ratio = stage['seconds'] / old['seconds']
+        slower = ratio > 1 + tolerance and stage['seconds'] - old['seconds'] > min_delta
+        regressed |= slower
+        lines.append(f"{name:<22} {old['seconds']:>10.4f}s -> {stage['seconds']:>10.4f}s  x{ratio:.2f}"
+                     + ("  REGRESSION" if slower else ""))
+    for mode, quality in results['quality'].items():
+        old_recall = baseline.get('quality', {}).get(mode, {}).get('planted_recall')
+        if old_recall is not None and quality['planted_recall'] is not None \
+                and quality['planted_recall'] < old_recall:
+            regressed = True
+            lines.append(f"recall[{mode}] dropped {old_recall} -> {quality['planted_recall']}  REGRESSION")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the code smell pipeline on a synthetic corpus.")
+    parser.add_argument('--modules', type=int, default=20)
+    parser.add_argument('--functions', type=int, default=50, help="functions per module")
+    parser.add_argument('--clusters', type=int, default=20, help="planted duplicate clusters")
+    parser.add_argument('--cluster-size', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--modes', default='exact,lsh', help="comma separated duplicate modes to time")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc peak memory pass")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per stage; the fastest one is reported")
+    parser.add_argument('-o', '--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="compare against a results JSON saved earlier")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown of a stage's fastest run before flagging (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        manifest = CorpusGenerator(
+            modules=args.modules, functions_per_module=args.functions,
+            duplicate_clusters=args.clusters, cluster_size=args.cluster_size, seed=args.seed,
+        ).generate(corpus_dir)
+        benchmark = PipelineBenchmark(manifest['files'], manifest['duplicate_clusters'],
+                                      modes=tuple(args.modes.split(',')), measure_memory=not args.no_memory,
+                                      repeat=args.repeat)
+        results = benchmark.run()
+    results['config'] = {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')}
+
+    for name, stage in results['stages'].items():
+        rate = next((f"{v:,.0f} {k.replace('_per_second', '')}/s" for k, v in stage.items()
+                     if k.endswith('_per_second') and v is not None), "")
+        memory = f"{stage['peak_bytes'] / 1e6:8.1f} MB" if stage['peak_bytes'] is not None else ""
+        print(f"{name:<22} {stage['seconds']:>10.4f}s  {rate:>24}  {memory}")
+    for mode, quality in results['quality'].items():
+        print(f"quality[{mode}]: {quality}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            lines, regressed = compare_with_baseline(results, json.load(file), args.tolerance)
+        print("\nCompared with baseline:")
+        print("\n".join(lines))
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only needed for duplicate_mode='bitset'
+    np = None
+
+OPERATION_VOCABULARY = ('BinOp', 'UnaryOp', 'Compare')
+
+
+class BitsetSimilarityEngine:
+    """All-pairs similarity over FunctionFingerprints using NumPy bit matrices.
+
+    The structure vocabulary (AST node type names and CALL_<name> tokens) is interned and each
+    function becomes one packed bit-vector row. Pairs are scored tile by tile: a tile is unpacked
+    and intersection counts come from a single matrix product, unions from the row popcounts.
+    The unique-operation penalty and the wrapper rule are applied the same vectorized way, so
+    scores equal CodeSmellDetector._compute_function_similarity exactly. Besides the packed
+    matrices (one bit per function and vocabulary token), working memory is bounded by
+    block_size * max(block_size, vocabulary size), whatever the number of functions."""
+
+    def __init__(self, fingerprints, class_names=None, block_size=1024, files=None):
+        if np is None:
+            raise RuntimeError("duplicate_mode='bitset' requires numpy (pip install numpy)")
+        self.block_size = block_size
+        self.count = len(fingerprints)
+
+        vocabulary = {}
+        for fingerprint in fingerprints:
+            for token in fingerprint.structure:
+                vocabulary.setdefault(token, len(vocabulary))
+        self.vocabulary = vocabulary
+        self.structure_bits = self._pack([fp.structure for fp in fingerprints], vocabulary, block_size)
+        self.structure_sizes = np.array([len(fp.structure) for fp in fingerprints], dtype=np.int64)
+
+        operation_ids = {name: i for i, name in enumerate(OPERATION_VOCABULARY)}
+        self.operation_bits = self._pack([fp.operations for fp in fingerprints], operation_ids, block_size)
+        self.operation_sizes = np.array([len(fp.operations) for fp in fingerprints], dtype=np.int64)
+
+        self.wrappers = np.array([fp.is_wrapper for fp in fingerprints], dtype=bool)
+
+        class_ids = {}
+        names = class_names if class_names is not None else [None] * self.count
+        self.class_ids = np.array(
+            [-1 if name is None else class_ids.setdefault(name, len(class_ids)) for name in names], dtype=np.int64)
+        # files, if given, name each function's file: pairs within one file are then skipped
+        file_ids = {}
+        self.file_ids = None if files is None else np.array(
+            [file_ids.setdefault(file, len(file_ids)) for file in files], dtype=np.int64)
+
+    @staticmethod
+    def _pack(token_sets, vocabulary, block_size):
+        # block by block, so only block_size unpacked rows exist at a time
+        width = max(len(vocabulary), 1)
+        packed = np.zeros((len(token_sets), (width + 7) // 8), dtype=np.uint8)
+        for start in range(0, len(token_sets), block_size):
+            block = token_sets[start:start + block_size]
+            dense = np.zeros((len(block), width), dtype=np.uint8)
+            for row, tokens in enumerate(block):
+                dense[row, [vocabulary[token] for token in tokens]] = 1
+            packed[start:start + len(block)] = np.packbits(dense, axis=1)
+        return packed
+
+    def _unpack(self, bits, start, stop, width):
+        return np.unpackbits(bits[start:stop], axis=1, count=width).astype(np.float32)
+
+    def _score_tile(self, r0, r1, c0, c1):
+        """Returns the (r1 - r0, c1 - c0) similarity matrix for one tile."""
+        width = max(len(self.vocabulary), 1)
+        rows = self._unpack(self.structure_bits, r0, r1, width)
+        cols = rows if (r0, r1) == (c0, c1) else self._unpack(self.structure_bits, c0, c1, width)
+        # float32 sums of 0/1 products are exact for any realistic vocabulary size
+        intersection = (rows @ cols.T).astype(np.int64)
+        union = self.structure_sizes[r0:r1, None] + self.structure_sizes[None, c0:c1] - intersection
+        similarity = np.zeros(intersection.shape, dtype=np.float64)
+        np.divide(intersection, union, out=similarity, where=union > 0)
+
+        op_width = len(OPERATION_VOCABULARY)
+        op_rows = self._unpack(self.operation_bits, r0, r1, op_width)
+        op_cols = self._unpack(self.operation_bits, c0, c1, op_width)
+        common_ops = (op_rows @ op_cols.T).astype(np.int64)
+        uncommon_ops = self.operation_sizes[r0:r1, None] + self.operation_sizes[None, c0:c1] - 2 * common_ops
+        penalty = np.minimum(uncommon_ops * 0.05, 0.5)
+
+        similarity = np.maximum(similarity - penalty, 0)
+        similarity[self.wrappers[r0:r1, None] & self.wrappers[None, c0:c1]] = 0
+        return similarity
+
+    def iter_pairs(self, threshold, counts=None, progress=None):
+        """Yields (i, j, similarity) for i < j with similarity > threshold, in (i, j) order,
+        skipping pairs of functions that belong to two different classes (or to one file, see files).
+        counts, a Counter, receives the detector's pair counters for the tiles scored so far
+        (pairs_considered, pairs_skipped_class, pairs_skipped_same_file and pairs_skipped_wrapper, with
+        the same meaning as in the other modes); progress(done, total) is called before each row block."""
+        n, step = self.count, self.block_size
+        for r0 in range(0, n, step):
+            if progress:
+                progress(r0, n)
+            r1 = min(r0 + step, n)
+            found_i, found_j, found_score = [], [], []
+            for c0 in range(r0, n, step):
+                c1 = min(c0 + step, n)
+                similarity = self._score_tile(r0, r1, c0, c1)
+
+                # the pairs the other modes would score, counted filter by filter
+                candidates = np.triu(np.ones(similarity.shape, dtype=bool), k=1) if c0 == r0 \
+                    else np.ones(similarity.shape, dtype=bool)
+                pairs = int(candidates.sum())
+                row_classes = self.class_ids[r0:r1, None]
+                col_classes = self.class_ids[None, c0:c1]
+                candidates &= (row_classes == -1) | (col_classes == -1) | (row_classes == col_classes)
+                compatible = int(candidates.sum())
+                if counts is not None:
+                    counts['pairs_skipped_class'] += pairs - compatible
+                if self.file_ids is not None:
+                    candidates &= self.file_ids[r0:r1, None] != self.file_ids[None, c0:c1]
+                    if counts is not None:
+                        counts['pairs_skipped_same_file'] += compatible - int(candidates.sum())
+                if counts is not None:
+                    counts['pairs_considered'] += int(candidates.sum())
+                    counts['pairs_skipped_wrapper'] += int(
+                        (candidates & self.wrappers[r0:r1, None] & self.wrappers[None, c0:c1]).sum())
+
+                i, j = np.nonzero(candidates & (similarity > threshold))
+                found_i.append(i + r0)
+                found_j.append(j + c0)
+                found_score.append(similarity[i, j])
+
+            i, j, score = np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_score)
+            for k in np.lexsort((j, i)):
+                yield int(i[k]), int(j[k]), float(score[k])
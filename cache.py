@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+from detector import FunctionFingerprint
+from function_table import FunctionTable
+from similarity_index import SimilarityIndex
+
+TOOL_VERSION = "1.4"  # bump whenever extraction or fingerprinting changes what gets stored
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "codesniffer", "analysis.sqlite")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+TOUCH_INTERVAL = 600  # seconds; last_used is only rewritten on a hit when it is older than this
+# options that change what is stored; the detector thresholds never do, they are applied after loading
+KEYED_OPTIONS = ('clone_min_nodes', 'similarity_floor', 'duplicate_mode', 'lsh_bands', 'lsh_rows')
+
+
+def _encode_functions(functions):
+    """Packs function records (without AST nodes) into a compressed JSON blob."""
+    rows = []
+    for fn in functions:
+        fp = fn['fingerprint']
+        rows.append([
+            fn['name'], fn['qualname'], fn['parameters'], fn['loc'], fn['class_name'], fn['is_async'], fn['nesting'],
+            fn['lineno'], fn['end_lineno'],
+            sorted(fp.structure), sorted(fp.operations), fp.node_count, fp.is_wrapper, list(fp.call_names),
+        ])
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode())
+
+
+def _decode_functions(blob):
+    functions = FunctionTable()
+    for name, qualname, parameters, loc, class_name, is_async, nesting, lineno, end_lineno, structure, operations, \
+            node_count, is_wrapper, call_names in json.loads(zlib.decompress(blob)):
+        functions.append({
+            'name': name,
+            'qualname': qualname,
+            'class_name': class_name,
+            'is_async': is_async,
+            'nesting': nesting,
+            'parameters': parameters,
+            'loc': loc,
+            'lineno': lineno,
+            'end_lineno': end_lineno,
+            'fingerprint': FunctionFingerprint(
+                structure=frozenset(structure),
+                operations=frozenset(operations),
+                node_count=node_count,
+                is_wrapper=is_wrapper,
+                call_names=tuple(call_names),
+            ),
+        })
+    return functions
+
+
+class AnalysisCache:
+    """Content-addressed SQLite cache of extracted function metadata and fingerprints.
+
+    Entries are keyed by the hash of the file content, TOOL_VERSION and the options that shape the
+    entry, so an unchanged file skips parsing, extraction and fingerprinting entirely, whatever
+    thresholds it is checked against. Similarity indexes and clone units are stored the same way. The total stored
+    size is bounded by max_bytes; evict() drops the least recently used entries first. Recency is
+    tracked to within TOUCH_INTERVAL, so most hits are pure reads. Several processes may share one
+    cache file."""
+
+    LOOKUP_COUNTERS = ('hits', 'misses', 'clone_hits', 'clone_misses', 'index_hits', 'index_misses')
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        # lookups made through this instance only: other processes sharing the file count their own
+        self.hits = 0  # function record lookups
+        self.misses = 0
+        self.clone_hits = 0
+        self.clone_misses = 0
+        self.index_hits = 0
+        self.index_misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(content, options=None):
+        """Key for the entry of content, the raw bytes of a file (str is encoded as UTF-8); options (see
+        KEYED_OPTIONS) tell apart entry kinds and their settings, anything else in options is ignored."""
+        keyed = {name: options[name] for name in KEYED_OPTIONS if name in (options or {})}
+        digest = hashlib.sha256()
+        digest.update(TOOL_VERSION.encode())
+        digest.update(json.dumps(keyed, sort_keys=True).encode())
+        digest.update(content if isinstance(content, bytes) else content.encode('utf-8', errors='surrogatepass'))
+        return digest.hexdigest()
+
+    def _load(self, key):
+        row = self.connection.execute("SELECT data, last_used FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        data, last_used = row
+        now = time.time()
+        if now - last_used > TOUCH_INTERVAL:
+            with self.connection:
+                self.connection.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+        return data
+
+    def _store(self, key, data):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+
+    def get(self, key):
+        """Returns the cached functions for key as a FunctionTable, or None on a miss."""
+        data = self._load(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _decode_functions(data)
+
+    def put(self, key, functions):
+        self._store(key, _encode_functions(functions))
+
+    def get_clone_units(self, key):
+        """Returns the cached clones.SubtreeHasher units for key (made with {'clone_min_nodes': n}), or None."""
+        data = self._load(key)
+        if data is None:
+            self.clone_misses += 1
+            return None
+        self.clone_hits += 1
+        return [tuple(unit) for unit in json.loads(zlib.decompress(data))]
+
+    def put_clone_units(self, key, units):
+        self._store(key, zlib.compress(json.dumps(units, separators=(',', ':')).encode()))
+
+    def get_similarity_index(self, key):
+        """Returns the cached SimilarityIndex for key (made with its similarity_floor and duplicate search
+        options), or None."""
+        data = self._load(key)
+        if data is None:
+            self.index_misses += 1
+            return None
+        self.index_hits += 1
+        return SimilarityIndex.from_bytes(zlib.decompress(data))
+
+    def put_similarity_index(self, key, index):
+        self._store(key, zlib.compress(index.to_bytes()))
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in max_bytes. Returns the number removed."""
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        with self.connection:
+            for key, size in self.connection.execute(
+                    "SELECT key, size FROM entries ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        return removed
+
+    def lookups(self):
+        """This instance's LOOKUP_COUNTERS so far, by name."""
+        return {name: getattr(self, name) for name in self.LOOKUP_COUNTERS}
+
+    def stats(self):
+        entries, size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            'path': self.path,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'clone_hits': self.clone_hits,
+            'clone_misses': self.clone_misses,
+            'index_hits': self.index_hits,
+            'index_misses': self.index_misses,
+        }
+
+    def close(self):
+        self.connection.close()
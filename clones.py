@@ -0,0 +1,176 @@
+import ast
+import hashlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+# Unit tuples produced by SubtreeHasher.units(): a statement or a whole block (a statement list).
+NORM_HASH, EXACT_HASH, KIND, LINE, END_LINE, SIZE, PARENT = range(7)
+# identifier fields kept in the normalized hash: unlike a variable name, an attribute or method name
+# says what the code does (x.append(y) is no clone of x.pop(y))
+NORMALIZED_KEPT_FIELDS = {(ast.Attribute, 'attr')}
+
+
+def _digest(label, child_digests):
+    data = label.encode('utf-8', errors='surrogatepass') + b"".join(child_digests)
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+class SubtreeHasher:
+    """Merkle-style hashing of every AST subtree, computed bottom-up in one pass.
+
+    Each node gets two hashes built from its type, its field layout and its children's hashes:
+    a normalized one that ignores variable names and literal values (so renamed or re-parameterized
+    copies collide, see NORMALIZED_KEPT_FIELDS for what it keeps) and an exact one that includes them.
+    Statements and whole blocks (every statement list of two or more statements: a body, an else
+    branch, ...) with at least min_nodes nodes are recorded as clone units; shorter runs of statements
+    inside a block are not."""
+
+    def __init__(self, min_nodes=10):
+        self.min_nodes = min_nodes
+        self._leaf_digests = {}  # field-less nodes (contexts, operators) hash the same everywhere
+
+    def units(self, tree):
+        """Returns the clone units of a parsed module as a list of tuples
+        (norm_hash, exact_hash, kind, line, end_line, size, parent) where kind is 'stmt' or 'block'
+        and parent is the index of the enclosing recorded unit, or -1."""
+        units = []
+        self._visit(tree, units)
+        return [tuple(unit) for unit in units]
+
+    def _record(self, units, kind, norm, exact, line, end_line, size, children):
+        index = len(units)
+        units.append([int.from_bytes(norm, 'big'), int.from_bytes(exact, 'big'), kind, line, end_line, size, -1])
+        for child in children:
+            units[child][PARENT] = index
+        return [index]
+
+    def _visit(self, node, units):
+        """Returns (norm_digest, exact_digest, size, unparented_unit_indices) for node's subtree."""
+        if not node._fields:
+            digest = self._leaf_digests.get(type(node))
+            if digest is None:
+                digest = self._leaf_digests[type(node)] = _digest(type(node).__name__, ())
+            return digest, digest, 1, []
+
+        type_name = type(node).__name__
+        norm_parts, exact_parts, digests_norm, digests_exact = [type_name], [type_name], [], []
+        size = 1
+        pending = []
+
+        for name in node._fields:
+            value = getattr(node, name, None)
+            if isinstance(value, ast.AST):
+                norm, exact, child_size, child_units = self._visit(value, units)
+                norm_parts.append(name)
+                exact_parts.append(name)
+                digests_norm.append(norm)
+                digests_exact.append(exact)
+                size += child_size
+                pending += child_units
+            elif isinstance(value, list):
+                norm, exact, child_size, child_units = self._visit_list(value, units)
+                norm_parts.append(f"{name}[]")
+                exact_parts.append(f"{name}[]")
+                digests_norm.append(norm)
+                digests_exact.append(exact)
+                size += child_size
+                pending += child_units
+            else:
+                # identifiers and literals only make it into the exact hash
+                if (type(node), name) in NORMALIZED_KEPT_FIELDS:
+                    norm_parts.append(f"{name}={value!r}")
+                else:
+                    norm_parts.append(name if value is not None else f"{name}=None")
+                exact_parts.append(f"{name}={value!r}")
+
+        norm = _digest("|".join(norm_parts), digests_norm)
+        exact = _digest("|".join(exact_parts), digests_exact)
+        if isinstance(node, ast.stmt) and size >= self.min_nodes:
+            pending = self._record(units, 'stmt', norm, exact, node.lineno, node.end_lineno, size, pending)
+        return norm, exact, size, pending
+
+    def _visit_list(self, values, units):
+        digests_norm, digests_exact, size, pending = [], [], 0, []
+        labels_norm, labels_exact = ["list"], ["list"]
+        for value in values:
+            if isinstance(value, ast.AST):
+                norm, exact, child_size, child_units = self._visit(value, units)
+                digests_norm.append(norm)
+                digests_exact.append(exact)
+                size += child_size
+                pending += child_units
+            else:  # e.g. the names of a global statement
+                labels_norm.append("value")
+                labels_exact.append(repr(value))
+
+        norm = _digest("|".join(labels_norm), digests_norm)
+        exact = _digest("|".join(labels_exact), digests_exact)
+        is_block = len(values) >= 2 and all(isinstance(value, ast.stmt) for value in values)
+        if is_block and size >= self.min_nodes:
+            pending = self._record(units, 'block', _digest("block", [norm]), _digest("block", [exact]),
+                                   values[0].lineno, values[-1].end_lineno, size, pending)
+        return norm, exact, size, pending
+
+
+@dataclass
+class CloneGroup:
+    """Two or more code fragments with the same normalized subtree hash.
+    kind is 'exact' when the fragments are also identical, 'parameterized' when only identifiers
+    or literals differ. members are (file_path, unit_kind, line, end_line)."""
+    kind: str
+    size: int
+    members: list = field(default_factory=list)
+
+    def to_dict(self):
+        return {'kind': self.kind, 'size': self.size,
+                'members': [{'file_path': f, 'unit': u, 'line': line, 'end_line': end} for f, u, line, end in
+                            self.members]}
+
+
+class CloneIndex:
+    """Hash table of clone units across any number of files; building it and finding every clone
+    group is linear in the number of units."""
+
+    def __init__(self):
+        self.files = []
+        self.units = []  # (file_id, unit tuple)
+        self.parents = []  # global index of the enclosing unit, or -1
+        self.by_hash = defaultdict(list)
+
+    def add(self, file_path, units):
+        file_id = len(self.files)
+        self.files.append(file_path)
+        offset = len(self.units)
+        for unit in units:
+            self.by_hash[unit[NORM_HASH]].append(len(self.units))
+            self.units.append((file_id, unit))
+            self.parents.append(unit[PARENT] + offset if unit[PARENT] >= 0 else -1)
+
+    def _is_cloned(self, index):
+        return index >= 0 and len(self.by_hash[self.units[index][1][NORM_HASH]]) > 1
+
+    def groups(self):
+        """Returns the clone groups, largest first. A group is dropped when every member sits
+        inside a unit that is itself cloned, since the enclosing group already reports it."""
+        groups = []
+        for members in self.by_hash.values():
+            if len(members) < 2 or all(self._is_cloned(self.parents[m]) for m in members):
+                continue
+            units = [self.units[m] for m in members]
+            exact_hashes = {unit[EXACT_HASH] for _, unit in units}
+            groups.append(CloneGroup(
+                kind='exact' if len(exact_hashes) == 1 else 'parameterized',
+                size=units[0][1][SIZE],
+                members=sorted((self.files[file_id], unit[KIND], unit[LINE], unit[END_LINE]) for file_id, unit in units),
+            ))
+        groups.sort(key=lambda group: (-group.size, group.members[0]))
+        return groups
+
+
+def find_clones(trees, min_nodes=10):
+    """Convenience wrapper: trees is an iterable of (file_path, ast tree); returns the clone groups."""
+    hasher = SubtreeHasher(min_nodes)
+    index = CloneIndex()
+    for file_path, tree in trees:
+        index.add(file_path, hasher.units(tree))
+    return index.groups()
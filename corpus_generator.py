@@ -0,0 +1,147 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import textwrap
+
+# Statement templates: {v} a local variable, {p} a parameter, {n} a number, {f} a called function,
+# {op} a binary operator and {cmp} a comparison (both part of a function's structure).
+STATEMENT_TEMPLATES = [
+    "{v} = {p} {op} {n}",
+    "{v} = {p} {op} {n} - {n}",
+    "{v} = [x {op} {n} for x in range({n})]",
+    "{v} = {{'key': {p}, 'size': {n}}}",
+    "{v} = not {p}",
+    "{v} = {p}[{n}:]",
+    "{v} = {f}({p})",
+    "{v} = {f}({p}, {n})",
+    "{v} = {f}({v}, {p})",
+    "{f}({v})",
+    "{v} = str({p}).strip()",
+    "{v} = lambda x: x {op} {n}",
+    "assert {p} is not None",
+    "if {p} {cmp} {n}:\n    {v} = {p} {op} {n}\nelse:\n    {v} = {n}",
+    "for i in range({n}):\n    {v} = i {op} {n}",
+    "while {p} {cmp} {n}:\n    {p} {op}= 1",
+    "try:\n    {v} = int({p})\nexcept ValueError:\n    {v} = 0",
+    "with open('{v}.txt') as handle:\n    {v} = handle.read()",
+    "{v} = sum({p} for _ in range({n})) if {p} else -{n}",
+]
+CALL_TEMPLATES = [template for template in STATEMENT_TEMPLATES if '{f}' in template]
+# called names are part of a function's structure: a realistic spread of them keeps unrelated functions apart
+CALL_NAMES = [f"{verb}_{noun}" for verb, noun in itertools.product(
+    ['load', 'save', 'parse', 'render', 'check', 'build', 'merge', 'split', 'fetch', 'store'],
+    ['user', 'order', 'item', 'config', 'report', 'token', 'record', 'event', 'cache', 'file'])]
+OPERATORS = ['+', '-', '*', '/', '//', '%', '**', '<<', '>>', '|', '&', '^']
+COMPARISONS = ['<', '>', '<=', '>=', '==', '!=']
+MIN_CALLS = 3  # calls per body; a single call would make a wrapper, which the detector never pairs
+
+
+class CorpusGenerator:
+    """Writes synthetic Python modules with controlled function counts, body sizes and parameter
+    counts, plus planted clusters of structural duplicates (same body, renamed identifiers).
+    Every body calls at least MIN_CALLS functions from a wide CALL_NAMES vocabulary and draws operators
+    at random, as real code would: random bodies then rarely look alike, so the planted clusters stand out.
+    The manifest returned by generate() lists every planted cluster by function name."""
+
+    def __init__(self, modules=10, functions_per_module=50, statements=(2, 8), params=(0, 6),
+                 duplicate_clusters=10, cluster_size=3, seed=0):
+        self.modules = modules
+        self.functions_per_module = functions_per_module
+        self.statements = statements
+        self.params = params
+        self.duplicate_clusters = duplicate_clusters
+        self.cluster_size = cluster_size
+        self.rng = random.Random(seed)
+
+    def _statement(self, templates=STATEMENT_TEMPLATES):
+        return (self.rng.choice(templates), self.rng.randint(1, 99), self.rng.choice(CALL_NAMES),
+                self.rng.choice(OPERATORS), self.rng.choice(COMPARISONS))
+
+    def _body_template(self, min_calls=MIN_CALLS):
+        """A function body as a list of (template, number, call_name, operator, comparison) choices,
+        independent of names, with call statements added until at least min_calls of them call a
+        CALL_NAMES function."""
+        body = [self._statement() for _ in range(self.rng.randint(*self.statements))]
+        while sum('{f}' in statement[0] for statement in body) < min_calls:
+            body.insert(self.rng.randint(0, len(body)), self._statement(CALL_TEMPLATES))
+        return body
+
+    def _render(self, name, param_count, body, naming_seed):
+        rng = random.Random(naming_seed)
+        prefix = rng.choice(['val', 'item', 'tmp', 'res', 'acc'])
+        params = [f"{prefix}_arg{i}" for i in range(param_count)] or [f"{prefix}_arg"]
+        local = f"{prefix}_out"
+        lines = [f"def {name}({', '.join(params) if param_count else ''}):"]
+        if not param_count:
+            lines.append(f"    {params[0]} = {rng.randint(1, 9)}")
+        lines.append(f"    {local} = None")
+        for k, (template, number, call_name, operator, comparison) in enumerate(body):
+            statement = template.format(v=local, p=params[k % len(params)], n=number, f=call_name, op=operator,
+                                        cmp=comparison)
+            lines.append(textwrap.indent(statement, "    "))
+        lines.append(f"    return {local}")
+        return "\n".join(lines) + "\n"
+
+    def generate(self, out_dir):
+        """Writes the modules into out_dir and returns the manifest (also saved as manifest.json)."""
+        os.makedirs(out_dir, exist_ok=True)
+        slots = [(m, k) for m in range(self.modules) for k in range(self.functions_per_module)]
+        self.rng.shuffle(slots)
+
+        planted = {}
+        clusters = []
+        for c in range(min(self.duplicate_clusters, len(slots) // max(self.cluster_size, 1))):
+            body = self._body_template()
+            param_count = self.rng.randint(*self.params)
+            members = []
+            for _ in range(self.cluster_size):
+                slot = slots.pop()
+                planted[slot] = (body, param_count)
+                members.append(f"fn_m{slot[0]}_{slot[1]}")
+            clusters.append(members)
+
+        files = []
+        for m in range(self.modules):
+            chunks = []
+            for k in range(self.functions_per_module):
+                body, param_count = planted.get((m, k)) or (self._body_template(), self.rng.randint(*self.params))
+                chunks.append(self._render(f"fn_m{m}_{k}", param_count, body, self.rng.random()))
+            path = os.path.join(out_dir, f"module_{m}.py")
+            with open(path, 'w') as file:
+                file.write("\n\n".join(chunks))
+            files.append(path)
+
+        manifest = {
+            'files': files,
+            'functions': self.modules * self.functions_per_module,
+            'duplicate_clusters': clusters,
+        }
+        with open(os.path.join(out_dir, 'manifest.json'), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Python corpus for benchmarks.")
+    parser.add_argument('out_dir')
+    parser.add_argument('--modules', type=int, default=10)
+    parser.add_argument('--functions', type=int, default=50, help="functions per module")
+    parser.add_argument('--min-statements', type=int, default=2)
+    parser.add_argument('--max-statements', type=int, default=8)
+    parser.add_argument('--max-params', type=int, default=6)
+    parser.add_argument('--clusters', type=int, default=10, help="planted duplicate clusters")
+    parser.add_argument('--cluster-size', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    manifest = CorpusGenerator(
+        modules=args.modules, functions_per_module=args.functions,
+        statements=(args.min_statements, args.max_statements), params=(0, args.max_params),
+        duplicate_clusters=args.clusters, cluster_size=args.cluster_size, seed=args.seed,
+    ).generate(args.out_dir)
+    print(f"Wrote {len(manifest['files'])} modules with {manifest['functions']} functions to {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
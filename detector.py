@@ -1,19 +1,79 @@
 import ast
-import openai
 import json
 import os
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from heapq import merge
+from bitset import BitsetSimilarityEngine
+from llm_client import AsyncOpenAIClient, BackgroundLoop, OpenAITransport, ResponseCache
+from metrics import NULL_METRICS, logger
+from minhash import LSHIndex, MinHasher
+from semantic import FileFunctions, semantic_candidates, splice_functions, token_batches
+from similarity_index import DEFAULT_FLOOR, SimilarityIndex
+
+
+STRUCTURE_IGNORED_NODES = {ast.Load, ast.Store, ast.Expr, ast.arguments, ast.arg, ast.Attribute}
+COUNT_IGNORED_NODES = (ast.Load, ast.Store, ast.arguments, ast.arg)
+OPERATION_NODES = (ast.BinOp, ast.UnaryOp, ast.Compare)
+
+
+@dataclass(frozen=True, slots=True)
+class FunctionFingerprint:
+    """Immutable summary of a function's AST, built in a single walk by ASTAnalyzer.fingerprint.
+    All pairwise comparisons work on these records instead of re-walking the ASTs."""
+    structure: frozenset
+    operations: frozenset
+    node_count: int
+    is_wrapper: bool
+    call_names: tuple
 
 
 class ASTAnalyzer:
     """Handles AST-based analysis for function structure and operations."""
+    @staticmethod
+    def fingerprint(node):
+        """Collects structure, unique operations, node count, wrapper flag and called names in one ast.walk."""
+        structure = set()
+        operations = set()
+        call_names = set()
+        node_count = 0
+        calls = 0
+        wrapper_call = None
+
+        for n in ast.walk(node):
+            node_type = type(n)
+            if not isinstance(n, COUNT_IGNORED_NODES):
+                node_count += 1
+            if isinstance(n, OPERATION_NODES):
+                operations.add(node_type.__name__)
+
+            if isinstance(n, ast.Call):
+                calls += 1
+                wrapper_call = n
+                if isinstance(n.func, ast.Name):
+                    call_names.add(n.func.id)
+                    structure.add(f"CALL_{n.func.id}")  # Normalize function calls
+                    continue
+
+            if node_type not in STRUCTURE_IGNORED_NODES:
+                structure.add(node_type.__name__)
+
+        return FunctionFingerprint(
+            structure=frozenset(structure),
+            operations=frozenset(operations),
+            node_count=node_count,
+            is_wrapper=calls == 1 and isinstance(wrapper_call.func, ast.Name),
+            call_names=tuple(sorted(call_names)),
+        )
+
     @staticmethod
     def get_function_ast_structure(node):
         """Extracts a set representing the AST structure while ignoring trivial elements."""
-        ignore_nodes = {ast.Load, ast.Store, ast.Expr, ast.arguments, ast.arg, ast.Attribute}
         structure = set()
 
         for n in ast.walk(node):
-            if type(n) in ignore_nodes:
+            if type(n) in STRUCTURE_IGNORED_NODES:
                 continue
 
             if isinstance(n, ast.Call) and isinstance(n.func, ast.Name):
@@ -25,15 +85,14 @@ class ASTAnalyzer:
     @staticmethod
     def count_ast_nodes(node):
         """Counts the number of AST nodes in a function, excluding trivial ones."""
-        ignore_nodes = (ast.Load, ast.Store, ast.arguments, ast.arg)
-        return sum(1 for n in ast.walk(node) if not isinstance(n, ignore_nodes))
+        return sum(1 for n in ast.walk(node) if not isinstance(n, COUNT_IGNORED_NODES))
 
     @staticmethod
     def extract_unique_operations(ast_node):
         """Gathers unique operations (e.g: BinOp, Compare) from a function AST."""
         ops = set()
         for node in ast.walk(ast_node):
-            if isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Compare)):
+            if isinstance(node, OPERATION_NODES):
                 ops.add(type(node).__name__)
         return ops
 
@@ -43,7 +102,11 @@ class ASTAnalyzer:
 
         unique_ops1 = ASTAnalyzer.extract_unique_operations(ast1)
         unique_ops2 = ASTAnalyzer.extract_unique_operations(ast2)
+        return ASTAnalyzer.operation_penalty(unique_ops1, unique_ops2)
 
+    @staticmethod
+    def operation_penalty(unique_ops1, unique_ops2):
+        """Penalty for two already extracted sets of unique operations."""
         uncommon_ops = unique_ops1.symmetric_difference(unique_ops2)
         penalty = len(uncommon_ops) * 0.05
         return min(penalty, 0.5)  # Cap the penalty at 0.5
@@ -57,118 +120,319 @@ def jaccard_similarity(set1, set2):
     return intersection / union if union else 0
 
 
-def is_wrapper_function(ast_node):
-    """Identifies if a function is a wrapper (e.g. Adapter Pattern).
-    We assume it's a wrapper if it has exactly one function call and no other logic."""
-
-    calls = [node for node in ast.walk(ast_node) if isinstance(node, ast.Call)]
-    if len(calls) == 1:
-        call_node = calls[0]
-        return isinstance(call_node.func, ast.Name)
-    return False
+def fingerprint_similarity(fingerprint1, fingerprint2):
+    """Duplicate score of two FunctionFingerprints: Jaccard similarity of their structures minus the
+    unique-operation penalty, and 0 when both are simple wrappers."""
+    if fingerprint1.is_wrapper and fingerprint2.is_wrapper:
+        return 0
+    similarity = jaccard_similarity(fingerprint1.structure, fingerprint2.structure)
+    penalty = ASTAnalyzer.operation_penalty(fingerprint1.operations, fingerprint2.operations)
+    return max(similarity - penalty, 0)
 
 
 class CodeSmellDetector:
     """Detects code smells:
     - Long functions (over MAX_LOC lines)
     - Excessive function parameters (over MAX_PARAMS)
-    - Duplicate code (using AST-based Jaccard similarity)"""
-
-    def __init__(self, functions, MAX_LOC=15, MAX_PARAMS=3, SIMILARITY_THRESHOLD=0.75, min_complexity_threshold=2):
+    - Duplicate code (using AST-based Jaccard similarity)
+
+    Methods of two different classes are never compared; candidate pairs are generated per class
+    bucket (plus module-level functions against everything) rather than filtered afterwards. A class
+    is told apart by its name and its record's 'file_path', if any, so same-named classes of
+    different files stay different. With cross_file_only, pairs of functions with the same
+    'file_path' are not generated either (the cross-shard merge of shards.py).
+    duplicate_mode picks how candidate pairs are generated:
+    - 'exact': every such pair is compared (the reference result)
+    - 'lsh': only pairs colliding in a MinHash/LSH index are compared; lsh_bands and lsh_rows
+      trade recall for speed (see minhash.LSHIndex)
+    - 'bitset': every pair, scored in NumPy tiles (see bitset.BitsetSimilarityEngine, needs numpy)
+
+    Pass a metrics.Metrics to time the fingerprint_lookup/pair_generation/similarity stages and count pairs."""
+    DUPLICATE_MODES = ('exact', 'lsh', 'bitset')
+    DEFAULT_SIMILARITY_THRESHOLD = 0.75
+
+    def __init__(self, functions, MAX_LOC=15, MAX_PARAMS=3, SIMILARITY_THRESHOLD=DEFAULT_SIMILARITY_THRESHOLD,
+                 min_complexity_threshold=2,
+                 duplicate_mode='exact', lsh_bands=16, lsh_rows=4, cross_file_only=False, metrics=NULL_METRICS):
+        if duplicate_mode not in self.DUPLICATE_MODES:
+            raise ValueError(f"Unknown duplicate_mode {duplicate_mode!r}, expected one of {self.DUPLICATE_MODES}")
         self.functions = functions
         self.MAX_LOC = MAX_LOC
         self.MAX_PARAMS = MAX_PARAMS
         self.SIMILARITY_THRESHOLD = SIMILARITY_THRESHOLD
         self.MIN_COMPLEXITY_THRESHOLD = min_complexity_threshold  # Minimum AST nodes to consider a function non-trivial
+        self.duplicate_mode = duplicate_mode
+        self.lsh_bands = lsh_bands
+        self.lsh_rows = lsh_rows
+        self.cross_file_only = cross_file_only
+        self.metrics = metrics
 
     def detect_code_smells(self):
         """Returns a dictionary containing: 'long_functions' and 'excess_parameters'"""
-        return {
-            'long_functions': self._detect_threshold_exceeding('loc', self.MAX_LOC),
-            'excess_parameters': self._detect_threshold_exceeding('parameters', self.MAX_PARAMS),
-        }
-
-    def _detect_threshold_exceeding(self, key, threshold):
-        """Generic helper that checks if a function's attribute (like LOC or param count) exceeds a threshold."""
-        return [
-            fn for fn in self.functions
-            if (len(fn[key]) if isinstance(fn[key], list) else fn[key]) > threshold
-        ]   # loc could be an int, while parameters could be a list.
+        smells = {'long_functions': [], 'excess_parameters': []}
+        for kind, fn in self.iter_code_smells():
+            smells[kind].append(fn)
+        return smells
+
+    def iter_code_smells(self):
+        """Yields ('long_functions' | 'excess_parameters', function) in a single pass over the functions.
+        A function_table.FunctionTable is checked column by column, building records only for the
+        functions reported."""
+        functions = self.functions
+        if hasattr(functions, 'param_count'):
+            for i in range(len(functions)):
+                is_long, has_excess = functions.loc[i] > self.MAX_LOC, functions.param_count(i) > self.MAX_PARAMS
+                if is_long or has_excess:
+                    fn = functions[i]
+                    if is_long:
+                        yield 'long_functions', fn
+                    if has_excess:
+                        yield 'excess_parameters', fn
+            return
+        for fn in functions:
+            if self._exceeds(fn, 'loc', self.MAX_LOC):
+                yield 'long_functions', fn
+            if self._exceeds(fn, 'parameters', self.MAX_PARAMS):
+                yield 'excess_parameters', fn
+
+    @staticmethod
+    def _exceeds(fn, key, threshold):
+        # loc could be an int, while parameters could be a list.
+        return (len(fn[key]) if isinstance(fn[key], list) else fn[key]) > threshold
 
     def duplicate_code_detector(self):
         """Detects structurally duplicate functions using Jaccard similarity, ignoring trivial wrappers
         and penalizing unique operations."""
-        function_structures = self._get_function_structures()
-        duplicates = []
-
-        for i in range(len(function_structures)):
-            for j in range(i + 1, len(function_structures)):
+        return list(self.iter_duplicates())
+
+    def iter_duplicates(self, progress=None):
+        """Yields (function1, function2, similarity) duplicates as soon as they are found.
+        progress, if given, is called as progress(done, total) while the search advances through
+        the functions; it may raise to abort the search."""
+        for fn1, fn2, similarity in self.iter_duplicate_records(progress):
+            yield fn1['name'], fn2['name'], similarity
+
+    def iter_duplicate_records(self, progress=None):
+        """Like iter_duplicates, but yields the full function records instead of their names."""
+        with self.metrics.stage('fingerprint_lookup'):
+            function_structures = self._get_function_structures()
+        scored = self._scored_pairs(function_structures, progress)
+        for i, j, similarity in self.metrics.timed('similarity', scored):
+            self.metrics.incr('duplicates')
+            yield function_structures[i][4], function_structures[j][4], round(similarity, 2)
+        if progress:
+            progress(len(function_structures), len(function_structures))
+
+    def iter_indexed_duplicates(self, index):
+        """Like iter_duplicate_records, but answered from a SimilarityIndex built over the same functions
+        (see build_similarity_index) under the current thresholds, without scoring any pair."""
+        records = {}  # each function's record is built once, however many pairs it is in
+        for i, j, similarity in index.query(self.SIMILARITY_THRESHOLD, self.MIN_COMPLEXITY_THRESHOLD):
+            self.metrics.incr('duplicates')
+            for k in (i, j):
+                if k not in records:
+                    records[k] = self.functions[k]
+            yield records[i], records[j], similarity
+
+    def build_similarity_index(self, floor=DEFAULT_FLOOR, progress=None, on_duplicate=None):
+        """Scores the candidate pairs once and keeps every score above floor in a SimilarityIndex,
+        so other SIMILARITY_THRESHOLD / min_complexity_threshold values can be answered without
+        rescoring. Pairs are indexed by position in self.functions. on_duplicate(fn1, fn2, similarity),
+        if given, is called for each duplicate under the current thresholds as soon as it is found."""
+        with self.metrics.stage('fingerprint_lookup'):
+            function_structures = self._get_function_structures(min_complexity=0)
+        node_counts = [0] * len(self.functions)
+        for data in function_structures:
+            node_counts[data[5]] = data[3].node_count
+        index = SimilarityIndex(node_counts, floor)
+        scored = self._scored_pairs(function_structures, progress, threshold=floor)
+        for i, j, similarity in self.metrics.timed('similarity', scored):
+            data1, data2 = function_structures[i], function_structures[j]
+            index.add(data1[5], data2[5], similarity)
+            if on_duplicate and similarity > self.SIMILARITY_THRESHOLD and \
+                    min(data1[3].node_count, data2[3].node_count) > self.MIN_COMPLEXITY_THRESHOLD:
+                self.metrics.incr('duplicates')
+                on_duplicate(data1[4], data2[4], round(similarity, 2))
+        if progress:
+            progress(len(function_structures), len(function_structures))
+        return index
+
+    def _scored_pairs(self, function_structures, progress=None, threshold=None):
+        """Returns an iterator of (i, j, similarity) for every pair above threshold (default
+        SIMILARITY_THRESHOLD). Candidate generation (the pair_generation stage) runs right away, the
+        scoring only as the iterator is consumed, so the two are timed apart."""
+        threshold = self.SIMILARITY_THRESHOLD if threshold is None else threshold
+        if self.duplicate_mode == 'bitset':
+            return self._bitset_scored_pairs(function_structures, progress, threshold)
+        candidates = self._candidate_pairs(function_structures)
+        return self._score_candidates(function_structures, candidates, progress, threshold)
+
+    def _bitset_scored_pairs(self, function_structures, progress, threshold):
+        engine = BitsetSimilarityEngine([data[3] for data in function_structures],
+                                        [data[2] for data in function_structures],
+                                        files=self._files(function_structures))
+        counts = Counter()  # reported once, like _score_candidates does
+        try:
+            yield from engine.iter_pairs(threshold, counts, progress)
+        finally:
+            for name, count in counts.items():
+                self.metrics.incr(name, count)
+
+    def _score_candidates(self, function_structures, candidates, progress, threshold):
+        total = len(function_structures)
+        # counted locally and reported once, so the hot loop pays nothing for instrumentation
+        considered = skipped_wrapper = 0
+        current_row = -1
+        try:
+            for i, j in candidates:
+                if progress and i != current_row:
+                    current_row = i
+                    progress(i, total)
+                considered += 1
                 func1_data, func2_data = function_structures[i], function_structures[j]
-
-                # If both belong to different classes, skip as we only compare functions within the same class.
-                if func1_data[2] and func2_data[2] and (func1_data[2] != func2_data[2]):
-                    continue
+                if func1_data[3].is_wrapper and func2_data[3].is_wrapper:
+                    skipped_wrapper += 1
 
                 similarity = self._compute_function_similarity(func1_data, func2_data)
-                if similarity > self.SIMILARITY_THRESHOLD:
-                    duplicates.append((func1_data[0], func2_data[0], round(similarity, 2)))
-        return duplicates
-
-    def _get_function_structures(self):
-        """Gathers (function_name, set_of_ast_structures, class_name, ast_node) for each function
-        that exceeds the min complexity threshold."""
+                if similarity > threshold:
+                    yield i, j, similarity
+        finally:
+            self.metrics.incr('pairs_considered', considered)
+            self.metrics.incr('pairs_skipped_wrapper', skipped_wrapper)
+
+    def _candidate_pairs(self, function_structures):
+        """Returns the index pairs (i, j), i < j, in order, to verify with the exact similarity: a lazy
+        iterator in exact mode, the LSH collisions (built right away) in lsh mode.
+        Pairs of methods from two different classes are never generated; their number is counted
+        as pairs_skipped_class (and pairs within one file, with cross_file_only, as pairs_skipped_same_file)."""
+        classes = [data[2] for data in function_structures]
+        files = self._files(function_structures)
+        if self.duplicate_mode == 'exact':
+            return self.metrics.timed('pair_generation', self._class_compatible_pairs(classes, files))
+
+        with self.metrics.stage('pair_generation'):
+            hasher = MinHasher(num_perm=self.lsh_bands * self.lsh_rows)
+            index = LSHIndex(bands=self.lsh_bands, rows=self.lsh_rows)
+            for i, func_data in enumerate(function_structures):
+                index.insert(i, hasher.signature(func_data[1]))
+            collisions = index.candidate_pairs()
+            compatible = [(i, j) for i, j in collisions
+                          if classes[i] is None or classes[j] is None or classes[i] == classes[j]]
+            candidates = sorted((i, j) for i, j in compatible if files is None or files[i] != files[j])
+        self.metrics.incr('pairs_skipped_class', len(collisions) - len(compatible))
+        self.metrics.incr('pairs_skipped_same_file', len(compatible) - len(candidates))
+        return candidates
+
+    def _files(self, function_structures):
+        """Each function's 'file_path' with cross_file_only, else None (every pair is generated)."""
+        return [data[4].get('file_path') for data in function_structures] if self.cross_file_only else None
+
+    def _class_compatible_pairs(self, classes, files=None):
+        n = len(classes)
+        buckets = defaultdict(list)  # class key -> ascending indices, None holds module-level functions
+        for i, class_name in enumerate(classes):
+            buckets[class_name].append(i)
+        module_level = buckets[None]
+        self.metrics.incr('pairs_skipped_class', n * (n - 1) // 2 - _compatible_pair_count(classes))
+
+        # run_ends[i]: where the run of consecutive functions of i's file ends, which is all of the file
+        # when functions come file by file; the pairs with the rest of that run are skipped wholesale
+        run_ends = list(range(1, n + 1))
+        if files is not None:
+            file_classes = defaultdict(list)
+            for file, class_name in zip(files, classes):
+                file_classes[file].append(class_name)
+            self.metrics.incr('pairs_skipped_same_file',
+                              sum(_compatible_pair_count(members) for members in file_classes.values()))
+            for i in range(n - 2, -1, -1):
+                if files[i] == files[i + 1]:
+                    run_ends[i] = run_ends[i + 1]
+
+        for i, class_name in enumerate(classes):
+            start = run_ends[i]
+            if class_name is None:
+                later = range(start, n)
+            else:
+                same_class = buckets[class_name]
+                later = merge(same_class[bisect_left(same_class, start):],
+                              module_level[bisect_left(module_level, start):])
+            for j in later:
+                if files is None or files[j] != files[i]:
+                    yield i, j
+
+    def _get_function_structures(self, min_complexity=None):
+        """Gathers (function_name, set_of_ast_structures, class_key, fingerprint, function, position) for
+        each function that exceeds the min complexity threshold (min_complexity_threshold unless given).
+        class_key is None for module-level functions, else (the record's 'file_path', class_name).
+        A precomputed 'fingerprint' is used when present, otherwise it is built from the function's 'node'."""
+        min_complexity = self.MIN_COMPLEXITY_THRESHOLD if min_complexity is None else min_complexity
         func_structs = []
-        for fn in self.functions:
-            node = fn.get('node')
-            if not node:
-                continue
+        for position, fn in enumerate(self.functions):
+            fingerprint = fn.get('fingerprint')
+            if fingerprint is None:
+                node = fn.get('node')
+                if not node:
+                    continue
+                fingerprint = ASTAnalyzer.fingerprint(node)
             # Only include non-trivial functions
-            if ASTAnalyzer.count_ast_nodes(node) > self.MIN_COMPLEXITY_THRESHOLD:
+            if fingerprint.node_count > min_complexity:
                 class_name = fn.get('class_name', None)
-                ast_structure = ASTAnalyzer.get_function_ast_structure(node)
-                func_structs.append((fn['name'], ast_structure, class_name, node))
+                class_key = None if class_name is None else (fn.get('file_path'), class_name)
+                func_structs.append((fn['name'], fingerprint.structure, class_key, fingerprint, fn, position))
         return func_structs
 
     def _compute_function_similarity(self, func1_data, func2_data):
         """Computes the similarity of two functions by combining Jaccard and an operation-based penalty.
         Ignores wrappers entirely by returning similarity=0 if both are wrappers."""
 
-        (_, struct1, _, ast1) = func1_data
-        (_, struct2, _, ast2) = func2_data
-
-        # If both are simple wrappers, consider them not duplicates
-        if is_wrapper_function(ast1) and is_wrapper_function(ast2):
-            print("They are wrappers!", ast1, ast2)
-            return 0
-
-        similarity = jaccard_similarity(struct1, struct2)
-
-        # Penalty for unique operations
-        penalty = ASTAnalyzer.compute_unique_operation_penalty(ast1, ast2)
-        return max(similarity - penalty, 0)
+        return fingerprint_similarity(func1_data[3], func2_data[3])
 
 
 class OpenAIClient:
-    """Refactors duplicated code using OpenAI GPT, optionally detecting semantic duplicates."""
+    """Refactors duplicated code using OpenAI GPT, optionally detecting semantic duplicates.
+    Requests go through one long-lived AsyncOpenAIClient (connection reuse, concurrency limit,
+    rate limiting, retries and a persistent response cache); create one instance and reuse it.
+    Time spent waiting on GPT is recorded as the 'llm' stage of metrics.
+    Only the functions concerned are sent, never the whole file, in prompts of at most
+    PROMPT_TOKEN_BUDGET estimated source tokens that run concurrently."""
     API_KEY = os.getenv('OPENAI_API_KEY')
+    PROMPT_TOKEN_BUDGET = 3000
+    MAX_SEMANTIC_CANDIDATES = 20  # pairs picked by the local prefilter per file
 
-    def __init__(self):
+    def __init__(self, transport=None, cache=True, metrics=NULL_METRICS, **client_options):
         try:
-            self.client = openai.OpenAI(api_key=self.API_KEY)
+            transport = transport if transport is not None else OpenAITransport(self.API_KEY)
+            response_cache = ResponseCache() if cache is True else cache or None
+            self.client = AsyncOpenAIClient(transport, cache=response_cache, metrics=metrics, **client_options)
         except Exception as e:
             raise RuntimeError(f"Failed to initialize OpenAI client: {str(e)}")
+        self.metrics = metrics
+        self.loop = BackgroundLoop()
 
-    def get_gpt_response(self, prompt):
-        """Sends a prompt to GPT and returns the response."""
+    def get_gpt_response(self, prompt, parse=None):
+        """Sends a prompt to GPT and returns the response, passed through parse if given, or None when the
+        request failed or parse rejected the answer (which is then not cached)."""
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1
-            )
-            return response.choices[0].message.content.strip()
+            with self.metrics.stage('llm'):
+                return self.loop.run(self.client.complete(prompt, parse=parse))
         except Exception as e:
-            return f"Unexpected Error: {str(e)}"
+            logger.warning("Unusable OpenAI response: %s", e)
+            return None
+
+    def get_gpt_json_responses(self, prompts):
+        """Sends several prompts concurrently and returns, in the same order, each response as a parsed
+        JSON object, or None when the request failed or the answer is not one; unusable answers are
+        never cached."""
+        with self.metrics.stage('llm'):
+            responses = self.loop.run(self.client.complete_many(prompts, parse=_json_object))
+        for response in responses:
+            if isinstance(response, Exception):
+                logger.warning("Unusable OpenAI response: %s", response)
+        return [None if isinstance(r, Exception) else r for r in responses]
+
+    def close(self):
+        self.loop.run(self.client.close())
+        self.loop.stop()
 
     def gpt_prompt(self):
         return """You are given a Python code snippet and a list of structural duplicate function pairs. 
@@ -181,37 +445,186 @@ class OpenAIClient:
                 The duplicate function pairs are: 
                 """
 
+    def function_prompt(self):
+        return """You are given Python functions from one file and the pairs among them that are structural duplicates.
+                Your task is to refactor only these functions to eliminate duplication while preserving the original functionality.
+                - In particular, for pairs of functions that return the same type of value, aim to create a single function that can serve both purposes by accepting an additional parameter to control the specific behavior,
+                and just the original functions to utilize this new function.
+                - Completely eliminate unnecessary wrapper functions that merely call the new function with predefined arguments.
+                - Ensure that the refactored code works exactly as the original and follows best practices in Python programming, avoiding new code smells.
+                - Each function is shown after a line "# function: <label>". Return only a JSON object, without markdown formatting or explanations:
+                {"functions": {"<label>": "<complete new source of that function, decorators included, or an empty string to delete it>"}, "helpers": "<source of new shared functions, or an empty string>"}
+                - Leave out functions that stay unchanged. Helpers are inserted right before the first function shown, at its indentation, so write them as methods when the functions shown are methods.
+                The duplicate function pairs are:
+                """
+
     def refactor_code(self, original_code, duplicates):
-        """Sends structurally duplicated functions to GPT for refactoring."""
+        """Sends structurally duplicated functions to GPT for refactoring. duplicates are (function1, function2,
+        similarity) with functions named by semantic.function_labels (a qualname, or a bare name that only one
+        function has). Only the duplicated functions are sent, one cluster of mutually duplicated functions
+        per prompt (clusters share a prompt while they fit the token budget), and the rewritten functions are
+        spliced back into original_code by line span; a prompt whose rewrite would leave code that does not
+        parse is dropped with a warning. Code that cannot be parsed is sent whole, as one prompt.
+        Returns the whole refactored code, or None when no rewrite could be applied."""
+        try:
+            functions = FileFunctions(original_code)
+        except SyntaxError:
+            return self._refactor_whole_file(original_code, duplicates)
+        clusters, pairs = _duplicate_clusters(functions, duplicates)
+        if not clusters:
+            return self._refactor_whole_file(original_code, duplicates)
+        labels = functions.labels
+        sources = {labels[i]: functions.source(i) for cluster in clusters for i in cluster}
+        batches = token_batches([[labels[i] for i in cluster] for cluster in clusters], sources,
+                                self.PROMPT_TOKEN_BUDGET)
+        prompts = []
+        for keys, _ in batches:
+            prompt = self.function_prompt()
+            for label1, label2, similarity in pairs:
+                if label1 in keys and label2 in keys:
+                    prompt += f"Function '{label1}' and '{label2}' having Jaccard Similarity: {similarity}. "
+            prompt += "\nFunctions:\n" + "\n\n".join(f"# function: {key}\n{sources[key]}" for key in keys)
+            prompts.append(prompt)
+
+        positions = {label: i for i, label in enumerate(labels)}
+        edits, refactored = [], original_code
+        for (keys, _), result in zip(batches, self.get_gpt_json_responses(prompts)):
+            if result is None:
+                logger.warning("Not refactoring %s", ", ".join(keys))
+                continue
+            batch_edits = []
+            for label, new_source in (result.get("functions") or {}).items():
+                if label in keys and isinstance(new_source, str):
+                    start, end = functions.spans[positions[label]]
+                    batch_edits.append((start, end, functions.indents[positions[label]], new_source))
+            helpers = result.get("helpers")
+            if isinstance(helpers, str) and helpers.strip():
+                first = min((positions[key] for key in keys), key=lambda i: functions.spans[i])
+                start = functions.spans[first][0]
+                batch_edits.append((start, start - 1, functions.indents[first], helpers))
+            candidate = splice_functions(functions.lines, edits + batch_edits)
+            try:
+                ast.parse(candidate)
+            except SyntaxError as e:
+                logger.warning("Not refactoring %s: the rewrite does not parse (%s)", ", ".join(keys), e)
+                continue
+            edits, refactored = edits + batch_edits, candidate
+        return refactored if edits else None
+
+    def _refactor_whole_file(self, original_code, duplicates):
         prompt = self.gpt_prompt()
 
         for func1, func2, similarity in duplicates:
             prompt += f"Function '{func1}' and '{func2}' having Jaccard Similarity: {similarity}. "
 
         prompt += "Original actual executable code:" + original_code
-        response = self.get_gpt_response(prompt)
-        return format_refactored_output(response)
-
-    def detect_semantic_duplicates(self, original_code):
-        """Detects semantic duplicates by analyzing the full code with GPT."""
+        return self.get_gpt_response(prompt, parse=_python_source)
 
-        prompt = f"""You are an expert software refactoring assistant. Analyze the given Python code and find functions that are **semantically the same** but implemented differently.
+    def semantic_prompt(self):
+        return """You are an expert software refactoring assistant. Below are Python functions from one file and candidate pairs among them. Decide for each candidate pair whether the two functions are **semantically the same** but implemented differently.
          - Two functions are considered semantically duplicate if they **achieve the same result** using different logic.
          - Ignore syntax differences like slicing vs loops, recursion vs iteration, or different variable names.
-         - Provide the output as a JSON object with the key "semantic_duplicates" containing a list of function pairs: {{"semantic_duplicates": [[function1, function2], ...]}}.
-         - If there are no semantic duplicates, return an empty list like this: {{"semantic_duplicates": []}}
+         - Each function is shown after a line "# function: <label>"; answer with these labels and only with candidate pairs.
+         - Provide the output as a JSON object with the key "semantic_duplicates" containing a list of function pairs: {"semantic_duplicates": [[function1, function2], ...]}.
+         - If there are no semantic duplicates, return an empty list like this: {"semantic_duplicates": []}
          - DO NOT include markdown formatting (no ``` or `json`).** Only return valid JSON, nothing else.
          - Do NOT include any explanation, only the JSON output.
-            Here is the code to analyze :
-            {original_code}"""
+            Candidate pairs:
+            """
 
+    def detect_semantic_duplicates(self, original_code):
+        """Detects semantic duplicates without sending the whole file: semantic.semantic_candidates picks
+        plausible pairs locally (same arity, compatible return shape, shared calls and data flow) and only
+        the candidate functions are sent, in token-budgeted prompts that run concurrently.
+        Returns [[function1, function2], ...] as before, functions named by qualname."""
         try:
-            response = self.get_gpt_response(prompt)
-            result = json.loads(response)
-            return result.get("semantic_duplicates", [])
-        except json.JSONDecodeError as e:
-            print("JSON decoding error:", {e})
+            functions = FileFunctions(original_code)
+        except SyntaxError as e:
+            logger.warning("Cannot look for semantic duplicates in code that does not parse: %s", e)
+            return []
+        candidates = semantic_candidates(functions.signatures, self.MAX_SEMANTIC_CANDIDATES)
+        self.metrics.incr('semantic_candidates', len(candidates))
+        if not candidates:
             return []
+        labels = functions.labels
+        pairs = [[labels[i], labels[j]] for i, j, _ in candidates]
+        sources = {label: functions.source(i) for i, label in enumerate(labels) if any(label in p for p in pairs)}
+        batches = token_batches(pairs, sources, self.PROMPT_TOKEN_BUDGET)
+        prompts = [self.semantic_prompt() + "".join(f"- {label1} / {label2}\n" for label1, label2 in batch_pairs)
+                   + "Functions:\n" + "\n\n".join(f"# function: {key}\n{sources[key]}" for key in keys)
+                   for keys, batch_pairs in batches]
+
+        duplicates = []
+        for (_, batch_pairs), result in zip(batches, self.get_gpt_json_responses(prompts)):
+            if result is None:
+                continue
+            asked = {frozenset(pair) for pair in batch_pairs}
+            for pair in result.get("semantic_duplicates") or []:
+                if isinstance(pair, list) and len(pair) == 2 and frozenset(pair) in asked and pair not in duplicates:
+                    duplicates.append(pair)
+        return duplicates
+
+
+def _compatible_pair_count(classes):
+    """Number of pairs among functions with these class keys that the class rule allows."""
+    counts = Counter(classes)
+    module_level = counts[None]
+    return sum(count * (count - 1) // 2 for count in counts.values()) + module_level * (len(classes) - module_level)
+
+
+def _duplicate_clusters(functions, duplicates):
+    """Groups the positions of the functions named in (name1, name2, similarity) duplicates (see
+    FileFunctions.positions_named) into connected clusters. Returns (clusters, [(label1, label2, similarity)])."""
+    parent = {}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    pairs = []
+    for name1, name2, similarity in duplicates:
+        for i in functions.positions_named(name1):
+            for j in functions.positions_named(name2):
+                if i == j:
+                    continue
+                parent.setdefault(i, i)
+                parent.setdefault(j, j)
+                parent[find(i)] = find(j)
+                pairs.append((functions.labels[i], functions.labels[j], similarity))
+    clusters = defaultdict(list)
+    for i in sorted(parent):
+        clusters[find(i)].append(i)
+    return list(clusters.values()), pairs
+
+
+def parse_json_response(response):
+    """Parses a JSON answer, tolerating markdown code fences around it; None when it is not JSON."""
+    text = response.strip()
+    if text.startswith("```"):
+        text = text.strip("`").strip()
+        if text.startswith("json"):
+            text = text[len("json"):]
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def _json_object(response):
+    result = parse_json_response(response)
+    if not isinstance(result, dict):
+        raise ValueError(f"expected a JSON object, got {response.strip()[:80]!r}")
+    return result
+
+
+def _python_source(response):
+    """The code of a whole-file refactoring response; raises SyntaxError unless it parses."""
+    code = format_refactored_output(response)
+    ast.parse(code)
+    return code
+
 
 def format_refactored_output(raw_output):
     """Cleans GPT responses to remove backticks and Python markers."""
@@ -1,21 +1,93 @@
 import ast
+import io
 import os.path
+import tokenize
+from array import array
+from itertools import accumulate
 
+BLANK, COMMENT, DOCSTRING, CODE = range(4)
 
-class CodeParser:
-    def __init__(self, file_path):
-        if not os.path.isfile(file_path):
-            raise FileNotFoundError(f"{file_path} not found")
 
+def classify_line(line):
+    """Classifies a single source line as BLANK, COMMENT, DOCSTRING or CODE."""
+    stripped = line.strip()
+    if not stripped:
+        return BLANK
+    if stripped.startswith('#'):
+        return COMMENT
+    if stripped.startswith('"'):
+        return DOCSTRING
+    return CODE
+
+
+class SourceFile:
+    """Reads a source file exactly once and keeps everything the pipeline needs from it:
+    the text, its lines, a per-line classification and a prefix sum of code lines,
+    so the LOC of any line span is an O(1) lookup. data holds the raw bytes the text was decoded
+    from (None for text that did not come from a file)."""
+
+    def __init__(self, text, file_path=None, data=None):
+        self.file_path = file_path
+        self.text = text
+        self.data = data
+        self.lines = text.split('\n')  # only '\n', so indices line up with ast line numbers
+        self.line_kinds = array('B', map(classify_line, self.lines))
+        # code_prefix[i] is the number of code lines among the first i lines
+        self.code_prefix = array('L', accumulate((kind == CODE for kind in self.line_kinds), initial=0))
+
+    @classmethod
+    def from_path(cls, file_path):
+        data = read_source_bytes(file_path)
+        return cls(_decode_source(data), file_path, data)
+
+    def loc(self, start_line, end_line):
+        """Counts code lines between 1-based start_line and end_line (inclusive)."""
+        start_line = max(start_line, 1)
+        end_line = min(end_line, len(self.lines))
+        if end_line < start_line:
+            return 0
+        return self.code_prefix[end_line] - self.code_prefix[start_line - 1]
+
+
+def read_source_bytes(file_path):
+    """Reads the raw bytes of a source file."""
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"{file_path} not found")
+
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+
+def read_source_text(file_path):
+    """Reads and decodes a source file the way SourceFile expects its text."""
+    return _decode_source(read_source_bytes(file_path))
+
+
+def _decode_source(data):
+    # decoded like the interpreter does: a BOM or PEP 263 coding cookie, otherwise UTF-8, and
+    # undecodable bytes are a SyntaxError rather than replaced. Universal newlines like open(..., 'r')
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    try:
+        text = data.decode(encoding)
+    except UnicodeDecodeError as e:
+        raise SyntaxError(f"source is not valid {encoding}: {e.reason} at byte {e.start}") from e
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+class CodeParser:
+    def __init__(self, file_path, source=None):
+        self.source = source if source is not None else SourceFile.from_path(file_path)
         self.file_path = file_path
         self.tree = self.parse_input_code()
 
     def get_ASTree(self):
         return self.tree
 
+    def get_source(self):
+        return self.source
+
     def parse_input_code(self):
-        with open(self.file_path, 'r') as file:
-            return ast.parse(file.read())
+        return ast.parse(self.source.text)
 
 
 def parameter_extractor(node):
@@ -24,35 +96,74 @@ def parameter_extractor(node):
     return params
 
 
-class FunctionExtractor:
-    def __init__(self, as_tree, file_path):
+STATEMENT_HOLDERS = (ast.stmt, ast.excepthandler, ast.match_case)
+
+
+class FunctionExtractor(ast.NodeVisitor):
+    """Collects function records in one scope-tracking traversal of the tree, in source order.
+    Besides name, parameters and LOC each record has its qualname (as Python's __qualname__),
+    class_name (qualname of the innermost enclosing class, None for module-level functions),
+    is_async and nesting (number of enclosing functions). __init__ methods are not recorded,
+    but functions nested inside them are. The visit methods are generators, so iter_functions
+    hands out each record as soon as the traversal reaches it."""
+
+    def __init__(self, as_tree, file_path, source=None):
         self.as_tree = as_tree
         self.file_path = file_path
+        self.source = source if source is not None else SourceFile.from_path(file_path)
+        self._scopes = []  # (qualname, is_class) of the enclosing classes and functions
 
     def function_details_extractor(self, node):
+        qualname = self._qualname(node.name)
+        class_name = next((name for name, is_class in reversed(self._scopes) if is_class), None)
         return ({
             'name': node.name,
+            'qualname': qualname,
+            'class_name': class_name,
+            'is_async': isinstance(node, ast.AsyncFunctionDef),
+            'nesting': sum(1 for _, is_class in self._scopes if not is_class),
             'parameters': parameter_extractor(node),
             'loc': self.loc_calculator(node),
+            'lineno': node.lineno,
+            'end_lineno': node.end_lineno,
             'node': node  # storing ast node for duplicate code detection
         })
 
     def extract_functions(self):
-        functions = []
-        for node in ast.walk(self.as_tree):
-            if isinstance(node, ast.FunctionDef) and node.name != '__init__':
-                functions.append(self.function_details_extractor(node))
-        return functions
+        return list(self.iter_functions())
 
-    def loc_calculator(self, node):
-        with open(self.file_path, 'r') as f:
-            lines = f.readlines()
+    def iter_functions(self):
+        """Yields the function records in source order, each as soon as it is visited."""
+        self._scopes = []
+        yield from self.visit(self.as_tree)
+
+    def _qualname(self, name):
+        if not self._scopes:
+            return name
+        parent, is_class = self._scopes[-1]
+        return f"{parent}.{name}" if is_class else f"{parent}.<locals>.{name}"
 
-        total_loc = lines[node.lineno - 1: node.end_lineno]
+    def generic_visit(self, node):
+        # functions and classes are statements, and only statements, handlers and match cases hold
+        # statements, so expressions are never descended into
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, STATEMENT_HOLDERS):
+                yield from self.visit(child)
 
-        final_loc = [
-            line for line in total_loc
-            if line.strip() and not line.strip().startswith("#") and not line.strip().startswith('"')
-        ]
+    def visit_ClassDef(self, node):
+        self._scopes.append((self._qualname(node.name), True))
+        yield from self.generic_visit(node)
+        self._scopes.pop()
 
-        return len(final_loc)
+    def visit_FunctionDef(self, node):
+        if node.name != '__init__':
+            yield self.function_details_extractor(node)
+        self._scopes.append((self._qualname(node.name), False))
+        yield from self.generic_visit(node)
+        self._scopes.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def loc_calculator(self, node):
+        # blank lines, comments and lines starting with a quote (docstrings) don't count
+        return self.source.loc(node.lineno, node.end_lineno)
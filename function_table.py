@@ -0,0 +1,119 @@
+from array import array
+
+from detector import ASTAnalyzer
+
+
+class StringTable:
+    """Interns strings: each distinct string is stored once and referred to by its integer id."""
+
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def intern(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class FunctionTable:
+    """Column-oriented store of the function records of one file.
+
+    Names, qualnames and class names are interned ids, numbers live in typed arrays, parameters are
+    kept in CSR form (param_offsets into param_ids) and identical FunctionFingerprints are stored once
+    and referenced by fingerprint_ids. No AST nodes or source text are kept: memory grows with the number
+    of functions, not with the size of their ASTs.
+
+    Iterating (or indexing) builds plain record dicts with the same keys FunctionExtractor produces
+    (minus 'node', plus 'fingerprint'), so CodeSmellDetector and the GUI accept a table as is; the
+    columns (loc, param_count(i), fingerprint(i), ...) answer single fields without building one."""
+    NO_CLASS = -1
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self.strings = StringTable()
+        self.name_ids = array('L')
+        self.qualname_ids = array('L')
+        self.class_ids = array('l')
+        self.is_async = array('B')
+        self.nesting = array('H')
+        self.loc = array('L')
+        self.lineno = array('L')
+        self.end_lineno = array('L')
+        self.param_offsets = array('L', [0])
+        self.param_ids = array('L')
+        self.fingerprint_ids = array('L')
+        self.fingerprints = []
+        self._fingerprint_ids = {}
+
+    @classmethod
+    def from_records(cls, records, file_path=None):
+        """Builds a table from FunctionExtractor records. Records holding a 'node' are fingerprinted
+        and the node reference is dropped, so the AST can be freed as soon as the caller lets go of it."""
+        table = cls(file_path)
+        for record in records:
+            table.append(record)
+        return table
+
+    def append(self, record):
+        fingerprint = record.get('fingerprint')
+        if fingerprint is None:
+            fingerprint = ASTAnalyzer.fingerprint(record['node'])
+        intern = self.strings.intern
+        self.name_ids.append(intern(record['name']))
+        self.qualname_ids.append(intern(record.get('qualname', record['name'])))
+        class_name = record.get('class_name')
+        self.class_ids.append(self.NO_CLASS if class_name is None else intern(class_name))
+        self.is_async.append(bool(record.get('is_async', False)))
+        self.nesting.append(record.get('nesting', 0))
+        self.loc.append(record['loc'])
+        self.lineno.append(record['lineno'])
+        self.end_lineno.append(record['end_lineno'])
+        self.param_ids.extend(intern(parameter) for parameter in record['parameters'])
+        self.param_offsets.append(len(self.param_ids))
+        fingerprint_id = self._fingerprint_ids.get(fingerprint)
+        if fingerprint_id is None:
+            fingerprint_id = self._fingerprint_ids[fingerprint] = len(self.fingerprints)
+            self.fingerprints.append(fingerprint)
+        self.fingerprint_ids.append(fingerprint_id)
+
+    def __len__(self):
+        return len(self.name_ids)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        class_id = self.class_ids[i]
+        return {
+            'name': self.strings[self.name_ids[i]],
+            'qualname': self.strings[self.qualname_ids[i]],
+            'class_name': None if class_id == self.NO_CLASS else self.strings[class_id],
+            'is_async': bool(self.is_async[i]),
+            'nesting': self.nesting[i],
+            'parameters': self.parameters(i),
+            'loc': self.loc[i],
+            'lineno': self.lineno[i],
+            'end_lineno': self.end_lineno[i],
+            'fingerprint': self.fingerprint(i),
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def parameters(self, i):
+        return [self.strings[p] for p in self.param_ids[self.param_offsets[i]:self.param_offsets[i + 1]]]
+
+    def param_count(self, i):
+        return self.param_offsets[i + 1] - self.param_offsets[i]
+
+    def fingerprint(self, i):
+        return self.fingerprints[self.fingerprint_ids[i]]
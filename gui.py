@@ -1,33 +1,184 @@
+import multiprocessing
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from tkinter.scrolledtext import ScrolledText
 import detector
-from extractor import CodeParser, FunctionExtractor
+from extractor import CodeParser, FunctionExtractor, SourceFile
+from function_table import FunctionTable
+from semantic import function_labels
+from similarity_index import DEFAULT_FLOOR, SmellIndex
+from watch import IncrementalAnalysis, create_watcher
+
+# spawn rather than fork: the Tk process may already run threads (e.g. the OpenAI event loop)
+_process_context = multiprocessing.get_context('spawn')
 
 
 class FileHandler:
     def read_file(self, file_path):
+        """Reads the file once; the returned SourceFile is shared by the parser, extractor and GUI."""
         try:
-            with open(file_path, "r") as file:
-                return file.read()
+            return SourceFile.from_path(file_path)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to read file: {str(e)}")
             return None
 
 
+class ThresholdTuner:
+    """The threshold-independent outcome of one analysis: results for any other thresholds are
+    re-filtered from the sorted smell and similarity indexes by binary search, without rescoring.
+    Small and picklable, so it travels back from the analysis process."""
+
+    def __init__(self, labels, smell_index, similarity_index):
+        self.labels = labels  # semantic.function_labels, so duplicates name functions unambiguously
+        self.smell_index = smell_index
+        self.similarity_index = similarity_index
+
+    def results(self, MAX_LOC, MAX_PARAMS, SIMILARITY_THRESHOLD, min_complexity_threshold):
+        """Returns (smells, duplicates) shaped like CodeSmellDetector's output for these thresholds."""
+        smells = self.smell_index.query(MAX_LOC, MAX_PARAMS)
+        duplicates = [(self.labels[i], self.labels[j], similarity) for i, j, similarity
+                      in self.similarity_index.query(SIMILARITY_THRESHOLD, min_complexity_threshold)]
+        return smells, duplicates
+
+
 class Analyzer:
-    def analyze(self, file_path):
-        parser = CodeParser(file_path)
-        extractor = FunctionExtractor(parser.get_ASTree(), file_path)
-        functions = extractor.extract_functions()
+    DUPLICATE_BATCH_SECONDS = 0.05  # how often newly found duplicates are sent to the GUI
+
+    @staticmethod
+    def function_table(file_path, source=None):
+        """Parses the file and returns its FunctionTable; the AST is released once this returns."""
+        parser = CodeParser(file_path, source)
+        extractor = FunctionExtractor(parser.get_ASTree(), file_path, parser.get_source())
+        return FunctionTable.from_records(extractor.iter_functions(), file_path)
+
+    def analyze(self, file_path, source=None):
+        functions = self.function_table(file_path, source)
         detection = detector.CodeSmellDetector(functions)
         smells = detection.detect_code_smells()
         duplicates = detection.duplicate_code_detector()
         return smells, duplicates
 
+    def analyze_streaming(self, file_path, source, emit, thresholds=None):
+        """Same analysis as analyze(), reported piecewise through emit(kind, payload):
+        ('progress', (percent, status)), ('smells', smells) and ('duplicates', [batch]).
+        Smell entries are sent without their fingerprints to keep the messages small; duplicates name
+        their functions by semantic.function_labels, as the refactoring prompts do.
+        Returns a ThresholdTuner for re-filtering the results under other thresholds."""
+        emit('progress', (0, "Parsing and extracting functions..."))
+        functions = self.function_table(file_path, source)
+        detection = detector.CodeSmellDetector(functions, **(thresholds or {}))
+        smells = detection.detect_code_smells()
+        emit('smells', {key: [{k: v for k, v in fn.items() if k != 'fingerprint'} for fn in items]
+                        for key, items in smells.items()})
+
+        last_percent = -1
+
+        def progress(done, total):
+            nonlocal last_percent
+            percent = 20 + 80 * done // max(total, 1)
+            if percent != last_percent:
+                last_percent = percent
+                emit('progress', (percent, "Comparing functions..."))
+
+        labels = function_labels(functions)
+        label_of = {(fn['qualname'], fn['lineno']): label for fn, label in zip(functions, labels)}
+        batch, last_sent = [], time.monotonic()
+
+        def on_duplicate(fn1, fn2, similarity):
+            nonlocal batch, last_sent
+            batch.append((label_of[fn1['qualname'], fn1['lineno']], label_of[fn2['qualname'], fn2['lineno']],
+                          similarity))
+            if time.monotonic() - last_sent >= self.DUPLICATE_BATCH_SECONDS:
+                emit('duplicates', batch)
+                batch, last_sent = [], time.monotonic()
+
+        floor = min(DEFAULT_FLOOR, detection.SIMILARITY_THRESHOLD)
+        similarity_index = detection.build_similarity_index(floor, progress, on_duplicate)
+        if batch:
+            emit('duplicates', batch)
+        return ThresholdTuner(labels, SmellIndex(functions), similarity_index)
+
+
+def _analysis_process(file_path, source, thresholds, messages):
+    """Entry point of the analysis process. Runs outside the Tk process so parsing never blocks the UI.
+    The 'done' message carries the ThresholdTuner."""
+    emit = lambda kind, payload: messages.put((kind, payload))
+    try:
+        tuner = Analyzer().analyze_streaming(file_path, source, emit, thresholds)
+    except Exception as e:
+        emit('error', str(e))
+    else:
+        emit('done', tuner)
+
+
+def _watch_update(analysis, file_path, messages):
+    """Entry point of a watch-mode re-analysis. Builds the file's IncrementalAnalysis (in a process,
+    like the first analysis) or brings it up to date (in a thread: only the edited functions are redone).
+    The 'done' message carries (analysis, update or a note when the file does not parse right now)."""
+    try:
+        if analysis is None:
+            analysis, update = IncrementalAnalysis(file_path), None
+        else:
+            update = analysis.update()
+    except SyntaxError as e:
+        messages.put(('done', (analysis, f"syntax error on line {e.lineno}, keeping the last results")))
+    except Exception as e:
+        messages.put(('error', str(e)))
+    else:
+        messages.put(('done', (analysis, update)))
+
+
+def _openai_thread(operation, client, messages):
+    """Entry point of the thread that waits on OpenAI, keeping the Tk thread free."""
+    try:
+        messages.put(('done', operation(client)))
+    except Exception as e:
+        messages.put(('error', str(e)))
+
+
+class BackgroundTask:
+    """Work running off the Tk thread (in a process or a thread) that reports back through a queue
+    of (kind, payload) messages, drained by CodeSmellGUI on a root.after timer."""
+
+    def __init__(self, target, args, use_process):
+        if use_process:
+            self.messages = _process_context.Queue()
+            self.worker = _process_context.Process(target=target, args=(*args, self.messages), daemon=True)
+        else:
+            self.messages = queue.Queue()
+            self.worker = threading.Thread(target=target, args=(*args, self.messages), daemon=True)
+        self.finished = False
+
+    def start(self):
+        self.worker.start()
+
+    def cancel(self):
+        """Stops an analysis process right away; a thread blocked on OpenAI is left to finish and ignored."""
+        self.finished = True
+        if isinstance(self.worker, _process_context.Process) and self.worker.is_alive():
+            self.worker.terminate()
+
+    def poll(self, deadline):
+        """Yields pending messages until the queue is empty or time.perf_counter() passes deadline."""
+        while not self.finished and time.perf_counter() < deadline:
+            try:
+                kind, payload = self.messages.get_nowait()
+            except queue.Empty:
+                if not self.worker.is_alive() and self.messages.empty():
+                    self.finished = True
+                    yield 'error', "Background task stopped unexpectedly."
+                return
+            if kind in ('done', 'error'):
+                self.finished = True
+            yield kind, payload
+
 
 class CodeSmellGUI:
-    """A GUI application for detecting and refactoring code smells in Python files."""
+    """A GUI application for detecting and refactoring code smells in Python files.
+    Analysis and OpenAI calls run in the background; their results are appended as they arrive."""
 
     FILE_TYPES = [("Python Files", "*.py")]
     SMELL_CONFIGS = [
@@ -36,11 +187,22 @@ class CodeSmellGUI:
          lambda fn: f"  - {fn['name']} with {len(fn['parameters'])} parameters\n"),
         ("Structural duplicates", "duplicates", lambda d: f"  - {d[0]} and {d[1]} (Similarity: {d[2]})\n")
     ]
+    POLL_INTERVAL_MS = 16  # ~60 fps
+    POLL_BUDGET_SECONDS = 0.008  # at most half a frame of UI work per poll
+    # (label, CodeSmellDetector keyword, minimum, maximum, default, is_integer)
+    THRESHOLD_SLIDERS = [
+        ("Max LOC", 'MAX_LOC', 1, 100, 15, True),
+        ("Max params", 'MAX_PARAMS', 0, 10, 3, True),
+        ("Similarity", 'SIMILARITY_THRESHOLD', DEFAULT_FLOOR, 1.0, 0.75, False),
+        ("Min complexity", 'min_complexity_threshold', 0, 50, 2, True),
+    ]
+    REFILTER_DELAY_MS = 50  # coalesces slider motion into one re-filter
+    WATCH_INTERVAL_MS = 250  # how often the watched file is checked for changes
 
     def __init__(self, root):
         self.root = root
         self.root.title("Varun' Code Smell Detector")
-        self.root.geometry("800x500")
+        self.root.geometry("800x600")
         self.root.configure(bg="#000000")
 
         self.title_label = ttk.Label(root, text="Code Smell Detector", font=("Consolas", 16, "bold"),
@@ -68,10 +230,42 @@ class CodeSmellGUI:
                                              command=self.check_semantic_duplicates, state=tk.DISABLED, style="TButton")
         self.semantic_check_btn.pack(side="left", padx=10, pady=10)
 
+        self.watch_var = tk.BooleanVar(value=False)
+        self.watch_check = ttk.Checkbutton(self.button_frame, text='Watch file', variable=self.watch_var,
+                                           command=self._toggle_watch)
+        self.watch_check.pack(side="left", padx=10, pady=10)
+
         self.refactor_btn = ttk.Button(self.button_frame, text='Refactor Duplicates',
                                        command=self.refactor_duplicate_code, state=tk.DISABLED, style="TButton")
         self.refactor_btn.pack(side="right", padx=10, pady=10)
 
+        self.progress_frame = ttk.Frame(root)
+        self.progress_frame.grid(row=4, column=0, columnspan=3, sticky="ew", padx=10, pady=(0, 10))
+
+        self.status_label = ttk.Label(self.progress_frame, text="", font=("Consolas", 9))
+        self.status_label.pack(side="left")
+
+        self.cancel_btn = ttk.Button(self.progress_frame, text='Cancel', command=self.cancel_task,
+                                     state=tk.DISABLED, style="TButton")
+        self.cancel_btn.pack(side="right")
+
+        self.progress_bar = ttk.Progressbar(self.progress_frame, mode="determinate", maximum=100)
+        self.progress_bar.pack(side="right", fill="x", expand=True, padx=10)
+
+        self.threshold_frame = ttk.Frame(root)
+        self.threshold_frame.grid(row=5, column=0, columnspan=3, sticky="ew", padx=10, pady=(0, 10))
+        self.threshold_vars = {}
+        self.threshold_labels = {}
+        for column, (label, key, low, high, default, _) in enumerate(self.THRESHOLD_SLIDERS):
+            self.threshold_vars[key] = tk.DoubleVar(value=default)
+            self.threshold_labels[key] = ttk.Label(self.threshold_frame, font=("Consolas", 9))
+            self.threshold_labels[key].grid(row=0, column=column, padx=5)
+            ttk.Scale(self.threshold_frame, from_=low, to=high, variable=self.threshold_vars[key],
+                      command=lambda _, key=key: self._on_threshold_change(key)).grid(row=1, column=column, padx=5,
+                                                                                      sticky="ew")
+            self.threshold_frame.grid_columnconfigure(column, weight=1)
+            self._update_threshold_label(key)
+
         self.file_handler = FileHandler()
         self.analyzer = Analyzer()
 
@@ -82,8 +276,33 @@ class CodeSmellGUI:
         root.grid_columnconfigure(2, weight=1)
 
         self.file_path = None
+        self.source = None
         self.original_code = None
         self.duplicates = None
+        self.smells = None
+        self.openai_client = None
+        self.task = None
+        self.on_task_done = None
+        self.tuner = None
+        self.shown_thresholds = None
+        self.refilter_job = None
+        self.watcher = None
+        self.watch_job = None
+        self.watch_pending = False
+        self.analysis = None
+        root.protocol("WM_DELETE_WINDOW", self.close)
+
+    def close(self):
+        """Stops watching and background work and closes the OpenAI client before the window goes."""
+        self._stop_watch()
+        if self.task is not None:
+            self.task.cancel()
+        if self.openai_client is not None:
+            try:
+                self.openai_client.close()
+            except Exception:
+                pass  # the window closes regardless
+        self.root.destroy()
 
     def _configure_styles(self):
         """Configures the styling for UI elements using a style map."""
@@ -99,16 +318,215 @@ class CodeSmellGUI:
         self.file_path = filedialog.askopenfilename(filetypes=self.FILE_TYPES)
         if not self.file_path:
             return
-        self.original_code = self.file_handler.read_file(self.file_path)
+        self.source = self.file_handler.read_file(self.file_path)
+        if self.source is None:
+            return
+        self.original_code = self.source.text
         self.code_analyzer()
+        self._stop_watch()
+        if self.watch_var.get():
+            self._start_watch()
 
     def code_analyzer(self):
-        """Parses, extracts functions, detects code smells."""
-        smells, self.duplicates = self.analyzer.analyze(self.file_path)
+        """Parses, extracts functions, detects code smells in a background process."""
+        self.smells, self.duplicates = None, []
+        self.tuner = None
+        self.shown_thresholds = self.thresholds()
         self.result_text.delete(1.0, tk.END)
-        self.display_results(smells, self.duplicates)
+        self.semantic_check_btn.config(state=tk.DISABLED)
+        self.refactor_btn.config(state=tk.DISABLED)
+        self._start_task(_analysis_process, (self.file_path, self.source, self.shown_thresholds), use_process=True,
+                         on_done=self._on_analysis_done, status="Starting analysis...")
+
+    # --- threshold sliders --------------------------------------------------------------------
+
+    def thresholds(self):
+        """Current slider values as CodeSmellDetector keyword arguments."""
+        return {key: self._threshold_value(key) for _, key, *_ in self.THRESHOLD_SLIDERS}
+
+    def _threshold_value(self, key):
+        is_integer = next(slider[5] for slider in self.THRESHOLD_SLIDERS if slider[1] == key)
+        value = self.threshold_vars[key].get()
+        return round(value) if is_integer else round(value, 2)
+
+    def _update_threshold_label(self, key):
+        label = next(slider[0] for slider in self.THRESHOLD_SLIDERS if slider[1] == key)
+        self.threshold_labels[key].config(text=f"{label}: {self._threshold_value(key)}")
+
+    def _on_threshold_change(self, key):
+        self._update_threshold_label(key)
+        if self.refilter_job is not None:
+            self.root.after_cancel(self.refilter_job)
+        self.refilter_job = self.root.after(self.REFILTER_DELAY_MS, self._apply_thresholds)
+
+    def _apply_thresholds(self):
+        """Re-filters the last analysis for the slider values; nothing is recomputed."""
+        self.refilter_job = None
+        thresholds = self.thresholds()
+        if self.tuner is None or self.task is not None or thresholds == self.shown_thresholds:
+            return
+        self.shown_thresholds = thresholds
+        self.smells, self.duplicates = self.tuner.results(**thresholds)
+        self.result_text.delete(1.0, tk.END)
+        self.display_results(self.smells, self.duplicates)
+        self.refactor_btn.config(state=tk.NORMAL if self.duplicates else tk.DISABLED)
+
+    # --- watch mode ---------------------------------------------------------------------------
+
+    def _toggle_watch(self):
+        if self.watch_var.get():
+            self._start_watch()
+        else:
+            self._stop_watch()
+
+    def _start_watch(self):
+        """Watches the open file; each save re-analyzes only the functions that changed."""
+        if self.file_path is None or self.watcher is not None:
+            return
+        self.watcher = create_watcher(self.file_path)
+        self.watch_pending = True  # builds the incremental analysis right away, so the first save is fast
+        self._poll_watch()
+
+    def _stop_watch(self):
+        if self.watch_job is not None:
+            self.root.after_cancel(self.watch_job)
+        if self.watcher is not None:
+            self.watcher.close()
+        self.watcher, self.watch_job, self.watch_pending, self.analysis = None, None, False, None
+
+    def _poll_watch(self):
+        """Checks the file without blocking; a change seen while another task runs waits for it."""
+        self.watch_job = self.root.after(self.WATCH_INTERVAL_MS, self._poll_watch)
+        if self.watcher.changes(timeout=0):
+            self.watch_pending = True
+        if self.watch_pending and self.task is None:
+            self.watch_pending = False
+            self._start_task(_watch_update, (self.analysis, self.file_path), use_process=self.analysis is None,
+                             on_done=self._on_watch_update, status="Re-analyzing changed functions...",
+                             determinate=False)
+
+    def _on_watch_update(self, result):
+        """Shows the updated analysis under the current slider values."""
+        if self.watcher is None:
+            return  # watching was switched off meanwhile
+        self.analysis, update = result
+        if isinstance(update, str) or self.analysis is None:
+            self.status_label.config(text=f"Watching: {update}")
+            return
+        records = self.analysis.records
+        self.original_code = "\n".join(self.analysis.lines)
+        self.tuner = ThresholdTuner(function_labels(records), SmellIndex(records), self.analysis)
+        self.shown_thresholds = None
+        self._apply_thresholds()
+        if update is not None:
+            self.status_label.config(text=f"Watching: {update['changed']} function(s) re-analyzed "
+                                          f"in {update['seconds'] * 1000:.0f} ms")
+        else:
+            self.status_label.config(text="Watching for changes...")
         self.semantic_check_btn.config(state=tk.NORMAL)
+
+    # --- background task plumbing -------------------------------------------------------------
+
+    def _start_task(self, target, args, use_process, on_done, status, determinate=True):
+        if self.task is not None:
+            self.task.cancel()
+        self.task = BackgroundTask(target, args, use_process)
+        self.on_task_done = on_done
+        self.upload_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.status_label.config(text=status)
+        self.progress_bar.config(mode="determinate" if determinate else "indeterminate", value=0)
+        if not determinate:
+            self.progress_bar.start(self.POLL_INTERVAL_MS)
+        self.task.start()
+        self.root.after(self.POLL_INTERVAL_MS, self._poll_task, self.task)
+
+    def _poll_task(self, task):
+        """Drains the task's queue within a fixed time budget so the UI keeps painting."""
+        if task is not self.task:
+            return  # superseded or cancelled
+        deadline = time.perf_counter() + self.POLL_BUDGET_SECONDS
+        for kind, payload in task.poll(deadline):
+            if kind == 'progress':
+                percent, status = payload
+                self.progress_bar.config(value=percent)
+                self.status_label.config(text=status)
+            elif kind == 'smells':
+                self._display_smells(payload)
+            elif kind == 'duplicates':
+                self._append_duplicates(payload)
+            elif kind == 'error':
+                self._finish_task("Failed.")
+                messagebox.showerror("Error", payload)
+                return
+            elif kind == 'done':
+                on_done = self.on_task_done
+                self._finish_task("Done.")
+                on_done(payload)
+                return
+        self.root.after(self.POLL_INTERVAL_MS, self._poll_task, task)
+
+    def _finish_task(self, status):
+        self.task = None
+        self.on_task_done = None
+        self.progress_bar.stop()
+        self.progress_bar.config(mode="determinate", value=100 if status == "Done." else 0)
+        self.status_label.config(text=status)
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.upload_btn.config(state=tk.NORMAL)
+        if self.smells is not None:
+            self.semantic_check_btn.config(state=tk.NORMAL)
+        # the duplicates of a cancelled analysis are partial, so refactoring waits for a complete one
+        self.refactor_btn.config(state=tk.NORMAL if self.tuner is not None and self.duplicates else tk.DISABLED)
+
+    def cancel_task(self):
+        if self.task is None:
+            return
+        if self.on_task_done == self._on_watch_update:
+            # the update thread may still be mutating the analysis, so neither the next update nor the
+            # sliders (through the tuner) may touch it; it is rebuilt on the next change
+            self.analysis = None
+            self.tuner = None
+        self.task.cancel()
+        self._finish_task("Cancelled.")
+        self.result_text.insert(tk.END, "\nCancelled.\n", "info")
+
+    # --- incremental result display -----------------------------------------------------------
+
+    def _display_smells(self, smells):
+        self.smells = smells
+        for name, key, format_func in self.SMELL_CONFIGS:
+            if smells.get(key):
+                self._display_smell_type(name, smells[key], format_func)
+
+    def _smell_config(self, key):
+        return next(config for config in self.SMELL_CONFIGS if config[1] == key)
+
+    def _append_duplicates(self, batch):
+        name, _, format_func = self._smell_config('duplicates')
+        if not self.duplicates:
+            self.result_text.insert(tk.END, f"- {name}: ", "highlight")
+            self.result_text.mark_set("duplicate_count", "end-1c")
+            self.result_text.mark_gravity("duplicate_count", tk.LEFT)
+            self.result_text.insert(tk.END, "\n", "highlight")
+        self.duplicates.extend(batch)
+        self.result_text.insert(tk.END, "".join(format_func(d) for d in batch))
+
+    def _on_analysis_done(self, tuner):
+        """Fills in the summary lines that could only be written once everything was found,
+        then catches up with slider moves made while the analysis ran."""
+        self.tuner = tuner
+        smell_data = dict(self.smells, duplicates=self.duplicates)
+        if self.duplicates:
+            self.result_text.insert("duplicate_count", str(len(self.duplicates)), "highlight")
+        if not self._has_smells(smell_data):
+            self.result_text.insert(tk.END, "No code smells found.\n", "success")
+        else:
+            present_smells = [name for name, key, _ in self.SMELL_CONFIGS if smell_data[key]]
+            self.result_text.insert("1.0", f"Code smells detected: {', '.join(present_smells)}\n", "header")
+        self.result_text.insert(tk.END, "\nYou can check for semantic duplicates if you want to...\n", "info")
         self.refactor_btn.config(state=tk.NORMAL if self.duplicates else tk.DISABLED)
+        self._apply_thresholds()
 
     def display_results(self, smells, duplicates):
         smell_data = {
@@ -134,22 +552,31 @@ class CodeSmellGUI:
 
     def _display_smell_type(self, smell_name, smell_list, format_func):
         self.result_text.insert(tk.END, f"- {smell_name}: {len(smell_list)}\n", "highlight")
-        for item in smell_list:
-            self.result_text.insert(tk.END, format_func(item))
+        self.result_text.insert(tk.END, "".join(format_func(item) for item in smell_list))
+
+    # --- OpenAI operations --------------------------------------------------------------------
 
-    def _run_openai_operation(self, operation):
-        """Runs an OpenAI operation with error handling to catch and display errors."""
+    def _run_openai_operation(self, operation, on_done, status):
+        """Runs an OpenAI operation on a worker thread; errors are shown once it finishes.
+        The client is created on first use and reused, keeping its connections and response cache."""
         try:
-            openai_client = detector.OpenAIClient()
-            return operation(openai_client)
+            if self.openai_client is None:
+                self.openai_client = detector.OpenAIClient()
         except Exception as e:
             messagebox.showerror("Error", str(e))
-            return None
+            return
+        self.semantic_check_btn.config(state=tk.DISABLED)
+        self.refactor_btn.config(state=tk.DISABLED)
+        self._start_task(_openai_thread, (operation, self.openai_client), use_process=False,
+                         on_done=on_done, status=status, determinate=False)
 
     def check_semantic_duplicates(self):
-        result = self._run_openai_operation(
-            lambda client: client.detect_semantic_duplicates(self.original_code)
+        self._run_openai_operation(
+            lambda client: client.detect_semantic_duplicates(self.original_code),
+            self._show_semantic_duplicates, "Asking OpenAI for semantic duplicates..."
         )
+
+    def _show_semantic_duplicates(self, result):
         if result:
             self.result_text.insert(tk.END, "\n=== Semantic Duplicates Found ===\n", "header")
             for func1, func2 in result:
@@ -160,11 +587,17 @@ class CodeSmellGUI:
             self.result_text.insert(tk.END, "\nError: Unable to retrieve semantic duplicates.\n", "error")
 
     def refactor_duplicate_code(self):
-        result = self._run_openai_operation(
-            lambda client: client.refactor_code(self.original_code, self.duplicates)
+        self._run_openai_operation(
+            lambda client: client.refactor_code(self.original_code, self.duplicates),
+            self._save_refactored_code, "Asking OpenAI to refactor duplicates..."
         )
-        if result:
-            save_refactored_code(result)
+
+    def _save_refactored_code(self, result):
+        if result is None:
+            self.result_text.insert(tk.END, "\nError: OpenAI returned no usable refactoring, nothing was saved.\n",
+                                    "error")
+            return
+        save_refactored_code(result)
 
 
 def save_refactored_code(refactored_code):
@@ -0,0 +1,194 @@
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import openai
+
+from metrics import NULL_METRICS
+
+DEFAULT_MODEL = "gpt-4-turbo"
+DEFAULT_RESPONSE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "codesniffer", "llm_responses.sqlite")
+
+
+class Transport(abc.ABC):
+    """Sends one chat completion request and returns the response text.
+    Subclass it to plug in something other than the OpenAI API, e.g. an in-process fake for tests."""
+    retryable_errors = ()  # exceptions worth retrying with backoff
+
+    @abc.abstractmethod
+    async def complete(self, model, messages, temperature):
+        """Returns the text of the completion of messages."""
+
+    async def close(self):
+        pass
+
+
+class OpenAITransport(Transport):
+    """Talks to the OpenAI API (or any compatible server given by base_url) through one reused
+    AsyncOpenAI client, so connections are pooled across requests."""
+    retryable_errors = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                        openai.InternalServerError)
+
+    def __init__(self, api_key=None, base_url=None, timeout=120):
+        # retries are handled by AsyncOpenAIClient so that they share the rate limiter
+        self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+
+    async def complete(self, model, messages, temperature):
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature
+        )
+        return response.choices[0].message.content.strip()
+
+    async def close(self):
+        await self.client.close()
+
+
+class ResponseCache:
+    """Persistent SQLite cache of completions keyed by the hash of model, temperature and prompt,
+    so asking the same question about the same code twice costs nothing. Its methods block; the
+    async client calls them through asyncio.to_thread."""
+
+    def __init__(self, path=DEFAULT_RESPONSE_CACHE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.connection.commit()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, temperature, prompt):
+        payload = json.dumps([model, temperature, prompt])
+        return hashlib.sha256(payload.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, response):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                                    (key, response, time.time()))
+
+    def delete(self, key):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def close(self):
+        self.connection.close()
+
+
+class RateLimiter:
+    """Spaces request starts so that at most requests_per_minute are sent (None means unlimited)."""
+
+    def __init__(self, requests_per_minute=None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_slot = 0.0
+        self.lock = None
+
+    async def wait(self):
+        if not self.interval:
+            return
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AsyncOpenAIClient:
+    """asyncio client for chat completions with bounded concurrency, rate limiting,
+    retry with exponential backoff and an optional persistent response cache.
+    Counts llm_requests, llm_retries and llm_cache_hits into metrics."""
+
+    def __init__(self, transport=None, model=DEFAULT_MODEL, temperature=0.1, max_concurrency=4,
+                 requests_per_minute=60, max_retries=4, backoff=1.0, cache=None, metrics=NULL_METRICS):
+        self.transport = transport if transport is not None else OpenAITransport(os.getenv('OPENAI_API_KEY'))
+        self.model = model
+        self.temperature = temperature
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.cache = cache
+        self.metrics = metrics
+        self.semaphore = None
+
+    async def complete(self, prompt, parse=None):
+        """Returns the completion text for prompt, from the cache when possible. With parse, returns
+        parse(text) instead: parse raises ValueError for a response the caller cannot use, which is
+        then not cached (a cached one is dropped and the prompt sent again)."""
+        key = ResponseCache.make_key(self.model, self.temperature, prompt) if self.cache else None
+        if key:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                try:
+                    result = parse(cached) if parse else cached
+                except ValueError:
+                    await asyncio.to_thread(self.cache.delete, key)
+                else:
+                    self.metrics.incr('llm_cache_hits')
+                    return result
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        messages = [{"role": "user", "content": prompt}]
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.rate_limiter.wait()
+                self.metrics.incr('llm_requests')
+                try:
+                    response = await self.transport.complete(self.model, messages, self.temperature)
+                    break
+                except self.transport.retryable_errors:
+                    if attempt == self.max_retries:
+                        raise
+                    self.metrics.incr('llm_retries')
+                    await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+
+        result = parse(response) if parse else response
+        if key:
+            await asyncio.to_thread(self.cache.put, key, response)
+        return result
+
+    async def complete_many(self, prompts, parse=None):
+        """Runs prompts concurrently; failed prompts come back as their exception instead of a result."""
+        return await asyncio.gather(*(self.complete(prompt, parse) for prompt in prompts), return_exceptions=True)
+
+    async def close(self):
+        await self.transport.close()
+
+
+class BackgroundLoop:
+    """An event loop running in a daemon thread, letting synchronous code (the GUI) drive the
+    async client while its connections and rate limiter live on one long-lived loop."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="openai-loop", daemon=True)
+        self.thread.start()
+
+    def run(self, coroutine, timeout=None):
+        """Runs coroutine on the background loop and blocks until it finishes."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
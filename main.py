@@ -1,7 +1,22 @@
-from gui import CodeSmellGUI
-import tkinter as tk
+import sys
+
+
+def main(argv=None):
+    """Any command line arguments switch to the headless scanner, e.g. `python main.py path/to/repo -j 8`;
+    without any, the GUI opens."""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        from scanner import main as scan
+        return scan(argv)
+
+    import tkinter as tk
+    from gui import CodeSmellGUI
 
-if __name__ == '__main__':
     root = tk.Tk()
     app = CodeSmellGUI(root)
     root.mainloop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
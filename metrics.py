@@ -0,0 +1,145 @@
+import cProfile
+import json
+import logging
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger("codesniffer")
+
+
+class Metrics:
+    """Collects per-stage wall time and named counters for one run.
+
+    Stages used by the pipeline: read, parse, extract, fingerprint (building fingerprints while
+    extracting), fingerprint_lookup (the detector collecting them), pair_generation (candidate pairs),
+    similarity (scoring only, see timed()), subtree_hash, clone_groups and llm. None of these contains
+    another; the scanner's scan stage is the total wall time of the run, around all of them.
+    Counters include pairs_considered, pairs_skipped_class, pairs_skipped_same_file, pairs_skipped_wrapper, duplicates,
+    cache_hits, cache_misses, clone_cache_hits, clone_cache_misses, index_cache_hits, index_cache_misses
+    and llm_cache_hits. Optionally wraps the run in cProfile and/or tracemalloc (see start() and stop())."""
+    enabled = True
+
+    def __init__(self, profile_path=None, trace_memory=False):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+        self.profiler = None
+        self.peak_memory = None
+        self._nested = []  # per active timed() step, the time billed meanwhile to timed() stages inside it
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def incr(self, name, amount=1):
+        self.counters[name] += amount
+
+    def timed(self, name, iterable):
+        """Yields from iterable, billing to stage name only the time spent producing the items, not the
+        time the consumer spends between them. Time billed to a timed() stage that iterable itself
+        consumes (e.g. candidate pairs generated lazily while scoring) is not billed to name as well.
+        Counts as one call."""
+        iterator = iter(iterable)
+        seconds = 0.0
+        try:
+            while True:
+                self._nested.append(0.0)
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed = time.perf_counter() - start
+                    seconds += elapsed - self._nested.pop()
+                    if self._nested:
+                        self._nested[-1] += elapsed
+                yield item
+        finally:
+            self.seconds[name] += seconds
+            self.calls[name] += 1
+
+    def merge(self, report):
+        """Adds a report() dict from another process (e.g. a scanner worker) into this one."""
+        for name, stage in report.get('stages', {}).items():
+            self.seconds[name] += stage['seconds']
+            self.calls[name] += stage['calls']
+        for name, value in report.get('counters', {}).items():
+            self.counters[name] += value
+
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            self.profiler = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def report(self):
+        report = {
+            'stages': {name: {'seconds': round(self.seconds[name], 6), 'calls': self.calls[name]}
+                       for name in self.seconds},
+            'counters': dict(self.counters),
+        }
+        if self.peak_memory is not None:
+            report['peak_memory_bytes'] = self.peak_memory
+        if self.profile_path:
+            report['profile'] = self.profile_path
+        return report
+
+    def write(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def log(self):
+        """Logs the stage timings and counters at DEBUG level."""
+        for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            logger.debug("stage %s: %.4fs in %d calls", name, self.seconds[name], self.calls[name])
+        for name, value in sorted(self.counters.items()):
+            logger.debug("counter %s: %d", name, value)
+        if self.peak_memory is not None:
+            logger.debug("peak traced memory: %d bytes", self.peak_memory)
+
+
+class NullMetrics:
+    """Drop-in for Metrics when instrumentation is off: every call is a no-op."""
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def incr(self, name, amount=1):
+        pass
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def merge(self, report):
+        pass
+
+    def log(self):
+        pass
+
+    def report(self):
+        return {}
+
+
+NULL_METRICS = NullMetrics()
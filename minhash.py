@@ -0,0 +1,64 @@
+import random
+import zlib
+from collections import defaultdict
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+class MinHasher:
+    """Builds MinHash signatures for token sets using num_perm universal hash functions.
+    Hashing is seeded and based on crc32, so signatures are stable across processes and runs."""
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+
+    def signature(self, tokens):
+        """Returns a tuple of num_perm minimum hash values for the given set of strings."""
+        hashes = [zlib.crc32(token.encode()) for token in tokens]
+        if not hashes:
+            return (MAX_HASH,) * self.num_perm
+        return tuple(
+            min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes)
+            for a, b in self.permutations
+        )
+
+
+class LSHIndex:
+    """Banded locality-sensitive hashing over MinHash signatures.
+
+    Signatures are cut into `bands` bands of `rows` values each; two items become a candidate
+    pair when at least one band matches exactly. The similarity at which a pair has a 50% chance
+    of colliding is roughly (1 / bands) ** (1 / rows): more bands or fewer rows raise recall,
+    fewer bands or more rows prune more pairs."""
+
+    def __init__(self, bands=16, rows=4):
+        self.bands = bands
+        self.rows = rows
+        self.buckets = defaultdict(list)
+
+    @property
+    def num_perm(self):
+        return self.bands * self.rows
+
+    def insert(self, key, signature):
+        if len(signature) < self.num_perm:
+            raise ValueError(f"Signature has {len(signature)} values, index needs {self.num_perm}")
+        for band in range(self.bands):
+            start = band * self.rows
+            self.buckets[(band, signature[start:start + self.rows])].append(key)
+
+    def candidate_pairs(self):
+        """Returns the set of (key1, key2) pairs, key1 < key2, that share at least one band."""
+        pairs = set()
+        for keys in self.buckets.values():
+            if len(keys) < 2:
+                continue
+            for i in range(len(keys)):
+                for j in range(i + 1, len(keys)):
+                    a, b = keys[i], keys[j]
+                    pairs.add((a, b) if a < b else (b, a))
+        return pairs
@@ -0,0 +1,143 @@
+import json
+import os
+from dataclasses import asdict, dataclass, field
+
+from cache import TOOL_VERSION
+
+RULES = {
+    'long-function': "Function is longer than the configured maximum lines of code.",
+    'excess-parameters': "Function takes more parameters than the configured maximum.",
+    'structural-duplicate': "Two functions have a near-identical AST structure.",
+    'subtree-clone': "A statement or block is repeated, identically or with only names and literals changed.",
+}
+
+
+@dataclass
+class Finding:
+    """One code smell, located in a file; the unit written by the streaming writers."""
+    rule_id: str
+    message: str
+    file_path: str
+    function: str  # None for findings that aren't tied to one function (subtree clones)
+    line: int = None
+    end_line: int = None
+    details: dict = field(default_factory=dict)
+    related: list = field(default_factory=list)  # [{'function', 'line', 'end_line'[, 'file_path']}]
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def iter_findings(file_path, detection, progress=None, index=None):
+    """Turns a CodeSmellDetector's smells and duplicates into Findings as soon as each one is produced.
+    With a SimilarityIndex of the detector's functions, duplicates are read from it instead of scored."""
+    for kind, fn in detection.iter_code_smells():
+        if kind == 'long_functions':
+            yield Finding('long-function', f"{fn['name']} has {fn['loc']} lines (max {detection.MAX_LOC})",
+                          file_path, fn['name'], fn.get('lineno'), fn.get('end_lineno'), {'loc': fn['loc']})
+        else:
+            count = len(fn['parameters'])
+            yield Finding('excess-parameters', f"{fn['name']} takes {count} parameters (max {detection.MAX_PARAMS})",
+                          file_path, fn['name'], fn.get('lineno'), fn.get('end_lineno'),
+                          {'parameters': fn['parameters']})
+
+    records = detection.iter_indexed_duplicates(index) if index is not None else \
+        detection.iter_duplicate_records(progress)
+    for fn1, fn2, similarity in records:
+        yield duplicate_finding(file_path, fn1, fn2, similarity)
+
+
+def duplicate_finding(file_path, fn1, fn2, similarity, other_file_path=None):
+    """The structural-duplicate Finding of fn1 (in file_path) and fn2, which lives in other_file_path
+    when that is given (cross-file duplicates, see shards.py)."""
+    related = {'function': fn2['name'], 'line': fn2.get('lineno'), 'end_line': fn2.get('end_lineno')}
+    if other_file_path is not None:
+        related['file_path'] = other_file_path
+    return Finding('structural-duplicate', f"{fn1['name']} and {fn2['name']} are structurally similar "
+                                           f"(similarity {similarity})",
+                   file_path, fn1['name'], fn1.get('lineno'), fn1.get('end_lineno'),
+                   {'similarity': similarity, 'duplicate_of': fn2['name']}, [related])
+
+
+def clone_findings(groups):
+    """Turns clones.CloneGroups into Findings located at the first member, with the others as related."""
+    for group in groups:
+        (file_path, unit, line, end_line), *others = group.members
+        yield Finding('subtree-clone', f"{group.kind.capitalize()} clone of a {group.size}-node "
+                                       f"{'statement' if unit == 'stmt' else 'block'} in {len(group.members)} places",
+                      file_path, None, line, end_line, {'kind': group.kind, 'size': group.size},
+                      [{'function': None, 'line': other_line, 'end_line': other_end, 'file_path': other_path}
+                       for other_path, _, other_line, other_end in others])
+
+
+class JsonLinesWriter:
+    """Writes one JSON object per finding and flushes it, so consumers can tail the output."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def write(self, finding):
+        self.stream.write(json.dumps(finding.to_dict()) + "\n")
+        self.stream.flush()
+        self.count += 1
+
+    def close(self):
+        self.stream.flush()
+
+
+class SarifWriter:
+    """Streams findings into a SARIF 2.1.0 log: the header is written up front, each result as it
+    arrives and the closing brackets on close(), so memory does not grow with the number of findings.
+    File paths are written relative to root_dir when given."""
+
+    def __init__(self, stream, root_dir=None):
+        self.stream = stream
+        self.root_dir = root_dir
+        self.count = 0
+        driver = {
+            'name': 'codeSniffer',
+            'version': TOOL_VERSION,
+            'rules': [{'id': rule_id, 'shortDescription': {'text': text}} for rule_id, text in RULES.items()],
+        }
+        header = json.dumps({
+            '$schema': 'https://json.schemastore.org/sarif-2.1.0.json',
+            'version': '2.1.0',
+            'runs': [{'tool': {'driver': driver}, 'results': []}],
+        })
+        # everything before the closing "]}]}" of the empty results list
+        self.stream.write(header[:-len(']}]}')])
+
+    def _uri(self, file_path):
+        if self.root_dir and os.path.isdir(self.root_dir):
+            file_path = os.path.relpath(file_path, self.root_dir)
+        return file_path.replace(os.sep, '/')
+
+    def _location(self, file_path, line, end_line, function):
+        location = {'physicalLocation': {'artifactLocation': {'uri': self._uri(file_path)}}}
+        if line:
+            location['physicalLocation']['region'] = {'startLine': line, 'endLine': end_line or line}
+        if function:
+            location['logicalLocations'] = [{'name': function, 'kind': 'function'}]
+        return location
+
+    def write(self, finding):
+        result = {
+            'ruleId': finding.rule_id,
+            'level': 'warning',
+            'message': {'text': finding.message},
+            'locations': [self._location(finding.file_path, finding.line, finding.end_line, finding.function)],
+            'properties': finding.details,
+        }
+        if finding.related:
+            result['relatedLocations'] = [
+                dict(self._location(r.get('file_path', finding.file_path), r['line'], r['end_line'], r['function']),
+                     id=k)
+                for k, r in enumerate(finding.related)
+            ]
+        self.stream.write(("," if self.count else "") + json.dumps(result))
+        self.count += 1
+
+    def close(self):
+        self.stream.write("]}]}\n")
+        self.stream.flush()
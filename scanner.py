@@ -0,0 +1,510 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from contextlib import contextmanager
+from multiprocessing import Pool
+
+import detector
+from cache import DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, AnalysisCache
+from clones import CloneIndex, SubtreeHasher
+from extractor import CodeParser, FunctionExtractor, SourceFile
+from function_table import FunctionTable
+from metrics import NULL_METRICS, Metrics
+from reporters import Finding, JsonLinesWriter, SarifWriter, clone_findings, iter_findings
+from shards import ShardWriter, parse_shard, shard_of
+from similarity_index import DEFAULT_FLOOR
+from watch import IncrementalAnalysis, create_watcher
+
+SKIP_DIRS = {'.git', '.hg', '.svn', '.tox', '.nox', '.venv', 'venv', '__pycache__', 'node_modules'}
+# AnalysisCache lookup counters summed into the report totals: each worker has its own cache connection
+CACHE_TOTALS = {'clone_hits': 'clone_cache_hits', 'clone_misses': 'clone_cache_misses',
+                'index_hits': 'index_cache_hits', 'index_misses': 'index_cache_misses'}
+
+
+class FileTimeoutError(Exception):
+    """Raised inside a worker when a single file takes longer than the per-file timeout."""
+
+
+def iter_python_files(root):
+    """Walks a directory tree (or accepts a single file) and yields the paths of all .py files."""
+    if os.path.isfile(root):
+        yield root
+        return
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(d for d in dir_names if d not in SKIP_DIRS)
+        for file_name in sorted(file_names):
+            if file_name.endswith('.py'):
+                yield os.path.join(dir_path, file_name)
+
+
+def _relative_path(file_path, root):
+    """file_path as recorded in shard indexes: relative to the scanned root, the same on every machine."""
+    return os.path.basename(file_path) if os.path.isfile(root) else os.path.relpath(file_path, root)
+
+
+def _raise_timeout(signum, frame):
+    raise FileTimeoutError()
+
+
+def _install_timeout_handler():
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+@contextmanager
+def _file_timeout(timeout):
+    """Raises FileTimeoutError inside the block once timeout seconds pass (no-op without SIGALRM)."""
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+_worker_cache = None  # each process opens its own connection to the shared cache file
+
+
+def _open_worker_cache(cache_path):
+    global _worker_cache
+    _worker_cache = AnalysisCache(cache_path) if cache_path else None
+
+
+def _init_worker(cache_path=None):
+    # Ctrl+C is handled by the parent, which tears the pool down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _install_timeout_handler()
+    _open_worker_cache(cache_path)
+
+
+def extract_file_functions(file_path, source=None, metrics=NULL_METRICS, parser=None):
+    """Parses a file (unless an already built CodeParser is given) and returns its functions as a
+    FunctionTable: fingerprinted, with no references to the AST left."""
+    if parser is None:
+        with metrics.stage('parse'):
+            parser = CodeParser(file_path, source)
+    with metrics.stage('extract'):
+        extractor = FunctionExtractor(parser.get_ASTree(), file_path, parser.get_source())
+        records = extractor.extract_functions()
+    with metrics.stage('fingerprint'):
+        return FunctionTable.from_records(records, file_path)
+
+
+def load_file_functions(file_path, thresholds, cache=None, metrics=NULL_METRICS, clone_min_nodes=None,
+                        similarity_floor=None):
+    """Returns (functions, cached, clone_units, similarity_index): the file's FunctionTable, from the
+    cache when the content is unchanged, otherwise freshly extracted (and stored). clone_units are the
+    clones.SubtreeHasher units of the file when clone_min_nodes is set, otherwise None; the file is
+    parsed at most once for both. With a cache and a similarity_floor, similarity_index is the file's
+    cached (or newly built and stored) SimilarityIndex, so reruns with other thresholds skip scoring."""
+    with metrics.stage('read'):
+        source = SourceFile.from_path(file_path)
+    key = cache.make_key(source.data) if cache else None
+    functions = cache.get(key) if cache else None
+    cached = functions is not None
+    if cache:
+        metrics.incr('cache_hits' if cached else 'cache_misses')
+
+    clone_units = clone_key = None
+    if clone_min_nodes is not None and cache:
+        clone_key = cache.make_key(source.data, {'clone_min_nodes': clone_min_nodes})
+        clone_units = cache.get_clone_units(clone_key)
+        metrics.incr('clone_cache_hits' if clone_units is not None else 'clone_cache_misses')
+
+    parser = None
+    if not cached or (clone_min_nodes is not None and clone_units is None):
+        with metrics.stage('parse'):
+            parser = CodeParser(file_path, source)
+    if not cached:
+        functions = extract_file_functions(file_path, source, metrics, parser)
+        if cache:
+            cache.put(key, functions)
+    if clone_min_nodes is not None and clone_units is None:
+        with metrics.stage('subtree_hash'):
+            clone_units = SubtreeHasher(clone_min_nodes).units(parser.get_ASTree())
+        if cache:
+            cache.put_clone_units(clone_key, clone_units)
+
+    similarity_index = None
+    if similarity_floor is not None and cache:
+        detection = detector.CodeSmellDetector(functions, metrics=metrics, **thresholds)
+        floor = min(similarity_floor, detection.SIMILARITY_THRESHOLD)
+        index_key = cache.make_key(source.data, dict(thresholds, similarity_floor=floor))
+        similarity_index = cache.get_similarity_index(index_key)
+        metrics.incr('index_cache_hits' if similarity_index is not None else 'index_cache_misses')
+        if similarity_index is None:
+            similarity_index = detection.build_similarity_index(floor)
+            cache.put_similarity_index(index_key, similarity_index)
+    return functions, cached, clone_units, similarity_index
+
+
+def analyze_file(file_path, thresholds, cache=None, metrics=NULL_METRICS, clone_min_nodes=None,
+                 similarity_floor=None, keep_functions=False):
+    """Runs CodeParser -> FunctionExtractor -> CodeSmellDetector on a single file.
+    With a cache, unchanged files skip straight to detection.
+    'findings' is an iterator of finding dicts, produced as the detector finds them, so even one large
+    file can be streamed (a worker collects them into a list, see _scan_task). Everything else is plain
+    data; with clone_min_nodes set it includes the file's subtree hash units for the repository-wide
+    CloneIndex, with keep_functions its FunctionTable (as 'function_table') for the shard index."""
+    functions, cached, clone_units, similarity_index = load_file_functions(
+        file_path, thresholds, cache, metrics, clone_min_nodes, similarity_floor)
+    detection = detector.CodeSmellDetector(functions, metrics=metrics, **thresholds)
+    result = {
+        'cached': cached,
+        'functions': len(functions),
+        'findings': (finding.to_dict() for finding in iter_findings(file_path, detection, index=similarity_index)),
+        'clone_units': clone_units,
+    }
+    if keep_functions:
+        result['function_table'] = functions
+    return result
+
+
+def summarize_findings(findings):
+    """Groups finding dicts into the per-file shape of the JSON report."""
+    summary = {'long_functions': [], 'excess_parameters': [], 'duplicates': []}
+    for finding in findings:
+        details = finding['details']
+        if finding['rule_id'] == 'long-function':
+            summary['long_functions'].append({'name': finding['function'], 'loc': details['loc'],
+                                              'line': finding['line']})
+        elif finding['rule_id'] == 'excess-parameters':
+            summary['excess_parameters'].append({'name': finding['function'], 'parameters': details['parameters'],
+                                                 'line': finding['line']})
+        else:
+            summary['duplicates'].append([finding['function'], details['duplicate_of'], details['similarity']])
+    return summary
+
+
+def _scan_task(task):
+    """Worker entry point: analyzes one file under the per-file timeout and never raises.
+    The findings are collected under the timeout too, so the result is plain data that can travel back
+    from a worker process. The worker cache's lookups for the file travel back in result['cache_lookups'],
+    and, when metrics are collected, the file's report in result['metrics']."""
+    file_path, thresholds, timeout, collect_metrics, clone_min_nodes, similarity_floor, keep_functions = task
+    try:
+        with _file_timeout(timeout):
+            metrics = Metrics() if collect_metrics else NULL_METRICS
+            before = _worker_cache.lookups() if _worker_cache else {}
+            result = analyze_file(file_path, thresholds, _worker_cache, metrics, clone_min_nodes, similarity_floor,
+                                  keep_functions)
+            result['findings'] = list(result['findings'])
+            result['cache_lookups'] = {name: count - before[name]
+                                       for name, count in (_worker_cache.lookups() if _worker_cache else {}).items()}
+            if collect_metrics:
+                result['metrics'] = metrics.report()
+            return file_path, result, None
+    except FileTimeoutError:
+        return file_path, None, f"timed out after {timeout}s"
+    except Exception as e:
+        return file_path, None, f"{type(e).__name__}: {e}"
+
+
+class RepositoryScanner:
+    """Analyzes every Python file under a directory tree across a pool of worker processes.
+
+    - workers: number of processes (defaults to the CPU count, 1 runs in-process)
+    - timeout: per-file limit in seconds (only enforced where SIGALRM exists)
+    - cache_path: SQLite analysis cache shared by all workers (None disables caching)
+    - metrics: a metrics.Metrics that receives the merged stage timings and counters of all workers
+    - clone_min_nodes: also find exact and parameterized statement/block clones across the whole tree
+      with clones.SubtreeHasher, ignoring fragments smaller than this many AST nodes (None disables)
+    - similarity_floor: with a cache, every pair scoring above it is cached per file in a SimilarityIndex,
+      so later scans with a different SIMILARITY_THRESHOLD or min_complexity_threshold skip scoring
+    - shard: (K, N) to scan only the K-th of N disjoint shards of the files (see shards.shard_of),
+      so N machines can split one tree
+    - index_path: also write the scanned functions to this shards.ShardWriter index file, for the
+      cross-shard duplicate merge of shards.py
+    - thresholds: keyword arguments forwarded to CodeSmellDetector"""
+
+    def __init__(self, workers=None, timeout=None, chunksize=8, cache_path=None, metrics=NULL_METRICS,
+                 clone_min_nodes=None, similarity_floor=DEFAULT_FLOOR, shard=None, index_path=None, **thresholds):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.chunksize = chunksize
+        self.cache_path = cache_path
+        self.metrics = metrics
+        self.clone_min_nodes = clone_min_nodes
+        self.similarity_floor = similarity_floor if cache_path else None
+        self.shard = shard
+        self.index_path = index_path
+        self.thresholds = thresholds
+
+    def iter_files(self, root):
+        """The .py files under root that belong to this scanner's shard (all of them without a shard)."""
+        for file_path in iter_python_files(root):
+            if self._in_shard(file_path, root):
+                yield file_path
+
+    def _in_shard(self, file_path, root):
+        return self.shard is None or shard_of(_relative_path(file_path, root), self.shard[1]) == self.shard[0]
+
+    def _shard_writer(self):
+        return ShardWriter(self.shard or (1, 1)) if self.index_path else None
+
+    def iter_results(self, root):
+        """Yields (file_path, result, error) as soon as each file is done, in completion order."""
+        tasks = ((path, self.thresholds, self.timeout, self.metrics.enabled, self.clone_min_nodes,
+                  self.similarity_floor, self.index_path is not None) for path in self.iter_files(root))
+        if self.workers == 1:
+            _install_timeout_handler()
+            _open_worker_cache(self.cache_path)
+            yield from map(_scan_task, tasks)
+            return
+        with Pool(self.workers, initializer=_init_worker, initargs=(self.cache_path,)) as pool:
+            yield from pool.imap_unordered(_scan_task, tasks, chunksize=self.chunksize)
+
+    def scan(self, root):
+        """Scans the tree and merges the per-file results into a single report."""
+        report = {'files': {}, 'errors': {}, 'totals': _empty_totals()}
+        clone_index = CloneIndex()
+        shard_writer = self._shard_writer()
+        for file_path, result, error in self.iter_results(root):
+            if error:
+                report['errors'][file_path] = error
+                self.metrics.incr('file_errors')
+                continue
+            self.metrics.merge(result.pop('metrics', {}))
+            if result['clone_units'] is not None:
+                clone_index.add(file_path, result['clone_units'])
+            if shard_writer is not None:
+                shard_writer.add(_relative_path(file_path, root), result.pop('function_table'))
+            file_report = {'functions': result['functions'], **summarize_findings(result['findings'])}
+            report['files'][file_path] = file_report
+            totals = report['totals']
+            _add_file_totals(totals, result)
+            for key in ('long_functions', 'excess_parameters', 'duplicates'):
+                totals[key] += len(file_report[key])
+        report['files'] = dict(sorted(report['files'].items()))
+        report['errors'] = dict(sorted(report['errors'].items()))
+        if self.clone_min_nodes is not None:
+            with self.metrics.stage('clone_groups'):
+                report['clones'] = [group.to_dict() for group in clone_index.groups()]
+            report['totals']['clones'] = len(report['clones'])
+        if shard_writer is not None:
+            shard_writer.write(self.index_path)
+        return report
+
+    def stream(self, root, writer):
+        """Writes every Finding to writer as soon as its file is done and keeps none of them, so memory
+        does not grow with the number of findings. A file's findings are collected under its timeout and
+        written only once the whole file succeeded, so a failed file contributes nothing (nor to the clone
+        groups or the shard index). Subtree clones need the whole tree and are written last.
+        Returns {'totals': ..., 'errors': ...}."""
+        totals, errors = _empty_totals(), {}
+        rule_totals = {'long-function': 'long_functions', 'excess-parameters': 'excess_parameters',
+                       'structural-duplicate': 'duplicates', 'subtree-clone': 'clones'}
+        clone_index = CloneIndex()
+        shard_writer = self._shard_writer()
+
+        def emit(finding):
+            writer.write(finding)
+            totals[rule_totals[finding.rule_id]] += 1
+
+        for file_path, result, error in self.iter_results(root):
+            if error:
+                errors[file_path] = error
+                self.metrics.incr('file_errors')
+                continue
+            self.metrics.merge(result.pop('metrics', {}))
+            _add_file_totals(totals, result)
+            if result['clone_units'] is not None:
+                clone_index.add(file_path, result['clone_units'])
+            if shard_writer is not None:
+                shard_writer.add(_relative_path(file_path, root), result.pop('function_table'))
+            for finding in result['findings']:
+                emit(Finding(**finding))
+
+        if self.clone_min_nodes is not None:
+            with self.metrics.stage('clone_groups'):
+                groups = clone_index.groups()
+            for finding in clone_findings(groups):
+                emit(finding)
+        if shard_writer is not None:
+            shard_writer.write(self.index_path)
+        return {'totals': totals, 'errors': errors}
+
+    def watch(self, root, write, watcher=None):
+        """Re-analyzes the files under root as they change, until interrupted. Every file gets its
+        watch.IncrementalAnalysis up front (a file that does not parse yet gets it on its next change), so
+        even the first edit of a file re-parses and rescores only the functions it touched. With a shard,
+        only the files of that shard are watched, as they are scanned.
+        write(file_path, result) receives the file's summary in the shape of the JSON report plus
+        'incremental' and 'seconds', or {'error': ...} (e.g. mid-edit syntax errors, the previous state is
+        kept) or {'deleted': True}."""
+        watcher = watcher or create_watcher(root, skip_dirs=SKIP_DIRS)  # first, so edits made meanwhile count
+        analyses = {}
+        try:
+            for file_path in self.iter_files(root):
+                try:
+                    analyses[file_path] = self._new_analysis(file_path)
+                except Exception:
+                    pass  # reported, and retried, when the file changes
+            while True:
+                for file_path in sorted(watcher.changes()):
+                    if self._in_shard(file_path, root):
+                        write(file_path, self._watch_update(analyses, file_path))
+        finally:
+            watcher.close()
+
+    def _watch_update(self, analyses, file_path):
+        if not os.path.exists(file_path):
+            analyses.pop(file_path, None)
+            return {'deleted': True}
+        start = time.perf_counter()
+        analysis = analyses.get(file_path)
+        try:
+            if analysis is None:
+                analysis = analyses[file_path] = self._new_analysis(file_path)
+                incremental = False
+            else:
+                incremental = analysis.update()['incremental']
+        except Exception as e:
+            return {'error': f"{type(e).__name__}: {e}"}
+        detection = detector.CodeSmellDetector(analysis.records, metrics=self.metrics, **self.thresholds)
+        findings = [finding.to_dict() for finding in iter_findings(file_path, detection, index=analysis)]
+        return {'functions': len(analysis.records), **summarize_findings(findings), 'incremental': incremental,
+                'seconds': round(time.perf_counter() - start, 4)}
+
+    def _new_analysis(self, file_path):
+        # the thresholds are fixed for the whole session, so only pairs above them are kept
+        floor = self.thresholds.get('SIMILARITY_THRESHOLD', detector.CodeSmellDetector.DEFAULT_SIMILARITY_THRESHOLD)
+        return IncrementalAnalysis(file_path, floor=floor, **self.thresholds)
+
+
+def _empty_totals():
+    return dict.fromkeys(('files', 'cached_files', 'functions', 'long_functions', 'excess_parameters',
+                          'duplicates', 'clones', *CACHE_TOTALS.values()), 0)
+
+
+def _add_file_totals(totals, result):
+    """Adds one analyzed file (a _scan_task result) to the report totals."""
+    totals['files'] += 1
+    totals['cached_files'] += result['cached']
+    totals['functions'] += result['functions']
+    for name, total in CACHE_TOTALS.items():
+        totals[total] += result['cache_lookups'].get(name, 0)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Scan a directory tree for code smells without the GUI.")
+    parser.add_argument('root', help="directory (or single .py file) to scan")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="per-file timeout in seconds (0 disables)")
+    parser.add_argument('-o', '--output', default='-', help="where to write the report (default: stdout)")
+    parser.add_argument('--format', choices=('json', 'jsonl', 'sarif'), default='json',
+                        help="'json': one merged report at the end; 'jsonl' and 'sarif' stream findings as "
+                             "they are found (summary goes to stderr)")
+    parser.add_argument('--no-cache', action='store_true', help="don't read or write the analysis cache")
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH, help="SQLite file for the analysis cache")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="cache size limit in MiB; least recently used entries are evicted")
+    parser.add_argument('--cache-stats', action='store_true', help="print cache statistics to stderr")
+    parser.add_argument('--metrics', metavar='PATH', help="write stage timings and counters as JSON to PATH")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="write cProfile stats of the main process to PATH (use -j 1 to profile the analysis)")
+    parser.add_argument('--trace-memory', action='store_true', help="record peak traced memory in the metrics")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="log debug diagnostics, including the stage timings and counters, to stderr")
+    parser.add_argument('--max-loc', type=int, default=15)
+    parser.add_argument('--max-params', type=int, default=3)
+    parser.add_argument('--similarity', type=float, default=0.75)
+    parser.add_argument('--min-complexity', type=int, default=2)
+    parser.add_argument('--duplicate-mode', choices=detector.CodeSmellDetector.DUPLICATE_MODES, default='exact',
+                        help="'exact' compares every pair, 'lsh' only pairs colliding in a MinHash/LSH index, "
+                             "'bitset' scores every pair with NumPy")
+    parser.add_argument('--lsh-bands', type=int, default=16, help="more bands: higher recall, more pairs verified")
+    parser.add_argument('--lsh-rows', type=int, default=4, help="more rows per band: fewer, more similar candidates")
+    parser.add_argument('--similarity-floor', type=float, default=DEFAULT_FLOOR,
+                        help="cache every pair scoring above this so reruns with any --similarity or "
+                             "--min-complexity at or above it are answered from the cache")
+    parser.add_argument('--clones', action='store_true',
+                        help="also report exact and parameterized statement/block clones across the whole tree "
+                             "using normalized AST subtree hashes")
+    parser.add_argument('--clone-min-nodes', type=int, default=10,
+                        help="smallest fragment, in AST nodes, reported by --clones")
+    parser.add_argument('--shard', type=parse_shard, metavar='K/N',
+                        help="scan only the K-th of N disjoint shards of the files, e.g. one per CI machine")
+    parser.add_argument('--write-index', metavar='PATH',
+                        help="also write the scanned functions to a shard index file; merge the files of all "
+                             "shards with `python shards.py` to find duplicates across files and shards")
+    parser.add_argument('--watch', action='store_true',
+                        help="after the scan, keep re-analyzing files as they change and print one JSON line per "
+                             "changed file to stdout (only the edited functions are re-parsed and rescored; with "
+                             "--shard, only the files of that shard)")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+    cache_path = None if args.no_cache else args.cache_path
+    instrumented = args.metrics or args.profile or args.trace_memory or args.verbose
+    metrics = Metrics(profile_path=args.profile, trace_memory=args.trace_memory) if instrumented else NULL_METRICS
+    scanner = RepositoryScanner(
+        workers=args.workers, timeout=args.timeout or None, cache_path=cache_path, metrics=metrics,
+        clone_min_nodes=args.clone_min_nodes if args.clones else None, similarity_floor=args.similarity_floor,
+        shard=args.shard, index_path=args.write_index,
+        MAX_LOC=args.max_loc, MAX_PARAMS=args.max_params,
+        SIMILARITY_THRESHOLD=args.similarity, min_complexity_threshold=args.min_complexity,
+        duplicate_mode=args.duplicate_mode, lsh_bands=args.lsh_bands, lsh_rows=args.lsh_rows,
+    )
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    if metrics.enabled:
+        metrics.start()
+    try:
+        with metrics.stage('scan'):
+            if args.format == 'json':
+                report = scanner.scan(args.root)
+                json.dump(report, output, indent=2)
+                output.write('\n')
+            else:
+                writer = JsonLinesWriter(output) if args.format == 'jsonl' else SarifWriter(output, args.root)
+                report = scanner.stream(args.root, writer)
+                writer.close()
+                print(f"Summary: {json.dumps(report)}", file=sys.stderr)
+    except KeyboardInterrupt:
+        print("Scan interrupted.", file=sys.stderr)
+        return 130
+    finally:
+        if metrics.enabled:
+            metrics.stop()
+        if output is not sys.stdout:
+            output.close()
+
+    if cache_path:
+        cache = AnalysisCache(cache_path, max_bytes=args.cache_size * 1024 * 1024)
+        evicted = cache.evict()
+        if args.cache_stats:
+            # the lookups were made by the scan's own cache connections, as counted in the totals
+            totals = report['totals']
+            stats = cache.stats()
+            stats.update(hits=totals['cached_files'], misses=totals['files'] - totals['cached_files'],
+                         evicted=evicted, **{name: totals[total] for name, total in CACHE_TOTALS.items()})
+            print(f"Cache: {json.dumps(stats)}", file=sys.stderr)
+        cache.close()
+
+    if args.metrics:
+        metrics.write(args.metrics)
+    if args.verbose:
+        metrics.log()
+
+    if args.watch:
+        print(f"Watching {args.root} for changes (Ctrl+C to stop)", file=sys.stderr)
+        try:
+            scanner.watch(args.root, lambda file_path, result: print(json.dumps({'file': file_path, **result}),
+                                                                      flush=True))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
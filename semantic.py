@@ -0,0 +1,231 @@
+import ast
+import textwrap
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from extractor import CodeParser, FunctionExtractor, SourceFile
+
+# return shapes that say nothing about the value (a call or a variable may be anything)
+LOOSE_SHAPES = frozenset({'call', 'value', 'operation'})
+
+
+@dataclass(frozen=True, slots=True)
+class SemanticSignature:
+    """Cheap, name-independent summary of what a function does. Two functions computing the same
+    result with different logic normally still agree on their arity and return shape and share
+    some called names or data flow, so these pick the pairs worth asking an LLM about."""
+    arity: int
+    return_shape: frozenset
+    called_names: frozenset
+    data_flow: frozenset
+    node_count: int
+
+
+def _value_shape(value):
+    if value is None:
+        return 'none'
+    if isinstance(value, ast.Constant):
+        if value.value is None:
+            return 'none'
+        if isinstance(value.value, bool):
+            return 'bool'
+        return 'str' if isinstance(value.value, (str, bytes)) else 'number'
+    if isinstance(value, (ast.Compare, ast.BoolOp)) or (isinstance(value, ast.UnaryOp) and isinstance(value.op, ast.Not)):
+        return 'bool'
+    if isinstance(value, (ast.List, ast.Tuple, ast.Set, ast.Dict, ast.ListComp, ast.SetComp, ast.DictComp,
+                          ast.GeneratorExp)):
+        return 'collection'
+    if isinstance(value, ast.JoinedStr):
+        return 'str'
+    if isinstance(value, (ast.BinOp, ast.UnaryOp)):
+        return 'operation'
+    return 'call' if isinstance(value, ast.Call) else 'value'
+
+
+def _loaded_names(node):
+    return [n.id for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)]
+
+
+def _stored_names(node):
+    return [n.id for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)]
+
+
+def semantic_signature(node, is_method=False):
+    """Builds the SemanticSignature of a function node. Variable names are replaced by their role
+    (P parameter, V local, G anything else), so renaming never changes the data-flow fingerprint."""
+    args = node.args
+    positional = [a.arg for a in args.posonlyargs + args.args]
+    parameters = set(positional + [a.arg for a in args.kwonlyargs])
+    parameters.update(a.arg for a in (args.vararg, args.kwarg) if a is not None)
+    arity = len(positional) + len(args.kwonlyargs)
+    if is_method and positional and positional[0] in ('self', 'cls'):
+        arity -= 1
+    local_names = set(_stored_names(node)) - parameters
+
+    def role(name):
+        return 'P' if name in parameters else 'V' if name in local_names else 'G'
+
+    shapes, called, flow = set(), set(), set()
+    node_count = 0
+    for n in ast.walk(node):
+        node_count += 1
+        if isinstance(n, ast.Return):
+            shapes.add(_value_shape(n.value))
+            sources = _loaded_names(n.value) if n.value is not None else []
+            kind = type(n.value).__name__ if n.value is not None else 'None'
+            flow.update(f"{role(name)}>{kind}>R" for name in sources or ['-'])
+        elif isinstance(n, (ast.Yield, ast.YieldFrom)):
+            shapes.add('collection')
+            flow.update(f"{role(name)}>yield>R" for name in _loaded_names(n))
+        elif isinstance(n, (ast.Assign, ast.AnnAssign)) and n.value is not None:
+            targets = n.targets if isinstance(n, ast.Assign) else [n.target]
+            kind = type(n.value).__name__
+            for target in targets:
+                for stored in _stored_names(target):
+                    flow.update(f"{role(name)}>{kind}>{role(stored)}" for name in _loaded_names(n.value) or ['-'])
+        elif isinstance(n, ast.AugAssign):
+            for stored in _stored_names(n.target):
+                flow.update(f"{role(name)}>{type(n.op).__name__}>{role(stored)}" for name in _loaded_names(n.value))
+        elif isinstance(n, (ast.For, ast.AsyncFor, ast.comprehension)):
+            for stored in _stored_names(n.target):
+                flow.update(f"{role(name)}>iter>{role(stored)}" for name in _loaded_names(n.iter))
+        elif isinstance(n, (ast.If, ast.While, ast.IfExp)):
+            flow.update(f"{role(name)}>test" for name in _loaded_names(n.test))
+        elif isinstance(n, ast.Call):
+            if isinstance(n.func, ast.Name):
+                called.add(n.func.id)
+            elif isinstance(n.func, ast.Attribute):
+                called.add(n.func.attr)
+    if not shapes or not any(isinstance(n, ast.Return) and n.value is not None for n in ast.walk(node)):
+        shapes.add('none')  # falls off the end
+    return SemanticSignature(arity, frozenset(shapes), frozenset(called), frozenset(flow), node_count)
+
+
+def _jaccard(set1, set2):
+    union = len(set1 | set2)
+    return len(set1 & set2) / union if union else 0
+
+
+def compatible_returns(shape1, shape2):
+    """False when one function only returns None and the other never does, or when both return
+    definite but different kinds of value."""
+    if (shape1 == {'none'}) != (shape2 == {'none'}):
+        return False
+    return bool(shape1 & shape2) or bool((shape1 | shape2) & LOOSE_SHAPES)
+
+
+def candidate_score(sig1, sig2):
+    """How alike two signatures are, in [0, 1]; only meaningful for pairs with the same arity and
+    compatible return shapes."""
+    return (0.4 * _jaccard(sig1.data_flow, sig2.data_flow) + 0.3 * _jaccard(sig1.called_names, sig2.called_names)
+            + 0.3 * _jaccard(sig1.return_shape, sig2.return_shape))
+
+
+def semantic_candidates(signatures, max_pairs=20, min_score=0.2, min_nodes=6):
+    """Returns up to max_pairs (i, j, score) pairs of plausible semantic duplicates, best first.
+    Only functions with at least min_nodes AST nodes and the same arity are paired, and only when
+    their return shapes are compatible and candidate_score reaches min_score."""
+    by_arity = defaultdict(list)
+    for i, sig in enumerate(signatures):
+        if sig.node_count >= min_nodes:
+            by_arity[sig.arity].append(i)
+    pairs = []
+    for members in by_arity.values():
+        for a, i in enumerate(members):
+            for j in members[a + 1:]:
+                sig1, sig2 = signatures[i], signatures[j]
+                if not compatible_returns(sig1.return_shape, sig2.return_shape):
+                    continue
+                score = candidate_score(sig1, sig2)
+                if score >= min_score:
+                    pairs.append((i, j, round(score, 3)))
+    pairs.sort(key=lambda pair: (-pair[2], pair[0], pair[1]))
+    return pairs[:max_pairs]
+
+
+def estimate_tokens(text):
+    """Rough token count for budgeting prompts (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def token_batches(groups, sources, budget):
+    """Packs groups (lists of function keys) into batches whose combined source, counting each
+    function once, stays within budget tokens; a group larger than budget gets a batch of its own.
+    Returns [(function keys in first-seen order, groups)]."""
+    batches = []
+    keys, members, used = [], [], 0
+    for group in groups:
+        new = [key for key in dict.fromkeys(group) if key not in keys]
+        cost = sum(estimate_tokens(sources[key]) for key in new)
+        if members and used + cost > budget:
+            batches.append((keys, members))
+            keys, members, used = [], [], 0
+            new = list(dict.fromkeys(group))
+            cost = sum(estimate_tokens(sources[key]) for key in new)
+        keys = keys + new
+        members.append(group)
+        used += cost
+    if members:
+        batches.append((keys, members))
+    return batches
+
+
+def function_labels(functions):
+    """A unique label per function record: its qualname, plus its line when several functions share
+    the qualname (e.g. one redefined under an if)."""
+    counts = Counter(fn['qualname'] for fn in functions)
+    return [fn['qualname'] if counts[fn['qualname']] == 1 else f"{fn['qualname']} (line {fn['lineno']})"
+            for fn in functions]
+
+
+class FileFunctions:
+    """The functions of one source text with what the LLM prompts need: a unique label per function
+    (see function_labels), its source, span and indentation, and its SemanticSignature."""
+
+    def __init__(self, code):
+        source = SourceFile(code)
+        parser = CodeParser(None, source)
+        self.lines = source.lines
+        self.records = FunctionExtractor(parser.get_ASTree(), None, source).extract_functions()
+        self.labels = function_labels(self.records)
+        self.spans, self.indents, self.signatures = [], [], []
+        for fn in self.records:
+            node = fn.pop('node')
+            start = min([decorator.lineno for decorator in node.decorator_list] + [node.lineno])
+            self.spans.append((start, node.end_lineno))
+            self.indents.append(node.col_offset)
+            self.signatures.append(semantic_signature(node, fn['class_name'] is not None))
+
+    def source(self, i):
+        """Dedented source of function i, decorators included."""
+        start, end = self.spans[i]
+        return textwrap.dedent("\n".join(self.lines[start - 1:end]))
+
+    def positions_named(self, name):
+        """Positions of the functions a duplicate entry names: by label, else by qualname, else by bare
+        name, but only when a single function has it, so same-named methods of different classes are
+        never taken for one another."""
+        by_label = [i for i, label in enumerate(self.labels) if label == name]
+        if by_label:
+            return by_label
+        by_qualname = [i for i, fn in enumerate(self.records) if fn['qualname'] == name]
+        if by_qualname:
+            return by_qualname
+        by_name = [i for i, fn in enumerate(self.records) if fn['name'] == name]
+        return by_name if len(by_name) == 1 else []
+
+
+def splice_functions(lines, edits):
+    """Applies [(start, end, indent, new_source)] line-span replacements (1-based, inclusive; end =
+    start - 1 inserts before start) to lines and returns the new text. new_source is re-indented to
+    indent; an empty new_source deletes the span."""
+    result = list(lines)
+    # bottom-up, so earlier spans keep their line numbers; at one start, replace before inserting
+    for start, end, indent, new_source in sorted(edits, key=lambda edit: (edit[0], edit[1] >= edit[0]),
+                                                 reverse=True):
+        replacement = textwrap.indent(textwrap.dedent(new_source).strip('\n'), ' ' * indent).split('\n') \
+            if new_source.strip() else []
+        if end < start and replacement:
+            replacement.append('')  # keep inserted code apart from what follows
+        result[start - 1:end] = replacement
+    return "\n".join(result)
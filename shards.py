@@ -0,0 +1,320 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+import detector
+from function_table import StringTable
+from metrics import NULL_METRICS
+from reporters import JsonLinesWriter, SarifWriter, duplicate_finding
+
+MAGIC = b'CSFI'
+FORMAT_VERSION = 1
+# magic, version, reserved, shard K, shard N, files, strings, vocabulary, functions, ids
+HEADER = struct.Struct('<4sHHIIIIIII')
+# file, name, qualname, class (-1: none), lineno, end_lineno, loc, node_count, ids start,
+# parameter / structure / operation / called name counts, flags (1: wrapper, 2: async), nesting
+RECORD = struct.Struct('<IIIiIIIIIHHHHBB2x')
+WRAPPER, ASYNC = 1, 2
+
+
+def shard_of(relative_path, shards):
+    """Stable 1-based shard number of a file, from its path relative to the scanned root, so every
+    node of a distributed scan picks the same disjoint subset of files whatever its checkout path."""
+    return zlib.crc32(relative_path.replace(os.sep, '/').encode('utf-8', errors='surrogatepass')) % shards + 1
+
+
+def parse_shard(text):
+    """Parses 'K/N' (1 <= K <= N) into (K, N)."""
+    try:
+        k, n = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N, got {text!r}")
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(f"shard {k}/{n} out of range")
+    return k, n
+
+
+def _pack_strings(table):
+    blobs = [string.encode('utf-8', errors='surrogatepass') for string in table.strings]
+    offsets = array('I', accumulate((len(blob) for blob in blobs), initial=0))
+    return _little_endian(offsets) + _pad(b"".join(blobs))
+
+
+def _pad(data):
+    return data + b'\0' * (-len(data) % 4)
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _u32_view(view):
+    """u32 values of a little-endian buffer, without copying on little-endian machines."""
+    if sys.byteorder == 'little':
+        return view.cast('I')
+    values = array('I', view.tobytes())
+    values.byteswap()
+    return values
+
+
+class ShardWriter:
+    """Collects the function tables of the files of one shard and writes them as one index file.
+
+    The file holds, little-endian and each section 4-byte aligned: the HEADER (magic, format version,
+    shard K/N and the section sizes); a string table of file paths, names, parameters and called
+    names; the vocabulary of AST structure and operation tokens; one fixed-width RECORD per function
+    with its identity, LOC and fingerprint counts; and the u32 id pool the records point into."""
+
+    def __init__(self, shard=(1, 1)):
+        self.shard = shard
+        self.files = {}
+
+    def add(self, file_path, functions):
+        """file_path should be relative to the scanned root, so shards written on different machines agree."""
+        self.files[file_path] = functions
+
+    def to_bytes(self):
+        strings, vocabulary = StringTable(), StringTable()
+        records, ids = bytearray(), array('I')
+        count = 0
+        for file_path in sorted(self.files):
+            file_id = strings.intern(file_path)
+            for fn in self.files[file_path]:
+                fp = fn['fingerprint']
+                parameters = [strings.intern(parameter) for parameter in fn['parameters']]
+                # interned in token order: set order varies with the hash seed, the file must not
+                structure = sorted(vocabulary.intern(token) for token in sorted(fp.structure))
+                operations = sorted(vocabulary.intern(token) for token in sorted(fp.operations))
+                calls = [strings.intern(name) for name in fp.call_names]
+                class_name = fn.get('class_name')
+                records += RECORD.pack(
+                    file_id, strings.intern(fn['name']), strings.intern(fn.get('qualname', fn['name'])),
+                    -1 if class_name is None else strings.intern(class_name),
+                    fn['lineno'], fn['end_lineno'], fn['loc'], fp.node_count, len(ids),
+                    len(parameters), len(structure), len(operations), len(calls),
+                    (WRAPPER if fp.is_wrapper else 0) | (ASYNC if fn.get('is_async') else 0), fn.get('nesting', 0))
+                ids.extend(parameters + structure + operations + calls)
+                count += 1
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, self.shard[0], self.shard[1], len(self.files),
+                             len(strings), len(vocabulary), count, len(ids))
+        return b"".join([header, _pack_strings(strings), _pack_strings(vocabulary), bytes(records),
+                         _little_endian(ids)])
+
+    def write(self, path):
+        """Writes the index atomically (a reader never sees a half-written shard)."""
+        temporary = f"{path}.tmp"
+        with open(temporary, 'wb') as file:
+            file.write(self.to_bytes())
+        os.replace(temporary, path)
+
+
+class ShardIndex:
+    """One shard index file, memory-mapped: the file is never read whole and a record is only decoded
+    when accessed; indexing yields the same record dicts as a FunctionTable, plus 'file_path'.
+
+    The mapping bounds what reading an index costs, not what a merge costs: the cross-shard detector
+    decodes every record and keeps it, with its fingerprint, for the whole run, which is about 2 KB
+    per function (against about 150 bytes on disk). Decoded strings and vocabulary tokens are shared
+    between records."""
+
+    def __init__(self, path):
+        self.path = path
+        self.views = []
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load()
+        except Exception:
+            self.close()
+            raise
+        self._strings = {}  # decoded strings and vocabulary tokens by id; names repeat a lot
+        self._tokens = {}
+
+    def _load(self):
+        if len(self.map) < HEADER.size:
+            raise ValueError(f"{self.path} is not a shard index (too short)")
+        magic, version, _, k, n, self.file_count, strings, vocabulary, functions, ids = \
+            HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a shard index")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} has index format {version}, expected {FORMAT_VERSION}")
+        self.shard = (k, n)
+        self.count = functions
+        offset = HEADER.size
+        self.string_offsets, self.string_blob, offset = self._string_section(offset, strings)
+        self.vocab_offsets, self.vocab_blob, offset = self._string_section(offset, vocabulary)
+        self.records_offset = offset
+        offset += functions * RECORD.size
+        self.ids = self._view(offset, ids * 4, u32=True)
+        if offset + ids * 4 > len(self.map):
+            raise ValueError(f"{self.path} is truncated")
+
+    def _view(self, offset, size, u32=False):
+        view = memoryview(self.map)[offset:offset + size]
+        self.views.append(view)
+        if u32:
+            view = _u32_view(view)
+            if isinstance(view, memoryview):
+                self.views.append(view)
+        return view
+
+    def _string_section(self, offset, count):
+        offsets = self._view(offset, (count + 1) * 4, u32=True)
+        offset += (count + 1) * 4
+        size = offsets[count] if count else 0
+        blob = self._view(offset, size)
+        return offsets, blob, offset + size + (-size % 4)
+
+    def _string(self, string_id):
+        string = self._strings.get(string_id)
+        if string is None:
+            start, end = self.string_offsets[string_id], self.string_offsets[string_id + 1]
+            string = self._strings[string_id] = str(self.string_blob[start:end], 'utf-8', 'surrogatepass')
+        return string
+
+    def _token(self, token_id):
+        token = self._tokens.get(token_id)
+        if token is None:
+            start, end = self.vocab_offsets[token_id], self.vocab_offsets[token_id + 1]
+            token = self._tokens[token_id] = str(self.vocab_blob[start:end], 'utf-8')
+        return token
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        (file_id, name_id, qualname_id, class_id, lineno, end_lineno, loc, node_count, start,
+         params, structure, operations, calls, flags, nesting) = RECORD.unpack_from(
+            self.map, self.records_offset + i * RECORD.size)
+        ids = self.ids[start:start + params + structure + operations + calls]
+        fingerprint = detector.FunctionFingerprint(
+            structure=frozenset(self._token(t) for t in ids[params:params + structure]),
+            operations=frozenset(self._token(t) for t in ids[params + structure:params + structure + operations]),
+            node_count=node_count,
+            is_wrapper=bool(flags & WRAPPER),
+            call_names=tuple(self._string(s) for s in ids[params + structure + operations:]),
+        )
+        return {
+            'file_path': self._string(file_id),
+            'name': self._string(name_id),
+            'qualname': self._string(qualname_id),
+            'class_name': None if class_id < 0 else self._string(class_id),
+            'is_async': bool(flags & ASYNC),
+            'nesting': nesting,
+            'parameters': [self._string(s) for s in ids[:params]],
+            'loc': loc,
+            'lineno': lineno,
+            'end_lineno': end_lineno,
+            'fingerprint': fingerprint,
+        }
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def close(self):
+        for view in reversed(self.views):
+            view.release()
+        self.map.close()
+
+
+class MergedShards:
+    """Several ShardIndexes seen as one function sequence, the input of the cross-shard detector.
+    Records are the ShardIndex ones, unchanged: the detector tells same-named classes of different
+    files apart by their 'file_path'."""
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.starts = list(accumulate((len(shard) for shard in shards), initial=0))
+
+    def __len__(self):
+        return self.starts[-1]
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        k = bisect_right(self.starts, i) - 1
+        return self.shards[k][i - self.starts[k]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def iter_cross_file_duplicates(shards, metrics=NULL_METRICS, **thresholds):
+    """Runs duplicate detection over the functions of all shards together and yields a Finding for
+    every duplicate pair whose functions live in different files (same-file duplicates are already
+    reported by the scan of each shard, so their pairs are not even scored)."""
+    functions = MergedShards(shards)
+    detection = detector.CodeSmellDetector(functions, cross_file_only=True, metrics=metrics, **thresholds)
+    for fn1, fn2, similarity in detection.iter_duplicate_records():
+        yield duplicate_finding(fn1['file_path'], fn1, fn2, similarity, fn2['file_path'])
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Merge the shard index files of a distributed scan (scanner --shard K/N --write-index PATH) "
+                    "and report the structural duplicates that cross file and shard boundaries.")
+    parser.add_argument('indexes', nargs='+', help="shard index files")
+    parser.add_argument('-o', '--output', default='-', help="where to write the report (default: stdout)")
+    parser.add_argument('--format', choices=('json', 'jsonl', 'sarif'), default='json')
+    parser.add_argument('--similarity', type=float, default=0.75)
+    parser.add_argument('--min-complexity', type=int, default=2)
+    parser.add_argument('--duplicate-mode', choices=detector.CodeSmellDetector.DUPLICATE_MODES, default='exact',
+                        help="'lsh' (or 'bitset' with NumPy) is recommended for large merges")
+    parser.add_argument('--lsh-bands', type=int, default=16)
+    parser.add_argument('--lsh-rows', type=int, default=4)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    shards = [ShardIndex(path) for path in args.indexes]
+    seen = {}
+    for shard in shards:
+        if shard.shard in seen:
+            print(f"Warning: {shard.path} and {seen[shard.shard]} are both shard {shard.shard[0]}/{shard.shard[1]}",
+                  file=sys.stderr)
+        seen[shard.shard] = shard.path
+    findings = iter_cross_file_duplicates(
+        shards, SIMILARITY_THRESHOLD=args.similarity, min_complexity_threshold=args.min_complexity,
+        duplicate_mode=args.duplicate_mode, lsh_bands=args.lsh_bands, lsh_rows=args.lsh_rows)
+    totals = {'shards': len(shards), 'files': sum(shard.file_count for shard in shards),
+              'functions': sum(len(shard) for shard in shards), 'duplicates': 0}
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        if args.format == 'json':
+            duplicates = [finding.to_dict() for finding in findings]
+            totals['duplicates'] = len(duplicates)
+            json.dump({'totals': totals, 'duplicates': duplicates}, output, indent=2)
+            output.write('\n')
+        else:
+            writer = JsonLinesWriter(output) if args.format == 'jsonl' else SarifWriter(output)
+            for finding in findings:
+                writer.write(finding)
+                totals['duplicates'] += 1
+            writer.close()
+            print(f"Summary: {json.dumps(totals)}", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        for shard in shards:
+            shard.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
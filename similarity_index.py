@@ -0,0 +1,97 @@
+from array import array
+from bisect import bisect_right
+
+DEFAULT_FLOOR = 0.5
+
+
+class SimilarityIndex:
+    """Sparse pairwise similarity scores of one function list, kept sorted by score.
+
+    Every pair scoring above floor is stored once (as positions into the function list), together
+    with each function's AST node count. Any SIMILARITY_THRESHOLD >= floor and any
+    min_complexity_threshold can then be answered by a binary search over the scores instead of
+    recomputing the similarities. Built by CodeSmellDetector.build_similarity_index."""
+
+    def __init__(self, node_counts, floor=DEFAULT_FLOOR):
+        self.floor = floor
+        self.node_counts = array('L', node_counts)  # per function position, 0 for functions never scored
+        self.scores = array('d')
+        self.first = array('L')
+        self.second = array('L')
+        self._sorted = True
+
+    def add(self, i, j, score):
+        if score > self.floor:
+            self.scores.append(score)
+            self.first.append(i)
+            self.second.append(j)
+            self._sorted = False
+
+    def _sort(self):
+        order = sorted(range(len(self.scores)), key=self.scores.__getitem__)
+        self.scores = array('d', (self.scores[k] for k in order))
+        self.first = array('L', (self.first[k] for k in order))
+        self.second = array('L', (self.second[k] for k in order))
+        self._sorted = True
+
+    def __len__(self):
+        return len(self.scores)
+
+    def query(self, threshold, min_complexity=0):
+        """Returns [(i, j, similarity)] in (i, j) order for pairs scoring above threshold whose
+        functions both have more than min_complexity nodes, exactly as a detector built with those
+        thresholds would find them. Similarities are rounded like the detector's output."""
+        if threshold < self.floor:
+            raise ValueError(f"threshold {threshold} is below the index floor {self.floor}")
+        if not self._sorted:
+            self._sort()
+        counts = self.node_counts
+        hits = [(self.first[k], self.second[k], round(self.scores[k], 2))
+                for k in range(bisect_right(self.scores, threshold), len(self.scores))
+                if counts[self.first[k]] > min_complexity and counts[self.second[k]] > min_complexity]
+        hits.sort()
+        return hits
+
+    def to_bytes(self):
+        if not self._sorted:
+            self._sort()
+        header = array('d', [self.floor, len(self.node_counts), len(self.scores)])
+        return b"".join(part.tobytes() for part in (header, self.node_counts, self.scores, self.first, self.second))
+
+    @classmethod
+    def from_bytes(cls, data):
+        view = memoryview(data)
+        header = array('d')
+        header.frombytes(view[:3 * header.itemsize])
+        floor, functions, pairs = header[0], int(header[1]), int(header[2])
+        index = cls([], floor)
+        offset = 3 * header.itemsize
+        for name, count in (('node_counts', functions), ('scores', pairs), ('first', pairs), ('second', pairs)):
+            column = getattr(index, name)
+            size = count * column.itemsize
+            column.frombytes(view[offset:offset + size])
+            offset += size
+        return index
+
+
+class SmellIndex:
+    """LOC and parameter counts of one function list, sorted once so that the long-function and
+    excess-parameter smells for any MAX_LOC / MAX_PARAMS come from a binary search."""
+
+    def __init__(self, functions):
+        self.records = [{'name': fn['name'], 'loc': fn['loc'], 'parameters': fn['parameters'],
+                         'lineno': fn.get('lineno')} for fn in functions]
+        self.by_loc = sorted(range(len(self.records)), key=lambda k: self.records[k]['loc'])
+        self.sorted_loc = array('L', (self.records[k]['loc'] for k in self.by_loc))
+        self.by_params = sorted(range(len(self.records)), key=lambda k: len(self.records[k]['parameters']))
+        self.sorted_params = array('L', (len(self.records[k]['parameters']) for k in self.by_params))
+
+    def _above(self, order, values, limit):
+        return [self.records[k] for k in sorted(order[bisect_right(values, limit):])]
+
+    def query(self, max_loc, max_params):
+        """Returns the smells dict of CodeSmellDetector.detect_code_smells for these thresholds."""
+        return {
+            'long_functions': self._above(self.by_loc, self.sorted_loc, max_loc),
+            'excess_parameters': self._above(self.by_params, self.sorted_params, max_params),
+        }
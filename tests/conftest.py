@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the repository root and are imported by their bare names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_client import Transport  # noqa: E402
+
+
+class FakeTransport(Transport):
+    """Stands in for the OpenAI API: answers each prompt with answer(prompt), records the prompts
+    and raises the errors queued in fail_with before answering."""
+
+    class Unavailable(Exception):
+        pass
+
+    retryable_errors = (Unavailable,)
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.prompts = []
+        self.fail_with = []
+        self.closed = False
+
+    async def complete(self, model, messages, temperature):
+        prompt = messages[-1]['content']
+        self.prompts.append(prompt)
+        if self.fail_with:
+            raise self.fail_with.pop(0)
+        return self.answer(prompt)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_transport():
+    """Returns FakeTransport, to be called with the answer function."""
+    return FakeTransport
@@ -0,0 +1,66 @@
+import ast
+import itertools
+import os
+
+from benchmark import PipelineBenchmark, _measure, compare_with_baseline
+from corpus_generator import CorpusGenerator
+from detector import ASTAnalyzer
+
+
+def results(seconds, recall=1.0):
+    return {'stages': {name: {'seconds': value} for name, value in seconds.items()},
+            'quality': {'exact': {'planted_recall': recall}}}
+
+
+def test_unchanged_run_is_not_a_regression():
+    run = results({'parse': 0.2, 'duplicates[exact]': 1.5})
+    lines, regressed = compare_with_baseline(run, run, tolerance=0.25)
+    assert not regressed and len(lines) == 2
+
+
+def test_slower_stage_and_lost_recall_are_flagged():
+    baseline = results({'parse': 0.2, 'duplicates[exact]': 1.5})
+    lines, regressed = compare_with_baseline(results({'parse': 0.21, 'duplicates[exact]': 2.0}), baseline, 0.25)
+    assert regressed and [line for line in lines if 'REGRESSION' in line][0].startswith('duplicates[exact]')
+    _, regressed = compare_with_baseline(results({'parse': 0.2, 'duplicates[exact]': 1.5}, recall=0.9), baseline,
+                                         0.25)
+    assert regressed
+
+
+def test_millisecond_jitter_is_not_a_regression():
+    lines, regressed = compare_with_baseline(results({'smells': 0.0012}), results({'smells': 0.0006}), 0.25)
+    assert not regressed and 'REGRESSION' not in lines[0]
+
+
+def test_measure_keeps_the_fastest_of_repeated_runs():
+    calls = []
+    def stage():
+        calls.append(1)
+        return [len(calls)] * 1000
+
+    result, seconds, peak = _measure(stage, measure_memory=True, repeat=3)
+    assert len(calls) == 4  # three timed runs, then one under tracemalloc
+    assert result[0] == 3 and seconds >= 0 and peak >= 8000
+
+
+def test_planted_clusters_are_identical_and_stand_out(tmp_path):
+    manifest = CorpusGenerator(modules=4, functions_per_module=30, duplicate_clusters=5, seed=1) \
+        .generate(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ['manifest.json'] + [f"module_{m}.py" for m in range(4)]
+    fingerprints = {}
+    for path in manifest['files']:
+        for node in ast.parse(open(path).read()).body:
+            fingerprints[node.name] = ASTAnalyzer.fingerprint(node)
+    assert len(fingerprints) == manifest['functions'] == 120
+    for cluster in manifest['duplicate_clusters']:
+        assert len({fingerprints[name].structure for name in cluster}) == 1
+    # every body calls some CALL_NAMES functions, and none is a wrapper the detector would skip
+    assert not any(fp.is_wrapper for fp in fingerprints.values())
+    assert all(any(name.startswith('CALL_') for name in fp.structure) for fp in fingerprints.values())
+
+    report = PipelineBenchmark(manifest['files'], manifest['duplicate_clusters'], measure_memory=False,
+                               repeat=1).run()
+    quality = report['quality']['exact']
+    planted = sum(len(list(itertools.combinations(cluster, 2))) for cluster in manifest['duplicate_clusters'])
+    assert quality['planted_recall'] == 1.0
+    assert quality['duplicates'] >= planted and quality['planted_precision'] >= 0.8
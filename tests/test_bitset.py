@@ -0,0 +1,104 @@
+import itertools
+
+import pytest
+
+from corpus_generator import CorpusGenerator
+from detector import CodeSmellDetector
+from extractor import SourceFile
+from metrics import Metrics
+from scanner import extract_file_functions
+
+np = pytest.importorskip('numpy')
+
+METHODS = '''
+class Left:
+    def run(self, items):
+        total = 0
+        for item in items:
+            total += item * 2
+        return total
+
+
+class Right:
+    def run(self, items):
+        total = 0
+        for item in items:
+            total += item * 2
+        return total
+'''
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    manifest = CorpusGenerator(modules=3, functions_per_module=40, duplicate_clusters=6, seed=3) \
+        .generate(str(tmp_path_factory.mktemp('corpus')))
+    functions = []
+    for path in manifest['files']:
+        functions.extend(extract_file_functions(path, SourceFile.from_path(path)))
+    functions.extend(extract_file_functions(None, SourceFile(METHODS)))
+    return functions, manifest
+
+
+def duplicates(functions, mode, threshold=0.5, **options):
+    detection = CodeSmellDetector(functions, SIMILARITY_THRESHOLD=threshold, duplicate_mode=mode, **options)
+    return {(fn1['qualname'], fn2['qualname']): similarity
+            for fn1, fn2, similarity in detection.iter_duplicate_records()}
+
+
+def test_bitset_scores_equal_exact(corpus):
+    functions, _ = corpus
+    exact = duplicates(functions, 'exact')
+    assert exact
+    assert duplicates(functions, 'bitset') == exact
+
+
+def test_bitset_tiles_do_not_change_scores(corpus, monkeypatch):
+    functions, _ = corpus
+    import bitset
+    expected = duplicates(functions, 'bitset')
+    original = bitset.BitsetSimilarityEngine.__init__
+    monkeypatch.setattr(bitset.BitsetSimilarityEngine, '__init__',
+                        lambda self, *args, **kwargs: original(self, *args, **dict(kwargs, block_size=7)))
+    assert duplicates(functions, 'bitset') == expected
+
+
+def test_lsh_finds_a_subset_with_exact_scores(corpus):
+    functions, manifest = corpus
+    exact = duplicates(functions, 'exact')
+    lsh = duplicates(functions, 'lsh')
+    assert lsh.items() <= exact.items()
+    planted = {pair for cluster in manifest['duplicate_clusters'] for pair in itertools.combinations(cluster, 2)}
+    found = {pair for pair, similarity in lsh.items() if similarity == 1.0}
+    assert {tuple(sorted(pair)) for pair in planted} <= {tuple(sorted(pair)) for pair in found}
+
+
+def test_methods_of_different_classes_are_never_paired(corpus):
+    functions, _ = corpus
+    for mode in CodeSmellDetector.DUPLICATE_MODES:
+        assert ('Left.run', 'Right.run') not in duplicates(functions, mode)
+
+
+def test_bitset_counts_pairs_like_exact(corpus):
+    functions, _ = corpus
+    counters = {}
+    for mode in ('exact', 'bitset'):
+        metrics = Metrics()
+        CodeSmellDetector(functions, duplicate_mode=mode, metrics=metrics).duplicate_code_detector()
+        counters[mode] = {name: metrics.counters[name] for name in
+                          ('pairs_considered', 'pairs_skipped_class', 'pairs_skipped_wrapper', 'duplicates')}
+    assert counters['bitset'] == counters['exact']
+    assert counters['exact']['pairs_skipped_class'] > 0
+
+
+def test_bitset_reports_progress_per_row_block(corpus, monkeypatch):
+    functions, _ = corpus
+    import bitset
+    original = bitset.BitsetSimilarityEngine.__init__
+    monkeypatch.setattr(bitset.BitsetSimilarityEngine, '__init__',
+                        lambda self, *args, **kwargs: original(self, *args, **dict(kwargs, block_size=7)))
+    calls = []
+    # a threshold nothing reaches: progress must not depend on pairs being found
+    detection = CodeSmellDetector(functions, SIMILARITY_THRESHOLD=2, duplicate_mode='bitset')
+    assert list(detection.iter_duplicates(progress=lambda done, total: calls.append((done, total)))) == []
+    total = calls[-1][1]
+    assert [done for done, _ in calls] == list(range(0, total, 7)) + [total]
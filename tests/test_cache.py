@@ -0,0 +1,61 @@
+import cache as cache_module
+from cache import AnalysisCache
+from extractor import SourceFile
+from scanner import extract_file_functions
+
+CODE = "def f(a, b):\n    if a > b:\n        return a - b\n    return b\n"
+
+
+def functions_of(code):
+    return extract_file_functions(None, SourceFile(code))
+
+
+def test_hit_miss_cycle(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    key = cache.make_key(CODE.encode())
+    assert cache.get(key) is None
+    cache.put(key, functions_of(CODE))
+    loaded = cache.get(key)
+    assert [fn['name'] for fn in loaded] == ['f']
+    assert loaded[0]['fingerprint'] == functions_of(CODE)[0]['fingerprint']
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_eviction_drops_least_recently_used(tmp_path, monkeypatch):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    clock = iter(range(1000, 100000, 1000))
+    monkeypatch.setattr(cache_module.time, 'time', lambda: next(clock))
+    keys = [cache.make_key(f"{CODE}# {i}\n") for i in range(3)]
+    for key in keys:
+        cache.put(key, functions_of(CODE))
+    assert cache.get(keys[0]) is not None  # touched: now the most recently used
+    size = cache.stats()['bytes'] // 3
+    cache.max_bytes = 2 * size
+    assert cache.evict() == 1
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.evict() == 0
+    cache.close()
+
+
+def test_recent_hits_do_not_write(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    key = cache.make_key(CODE)
+    cache.put(key, functions_of(CODE))
+    statements = []
+    cache.connection.set_trace_callback(statements.append)
+    for _ in range(3):
+        cache.get(key)
+    assert not any(statement.startswith("UPDATE") for statement in statements)
+    cache.close()
+
+
+def test_keys():
+    make_key = AnalysisCache.make_key
+    assert make_key(CODE) == make_key(CODE.encode())
+    assert make_key(CODE) != make_key(CODE, {'clone_min_nodes': 8})
+    assert make_key(CODE, {'clone_min_nodes': 8}) != make_key(CODE, {'clone_min_nodes': 9})
+    assert make_key(CODE, {'MAX_LOC': 3}) == make_key(CODE)  # thresholds are applied after loading
+    # raw bytes that decode to the same replacement text still get different keys
+    assert make_key(b"x = '\xff'\n") != make_key(b"x = '\xfe'\n")
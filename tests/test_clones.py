@@ -0,0 +1,69 @@
+import ast
+
+from cache import AnalysisCache
+from clones import CloneIndex, SubtreeHasher, find_clones
+
+LOOP = '''
+def {name}(items, {arg}):
+    for item in items:
+        if item > {limit}:
+            {arg}.{method}(item * 2)
+        else:
+            {arg}.{method}(item)
+    return {arg}
+'''
+
+
+def clones_of(**sources):
+    return find_clones(((name, ast.parse(code)) for name, code in sources.items()), min_nodes=8)
+
+
+def test_renamed_copies_are_parameterized_clones():
+    groups = clones_of(a=LOOP.format(name='f', arg='out', limit=3, method='append'),
+                       b=LOOP.format(name='g', arg='acc', limit=7, method='append'))
+    assert groups
+    largest = groups[0]
+    assert largest.kind == 'parameterized'
+    assert {member[0] for member in largest.members} == {'a', 'b'}
+
+
+def test_identical_copies_are_exact_clones():
+    code = LOOP.format(name='f', arg='out', limit=3, method='append')
+    assert clones_of(a=code, b=code)[0].kind == 'exact'
+
+
+def test_attribute_names_are_not_normalized_away():
+    assert clones_of(a=LOOP.format(name='f', arg='out', limit=3, method='append'),
+                     b=LOOP.format(name='g', arg='out', limit=3, method='remove')) == []
+
+
+def test_nested_clones_are_reported_once():
+    code = LOOP.format(name='f', arg='out', limit=3, method='append')
+    groups = clones_of(a=code, b=code.replace('def f', 'def g'))
+    # the loop, the if and the blocks all sit inside the cloned functions
+    assert [group.members for group in groups] == [[('a', 'stmt', 2, 8), ('b', 'stmt', 2, 8)]]
+
+
+def test_units_are_whole_blocks_and_statements():
+    tree = ast.parse("x = 1\ny = 2\nz = 3\n")
+    units = SubtreeHasher(min_nodes=1).units(tree)
+    kinds = sorted((unit[2], unit[3], unit[4]) for unit in units)
+    assert kinds == [('block', 1, 3), ('stmt', 1, 1), ('stmt', 2, 2), ('stmt', 3, 3)]
+
+
+def test_clone_unit_cache_has_its_own_counters(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    code = LOOP.format(name='f', arg='out', limit=3, method='append')
+    key = cache.make_key(code, {'clone_min_nodes': 8})
+    assert cache.get_clone_units(key) is None
+    units = SubtreeHasher(8).units(ast.parse(code))
+    cache.put_clone_units(key, units)
+    assert cache.get_clone_units(key) == units
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['clone_hits'], stats['clone_misses']) == (0, 0, 1, 1)
+    cache.close()
+
+    index = CloneIndex()
+    index.add('a', units)
+    index.add('b', units)
+    assert index.groups()
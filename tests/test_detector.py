@@ -0,0 +1,134 @@
+import ast
+import time
+
+import pytest
+
+from detector import ASTAnalyzer, CodeSmellDetector, fingerprint_similarity, jaccard_similarity
+from extractor import CodeParser, FunctionExtractor, SourceFile
+from metrics import Metrics
+
+SOURCE = '''
+def total(items):
+    result = 0
+    for item in items:
+        if item > 0:
+            result += item
+    return result
+
+
+def summed(values):
+    acc = 0
+    for value in values:
+        if value > 0:
+            acc += value
+    return acc
+
+
+def wrap_a(x):
+    return helper(x)
+
+
+def wrap_b(y):
+    return other(y)
+
+
+class First:
+    def run(self, items):
+        result = 0
+        for item in items:
+            if item > 0:
+                result += item
+        return result
+
+
+class Second:
+    def run(self, items):
+        result = 0
+        for item in items:
+            if item > 0:
+                result += item
+        return result
+'''
+
+
+def extract(code):
+    source = SourceFile(code)
+    return FunctionExtractor(CodeParser(None, source).get_ASTree(), None, source).extract_functions()
+
+
+def fingerprint(code):
+    return ASTAnalyzer.fingerprint(ast.parse(code).body[0])
+
+
+def test_jaccard_similarity():
+    assert jaccard_similarity({1, 2}, {2, 3}) == pytest.approx(1 / 3)
+    assert jaccard_similarity(set(), set()) == 0
+
+
+def test_renamed_function_scores_one():
+    functions = {fn['name']: fn['node'] for fn in extract(SOURCE)}
+    assert fingerprint_similarity(ASTAnalyzer.fingerprint(functions['total']),
+                                  ASTAnalyzer.fingerprint(functions['summed'])) == 1
+
+
+def test_unique_operations_are_penalized():
+    plain = fingerprint("def f(a, b):\n    x = a\n    return x\n")
+    with_ops = fingerprint("def f(a, b):\n    x = a\n    return -x if a < b else x + 1\n")
+    structure = jaccard_similarity(plain.structure, with_ops.structure)
+    assert fingerprint_similarity(plain, with_ops) == pytest.approx(max(structure - 3 * 0.05, 0))
+
+
+def test_two_wrappers_never_match():
+    first, second = fingerprint("def a(x):\n    return helper(x)\n"), fingerprint("def b(y):\n    return other(y)\n")
+    assert first.is_wrapper and second.is_wrapper
+    assert fingerprint_similarity(first, second) == 0
+
+
+def test_duplicates_skip_wrappers_and_methods_of_different_classes():
+    duplicates = CodeSmellDetector(extract(SOURCE), SIMILARITY_THRESHOLD=0.75).duplicate_code_detector()
+    pairs = {frozenset((name1, name2)) for name1, name2, _ in duplicates}
+    assert frozenset(('total', 'summed')) in pairs
+    assert frozenset(('wrap_a', 'wrap_b')) not in pairs
+    # First.run is compared with the module-level functions but never with Second.run
+    assert frozenset(('run',)) not in pairs
+    assert all(similarity == 1.0 for _, _, similarity in duplicates)
+
+
+def test_code_smells():
+    functions = extract("def f(a, b, c, d):\n    return a\n")
+    smells = CodeSmellDetector(functions, MAX_LOC=15, MAX_PARAMS=3).detect_code_smells()
+    assert [fn['name'] for fn in smells['excess_parameters']] == ['f']
+    assert smells['long_functions'] == []
+
+
+def test_similarity_stage_excludes_consumer_time_and_pair_generation():
+    functions = extract(SOURCE)
+    metrics = Metrics()
+    for _ in CodeSmellDetector(functions, duplicate_mode='lsh', metrics=metrics).iter_duplicates():
+        time.sleep(0.05)
+    assert metrics.seconds['similarity'] < 0.05
+    assert metrics.calls['similarity'] == metrics.calls['pair_generation'] == 1
+    assert 'fingerprint' not in metrics.seconds
+
+
+def test_exact_mode_times_pair_generation_apart():
+    functions = extract(SOURCE)
+    metrics = Metrics()
+    with metrics.stage('total'):
+        CodeSmellDetector(functions, duplicate_mode='exact', metrics=metrics).duplicate_code_detector()
+    assert metrics.calls['pair_generation'] == metrics.calls['similarity'] == 1
+    stages = sum(seconds for name, seconds in metrics.seconds.items() if name != 'total')
+    assert stages <= metrics.seconds['total']
+
+
+def test_nested_timed_stages_are_billed_once():
+    metrics = Metrics()
+
+    def slow(items):
+        for item in items:
+            time.sleep(0.02)
+            yield item
+
+    assert list(metrics.timed('outer', slow(metrics.timed('inner', slow(range(3)))))) == [0, 1, 2]
+    assert metrics.seconds['inner'] >= 0.06
+    assert 0.06 <= metrics.seconds['outer'] < 0.1
@@ -0,0 +1,82 @@
+import pytest
+
+from extractor import CodeParser, FunctionExtractor, SourceFile, read_source_text
+
+
+def test_coding_cookie_is_honoured(tmp_path):
+    path = tmp_path / "latin.py"
+    path.write_bytes("# -*- coding: latin-1 -*-\nNAME = 'caf\xe9'\n".encode('latin-1'))
+    assert "café" in read_source_text(str(path))
+
+
+def test_bom_and_newlines_are_normalized(tmp_path):
+    path = tmp_path / "bom.py"
+    path.write_bytes(b"\xef\xbb\xbfx = 1\r\ny = 2\rz = 3\n")
+    assert read_source_text(str(path)) == "x = 1\ny = 2\nz = 3\n"
+
+
+def test_undecodable_source_raises(tmp_path):
+    path = tmp_path / "bad.py"
+    path.write_bytes(b"x = 1\ny = 2\nz = '\xff'\n")
+    with pytest.raises(SyntaxError):
+        read_source_text(str(path))
+
+
+def test_loc_skips_blank_lines_comments_and_docstrings():
+    source = SourceFile('def f():\n    """Doc."""\n\n    # note\n    return 1\n')
+    assert source.loc(1, 5) == 2
+
+
+NESTED = '''
+class Outer:
+    def __init__(self):
+        def helper():
+            pass
+
+    class Inner:
+        async def run(self):
+            pass
+
+    def method(self):
+        try:
+            def local():
+                pass
+        except ValueError:
+            pass
+
+
+def top(a, b):
+    if a:
+        def branch():
+            pass
+    match b:
+        case 1:
+            def matched():
+                pass
+'''
+
+
+def extractor_for(code):
+    source = SourceFile(code)
+    return FunctionExtractor(CodeParser(None, source).get_ASTree(), None, source)
+
+
+def test_scopes_are_tracked():
+    records = {fn['qualname']: fn for fn in extractor_for(NESTED).extract_functions()}
+    assert list(records) == ['Outer.__init__.<locals>.helper', 'Outer.Inner.run', 'Outer.method',
+                             'Outer.method.<locals>.local', 'top', 'top.<locals>.branch', 'top.<locals>.matched']
+    assert records['Outer.Inner.run']['class_name'] == 'Outer.Inner'
+    assert records['Outer.Inner.run']['is_async']
+    assert records['Outer.method.<locals>.local']['nesting'] == 1
+    assert records['Outer.method.<locals>.local']['class_name'] == 'Outer'
+    assert records['top']['class_name'] is None
+    assert records['top']['parameters'] == ['a', 'b']
+
+
+def test_iter_functions_is_lazy():
+    extractor = extractor_for(NESTED)
+    functions = extractor.iter_functions()
+    assert next(functions)['qualname'] == 'Outer.__init__.<locals>.helper'
+    # the traversal stopped inside Outer.__init__, so the scopes of the rest are not visited yet
+    assert extractor._scopes == [('Outer', True), ('Outer.__init__', False)]
+    assert [fn['name'] for fn in functions] == ['run', 'method', 'local', 'top', 'branch', 'matched']
@@ -0,0 +1,56 @@
+import pickle
+
+from detector import CodeSmellDetector
+from extractor import CodeParser, FunctionExtractor, SourceFile
+from function_table import FunctionTable
+
+CODE = '''
+def short(a):
+    return a
+
+
+def wide(a, b, c, d, e):
+    return a + b + c + d + e
+
+
+class Box:
+    def long(self, a):
+''' + "".join(f"        x{i} = a * {i}\n" for i in range(20)) + '''        return x0
+'''
+
+
+def records():
+    source = SourceFile(CODE)
+    return FunctionExtractor(CodeParser(None, source).get_ASTree(), None, source).extract_functions()
+
+
+def test_rows_round_trip():
+    extracted = records()
+    table = FunctionTable.from_records(records(), "box.py")
+    assert len(table) == len(extracted)
+    for fn, row in zip(extracted, table):
+        assert {key: value for key, value in fn.items() if key != 'node'} == \
+            {key: value for key, value in row.items() if key != 'fingerprint'}
+    assert table[-1]['qualname'] == 'Box.long' and table[-1]['class_name'] == 'Box'
+    assert table.param_count(1) == 5 and table.parameters(1) == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_tables_hold_no_source_or_nodes():
+    table = FunctionTable.from_records(records(), "box.py")
+    assert 'node' not in table[0]
+    # small enough to travel between processes: only strings, arrays and fingerprints
+    assert b"x19 = a" not in pickle.dumps(table)
+
+
+def test_identical_fingerprints_are_stored_once():
+    table = FunctionTable.from_records(records() + records())
+    assert len(table) == 6 and len(table.fingerprints) == 3
+
+
+def test_smells_agree_with_record_lists():
+    thresholds = {'MAX_LOC': 15, 'MAX_PARAMS': 3}
+    from_list = list(CodeSmellDetector(records(), **thresholds).iter_code_smells())
+    from_table = list(CodeSmellDetector(FunctionTable.from_records(records()), **thresholds).iter_code_smells())
+    assert [(kind, fn['qualname']) for kind, fn in from_table] == [(kind, fn['qualname']) for kind, fn in from_list]
+    assert [(kind, fn['qualname']) for kind, fn in from_table] == [('excess_parameters', 'wide'),
+                                                                   ('long_functions', 'Box.long')]
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+
+from detector import OpenAIClient
+from llm_client import AsyncOpenAIClient, ResponseCache, Transport
+from metrics import Metrics
+
+CODE = '''
+def total(items):
+    result = 0
+    for item in items:
+        result = result + item
+    return result
+
+
+def add_up(values):
+    return sum(values) if values else 0
+
+
+def greet(name):
+    print("hello", name)
+'''
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def strict_json(text):
+    result = json.loads(text)
+    if not isinstance(result, dict):
+        raise ValueError(text)
+    return result
+
+
+def test_transport_is_abstract():
+    with pytest.raises(TypeError):
+        Transport()
+
+
+def test_responses_are_cached(tmp_path, fake_transport):
+    transport = fake_transport(lambda prompt: prompt.upper())
+    metrics = Metrics()
+    client = AsyncOpenAIClient(transport, cache=ResponseCache(str(tmp_path / "r.sqlite")), metrics=metrics)
+    assert run(client.complete("hi")) == "HI"
+    assert run(client.complete("hi")) == "HI"
+    assert transport.prompts == ["hi"]
+    assert metrics.counters['llm_cache_hits'] == 1
+
+
+def test_rejected_responses_are_not_cached(tmp_path, fake_transport):
+    answers = iter(["not json", '{"ok": true}'])
+    transport = fake_transport(lambda prompt: next(answers))
+    client = AsyncOpenAIClient(transport, cache=ResponseCache(str(tmp_path / "r.sqlite")))
+    with pytest.raises(ValueError):
+        run(client.complete("q", parse=strict_json))
+    assert run(client.complete("q", parse=strict_json)) == {'ok': True}
+    assert run(client.complete("q", parse=strict_json)) == {'ok': True}
+    assert len(transport.prompts) == 2
+
+
+def test_bad_cached_response_is_evicted(tmp_path, fake_transport):
+    cache = ResponseCache(str(tmp_path / "r.sqlite"))
+    transport = fake_transport(lambda prompt: '{"ok": 1}')
+    client = AsyncOpenAIClient(transport, cache=cache)
+    cache.put(ResponseCache.make_key(client.model, client.temperature, "q"), "garbage")
+    assert run(client.complete("q", parse=strict_json)) == {'ok': 1}
+    assert transport.prompts == ["q"]
+    assert cache.get(ResponseCache.make_key(client.model, client.temperature, "q")) == '{"ok": 1}'
+
+
+def test_retryable_errors_are_retried(fake_transport):
+    transport = fake_transport(lambda prompt: "done")
+    transport.fail_with = [transport.Unavailable(), transport.Unavailable()]
+    metrics = Metrics()
+    client = AsyncOpenAIClient(transport, backoff=0, requests_per_minute=None, metrics=metrics)
+    assert run(client.complete("q")) == "done"
+    assert metrics.counters['llm_retries'] == 2
+
+
+def test_failures_come_back_per_prompt(fake_transport):
+    transport = fake_transport(lambda prompt: "ok")
+    transport.fail_with = [RuntimeError("boom")]
+    client = AsyncOpenAIClient(transport, requests_per_minute=None, max_concurrency=1)
+    first, second = run(client.complete_many(["a", "b"]))
+    assert isinstance(first, RuntimeError) and second == "ok"
+
+
+def test_semantic_duplicates_through_a_fake_server(tmp_path, fake_transport):
+    def answer(prompt):
+        assert "def greet" not in prompt  # only the prefiltered candidates are sent
+        return json.dumps({"semantic_duplicates": [["total", "add_up"], ["total", "greet"]]})
+
+    transport = fake_transport(answer)
+    client = OpenAIClient(transport=transport, cache=ResponseCache(str(tmp_path / "r.sqlite")))
+    try:
+        assert client.detect_semantic_duplicates(CODE) == [["total", "add_up"]]
+        assert len(transport.prompts) == 1
+    finally:
+        client.close()
+    assert transport.closed
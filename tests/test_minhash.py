@@ -0,0 +1,33 @@
+import pytest
+
+from minhash import LSHIndex, MinHasher
+
+
+def test_signatures_are_deterministic_and_sized():
+    tokens = {"Call", "Name", "Return", "BinOp"}
+    assert MinHasher(32, seed=7).signature(tokens) == MinHasher(32, seed=7).signature(set(tokens))
+    assert len(MinHasher(32).signature(tokens)) == 32
+    assert MinHasher(8).signature(set()) == MinHasher(8).signature(set())
+
+
+def test_similar_sets_become_candidates_and_disjoint_sets_do_not():
+    hasher = MinHasher(64)
+    base = {f"tok{i}" for i in range(40)}
+    index = LSHIndex(bands=16, rows=4)
+    index.insert(0, hasher.signature(base))
+    index.insert(1, hasher.signature(base | {"extra"}))
+    index.insert(2, hasher.signature({f"other{i}" for i in range(40)}))
+    assert index.candidate_pairs() == {(0, 1)}
+
+
+def test_candidate_pairs_are_ordered():
+    signature = MinHasher(8).signature({"a"})
+    index = LSHIndex(bands=2, rows=4)
+    for key in (5, 3, 4):
+        index.insert(key, signature)
+    assert index.candidate_pairs() == {(3, 4), (3, 5), (4, 5)}
+
+
+def test_short_signatures_are_rejected():
+    with pytest.raises(ValueError):
+        LSHIndex(bands=4, rows=4).insert(0, MinHasher(8).signature({"a"}))
@@ -0,0 +1,136 @@
+import io
+import json
+import time
+
+import pytest
+
+import main
+import reporters
+import scanner
+from metrics import Metrics
+from reporters import JsonLinesWriter
+from scanner import RepositoryScanner
+from shards import ShardIndex
+
+LONG = "def long(a, b, c, d):\n" + "".join(f"    x{i} = a + {i}\n" for i in range(20)) + "    return x0\n"
+CLONE = "    total = 0\n    for item in items:\n        if item:\n            total += item * 2\n"
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "good.py").write_text(LONG + "\n\ndef one(items):\n" + CLONE + "    return total\n")
+    (tmp_path / "bad.py").write_text(LONG + "\n\ndef two(items):\n" + CLONE + "    return total\n")
+    return tmp_path
+
+
+def stream(root, **options):
+    output = io.StringIO()
+    metrics = Metrics()
+    summary = RepositoryScanner(workers=1, metrics=metrics, **options).stream(str(root), JsonLinesWriter(output))
+    return [json.loads(line) for line in output.getvalue().splitlines()], summary, metrics
+
+
+def test_stream_matches_scan(tree):
+    findings, summary, _ = stream(tree, clone_min_nodes=8)
+    report = RepositoryScanner(workers=1, clone_min_nodes=8).scan(str(tree))
+    assert summary['totals'] == report['totals']
+    assert {f['file_path'] for f in findings if f['rule_id'] == 'long-function'} == set(report['files'])
+
+
+def test_failed_file_leaves_nothing_behind(tree, monkeypatch):
+    real_iter_findings = reporters.iter_findings
+
+    def failing(file_path, detection, **options):
+        for finding in real_iter_findings(file_path, detection, **options):
+            yield finding
+            if file_path.endswith("bad.py"):
+                raise RuntimeError("detector crashed")
+
+    monkeypatch.setattr(scanner, 'iter_findings', failing)
+    index_path = tree / "index.idx"
+    findings, summary, metrics = stream(tree, clone_min_nodes=8, index_path=str(index_path))
+    assert list(summary['errors']) == [str(tree / "bad.py")]
+    assert metrics.counters['file_errors'] == 1
+    # not even the findings produced before the crash, nor bad.py's side of clone groups
+    files = {finding['file_path'] for finding in findings}
+    files.update(related.get('file_path') for finding in findings for related in finding['related'])
+    assert str(tree / "bad.py") not in files
+    assert summary['totals']['files'] == 1
+    index = ShardIndex(str(index_path))
+    try:
+        assert {index[i]['file_path'] for i in range(len(index))} == {"good.py"}
+    finally:
+        index.close()
+
+
+def test_pool_matches_in_process(tree):
+    metrics = {workers: Metrics() for workers in (1, 2)}
+    reports = {workers: RepositoryScanner(workers=workers, metrics=metrics[workers], clone_min_nodes=8).scan(str(tree))
+               for workers in (1, 2)}
+    assert reports[2] == reports[1]
+    assert reports[2]['totals']['files'] == 2
+    # the workers' metrics are merged into the parent's
+    assert metrics[2].counters == metrics[1].counters
+    assert metrics[2].counters['pairs_considered'] == 2
+    assert metrics[2].seconds['parse'] > 0
+
+
+def test_slow_file_times_out(tree, monkeypatch):
+    real_analyze_file = scanner.analyze_file
+
+    def slow(file_path, *args, **kwargs):
+        if file_path.endswith("bad.py"):
+            time.sleep(30)
+        return real_analyze_file(file_path, *args, **kwargs)
+
+    monkeypatch.setattr(scanner, 'analyze_file', slow)  # forked workers inherit the patch
+    report = RepositoryScanner(workers=2, timeout=0.5).scan(str(tree))
+    assert report['errors'] == {str(tree / "bad.py"): "timed out after 0.5s"}
+    assert list(report['files']) == [str(tree / "good.py")]
+
+
+def test_main_runs_the_scanner(tree, tmp_path):
+    output = tmp_path / "report.json"
+    assert main.main([str(tree), '-j', '1', '--no-cache', '-o', str(output)]) == 0
+    report = json.loads(output.read_text())
+    assert report['totals']['files'] == 2 and report['totals']['long_functions'] == 2
+
+
+def test_analyze_file_yields_findings_as_they_are_found(tree, monkeypatch):
+    produced = []
+    real_iter_findings = reporters.iter_findings
+
+    def recording(file_path, detection, **options):
+        for finding in real_iter_findings(file_path, detection, **options):
+            produced.append(finding)
+            yield finding
+
+    monkeypatch.setattr(scanner, 'iter_findings', recording)
+    path = str(tree / "good.py")
+    findings = scanner.analyze_file(path, {})['findings']
+    assert produced == []  # nothing is detected before the caller asks
+    first = next(findings)
+    assert len(produced) == 1 and first == produced[0].to_dict()
+    rest = list(findings)
+    assert [first] + rest == [finding.to_dict() for finding in produced]
+
+
+def test_worker_clone_cache_lookups_reach_the_totals(tree):
+    def scan():
+        return RepositoryScanner(workers=2, cache_path=str(tree / "cache.sqlite"), clone_min_nodes=8).scan(str(tree))
+
+    cold, warm = scan()['totals'], scan()['totals']
+    assert (cold['clone_cache_hits'], cold['clone_cache_misses']) == (0, 2)
+    assert (warm['clone_cache_hits'], warm['clone_cache_misses']) == (2, 0)
+
+
+def test_cache_stats_count_the_workers_lookups(tree, capsys):
+    arguments = [str(tree), '-j', '2', '--clones', '--clone-min-nodes', '8', '--cache-path', str(tree / "cache.sqlite"),
+                 '--cache-stats', '-o', str(tree / "report.json")]
+    assert main.main(arguments) == 0
+    capsys.readouterr()
+    assert main.main(arguments) == 0  # warm: every lookup hits
+    stats = json.loads(capsys.readouterr().err.split("Cache: ", 1)[1])
+    assert (stats['hits'], stats['misses']) == (2, 0)
+    assert (stats['clone_hits'], stats['clone_misses']) == (2, 0)
+    assert (stats['index_hits'], stats['index_misses']) == (2, 0)
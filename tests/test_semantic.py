@@ -0,0 +1,112 @@
+import ast
+import json
+
+from detector import OpenAIClient
+from semantic import FileFunctions, function_labels, semantic_candidates, splice_functions, token_batches
+
+CODE = '''class Cart:
+    def total(self, items):
+        result = 0
+        for item in items:
+            result = result + item
+        return result
+
+
+class Invoice:
+    def total(self, items):
+        result = 0
+        for item in items:
+            result += item
+        return result
+
+
+def tally(values):
+    result = 0
+    for value in values:
+        result = result + value
+    return result
+'''
+
+
+def test_labels_disambiguate_redefined_functions():
+    records = [{'qualname': 'f', 'lineno': 1}, {'qualname': 'f', 'lineno': 5}, {'qualname': 'A.g', 'lineno': 9}]
+    assert function_labels(records) == ['f (line 1)', 'f (line 5)', 'A.g']
+
+
+def test_same_named_methods_are_not_merged():
+    functions = FileFunctions(CODE)
+    assert functions.labels == ['Cart.total', 'Invoice.total', 'tally']
+    assert functions.positions_named('Invoice.total') == [1]
+    assert functions.positions_named('tally') == [2]
+    assert functions.positions_named('total') == []  # ambiguous bare name
+
+
+def test_splice_replaces_inserts_and_deletes():
+    lines = ['a', 'b', 'c', 'd']
+    assert splice_functions(lines, [(2, 2, 4, 'B')]) == 'a\n    B\nc\nd'
+    assert splice_functions(lines, [(3, 2, 0, 'x')]) == 'a\nb\nx\n\nc\nd'
+    assert splice_functions(lines, [(2, 3, 0, '')]) == 'a\nd'
+
+
+def test_semantic_candidates_pair_same_arity_functions():
+    functions = FileFunctions(CODE)
+    pairs = semantic_candidates(functions.signatures)
+    assert {(i, j) for i, j, _ in pairs} == {(0, 1), (0, 2), (1, 2)}
+    assert all(0.2 <= score <= 1 for _, _, score in pairs)
+
+
+def test_token_batches_respect_the_budget():
+    sources = {'a': 'x' * 40, 'b': 'x' * 40, 'c': 'x' * 40}
+    assert token_batches([['a', 'b'], ['b', 'c']], sources, budget=40) == [
+        (['a', 'b', 'c'], [['a', 'b'], ['b', 'c']])]
+    assert token_batches([['a', 'b'], ['b', 'c']], sources, budget=25) == [
+        (['a', 'b'], [['a', 'b']]), (['b', 'c'], [['b', 'c']])]
+
+
+def test_refactor_splices_by_label(fake_transport):
+    def answer(prompt):
+        assert "# function: Invoice.total" in prompt and "# function: Cart.total" not in prompt
+        return json.dumps({"functions": {"Invoice.total": "def total(self, items):\n    return sum(items)\n",
+                                         "tally": ""}})
+
+    client = OpenAIClient(transport=fake_transport(answer), cache=False)
+    try:
+        refactored = client.refactor_code(CODE, [('Invoice.total', 'tally', 0.9)])
+    finally:
+        client.close()
+    ast.parse(refactored)
+    functions = FileFunctions(refactored)
+    assert functions.labels == ['Cart.total', 'Invoice.total']
+    assert functions.source(1) == "def total(self, items):\n    return sum(items)"
+    assert "result = result + item" in functions.source(0)
+
+
+def test_refactor_drops_unparseable_rewrites(fake_transport):
+    transport = fake_transport(lambda prompt: json.dumps({"functions": {"tally": "def tally(values:\n"}}))
+    client = OpenAIClient(transport=transport, cache=False)
+    try:
+        assert client.refactor_code(CODE, [('Cart.total', 'tally', 0.9)]) is None  # nothing applied
+    finally:
+        client.close()
+    assert len(transport.prompts) == 1
+
+
+def test_refactor_reports_failed_requests(fake_transport):
+    transport = fake_transport(lambda prompt: "never sent")
+    transport.fail_with = [RuntimeError("boom")]
+    client = OpenAIClient(transport=transport, cache=False, requests_per_minute=None)
+    try:
+        assert client.refactor_code(CODE, [('Cart.total', 'tally', 0.9)]) is None
+    finally:
+        client.close()
+
+
+def test_whole_file_refactoring_must_parse(fake_transport):
+    broken = "def f(:\n    pass\n"
+    answers = iter(["```python\ndef f(:\n```", "```python\ndef f():\n    pass\n```"])
+    client = OpenAIClient(transport=fake_transport(lambda prompt: next(answers)), cache=False)
+    try:
+        assert client.refactor_code(broken, [('f', 'g', 0.9)]) is None
+        assert client.refactor_code(broken, [('f', 'g', 0.9)]) == "def f():\n    pass"
+    finally:
+        client.close()
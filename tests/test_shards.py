@@ -0,0 +1,109 @@
+import argparse
+
+import pytest
+
+from detector import CodeSmellDetector
+from extractor import CodeParser, FunctionExtractor, SourceFile
+from function_table import FunctionTable
+from metrics import Metrics
+from shards import MergedShards, ShardIndex, ShardWriter, iter_cross_file_duplicates, parse_shard, shard_of
+
+LOOP = "total = 0\nfor item in items:\n    if item:\n        total += item * 2\nreturn total\n"
+
+
+def indented(code, depth):
+    return "".join("    " * depth + line + "\n" for line in code.splitlines())
+
+
+FILES = {
+    "a.py": "class Box:\n    def sum(self, items):\n" + indented(LOOP, 2)
+            + "\n\ndef helper(items):\n" + indented(LOOP, 1) + "\n\ndef copy(items):\n" + indented(LOOP, 1),
+    "b.py": "class Box:\n    def add(self, items):\n" + indented(LOOP, 2),
+    "c.py": "def other(items):\n" + indented(LOOP, 1),
+}
+
+
+def table(file_path):
+    source = SourceFile(FILES[file_path])
+    records = FunctionExtractor(CodeParser(None, source).get_ASTree(), None, source).iter_functions()
+    return FunctionTable.from_records(records, file_path)
+
+
+def write_shard(tmp_path, shard, file_paths):
+    writer = ShardWriter(shard)
+    for file_path in file_paths:
+        writer.add(file_path, table(file_path))
+    path = str(tmp_path / f"shard{shard[0]}.idx")
+    writer.write(path)
+    return ShardIndex(path)
+
+
+def comparable(fn):
+    return {key: value for key, value in fn.items() if key != 'file_path'}
+
+
+def test_shard_round_trip(tmp_path):
+    index = write_shard(tmp_path, (2, 3), ["b.py", "a.py"])
+    try:
+        assert index.shard == (2, 3) and index.file_count == 2
+        expected = [fn for file_path in ("a.py", "b.py") for fn in table(file_path)]
+        assert [comparable(fn) for fn in index] == expected
+        assert [fn['file_path'] for fn in index] == ["a.py"] * 3 + ["b.py"]
+    finally:
+        index.close()
+
+
+def test_bad_index_is_rejected(tmp_path):
+    path = tmp_path / "bad.idx"
+    path.write_bytes(b"nope" * 20)
+    with pytest.raises(ValueError):
+        ShardIndex(str(path))
+
+
+def test_merged_records_keep_their_class_name(tmp_path):
+    shards = [write_shard(tmp_path, (1, 2), ["a.py"]), write_shard(tmp_path, (2, 2), ["b.py", "c.py"])]
+    try:
+        merged = MergedShards(shards)
+        assert len(merged) == 5
+        assert [fn['class_name'] for fn in merged] == ["Box", None, None, "Box", None]
+        assert merged[3]['class_name'] == "Box"  # repeated access does not change the record
+    finally:
+        for shard in shards:
+            shard.close()
+
+
+@pytest.mark.parametrize("mode", ["exact", "lsh", "bitset"])
+def test_merge_matches_the_unsharded_cross_file_duplicates(tmp_path, mode):
+    if mode == "bitset":
+        pytest.importorskip("numpy")
+    everything = [dict(fn, file_path=file_path) for file_path in sorted(FILES) for fn in table(file_path)]
+    expected = [(fn1['file_path'], fn1['qualname'], fn2['file_path'], fn2['qualname'], similarity)
+                for fn1, fn2, similarity in CodeSmellDetector(everything).iter_duplicate_records()
+                if fn1['file_path'] != fn2['file_path']]
+    # same-named classes of different files are different classes
+    assert not any(q1 == "Box.sum" and q2 == "Box.add" for _, q1, _, q2, _ in expected)
+    assert expected
+
+    shards = [write_shard(tmp_path, (1, 2), ["a.py"]), write_shard(tmp_path, (2, 2), ["b.py", "c.py"])]
+    metrics = Metrics()
+    try:
+        findings = [finding.to_dict() for finding in
+                    iter_cross_file_duplicates(shards, metrics=metrics, duplicate_mode=mode)]
+    finally:
+        for shard in shards:
+            shard.close()
+    assert len(findings) == len(expected)
+    assert all(finding['file_path'] != finding['related'][0]['file_path'] for finding in findings)
+    if mode == "exact":
+        # a.py's own pairs (Box.sum, helper and copy with each other) are never scored
+        assert metrics.counters['pairs_skipped_same_file'] == 3
+        assert metrics.counters['pairs_considered'] + metrics.counters['pairs_skipped_same_file'] + \
+            metrics.counters['pairs_skipped_class'] == 5 * 4 // 2
+
+
+def test_shard_of_is_stable_and_in_range():
+    assert shard_of("pkg/mod.py", 4) == shard_of("pkg/mod.py", 4)
+    assert all(1 <= shard_of(f"f{i}.py", 3) <= 3 for i in range(20))
+    assert parse_shard("2/3") == (2, 3)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_shard("4/3")
@@ -0,0 +1,75 @@
+import pytest
+
+from cache import AnalysisCache
+from corpus_generator import CorpusGenerator
+from detector import CodeSmellDetector
+from extractor import SourceFile
+from scanner import extract_file_functions
+from similarity_index import SimilarityIndex, SmellIndex
+
+THRESHOLDS = [0.5, 0.6, 0.75, 0.9, 0.99]
+COMPLEXITIES = [0, 2, 10, 30]
+
+
+@pytest.fixture(scope='module')
+def functions(tmp_path_factory):
+    manifest = CorpusGenerator(modules=2, functions_per_module=40, duplicate_clusters=5, seed=5) \
+        .generate(str(tmp_path_factory.mktemp('corpus')))
+    table = []
+    for path in manifest['files']:
+        table.extend(extract_file_functions(path, SourceFile.from_path(path)))
+    return table
+
+
+def scored(functions, threshold, min_complexity):
+    detection = CodeSmellDetector(functions, SIMILARITY_THRESHOLD=threshold, min_complexity_threshold=min_complexity)
+    positions = {id(fn): k for k, fn in enumerate(functions)}
+    return sorted((positions[id(fn1)], positions[id(fn2)], similarity)
+                  for fn1, fn2, similarity in detection.iter_duplicate_records())
+
+
+def test_query_matches_rescoring_at_every_threshold(functions):
+    index = CodeSmellDetector(functions).build_similarity_index(floor=0.5)
+    for threshold in THRESHOLDS:
+        for min_complexity in COMPLEXITIES:
+            assert index.query(threshold, min_complexity) == scored(functions, threshold, min_complexity)
+
+
+def test_query_below_floor_is_refused(functions):
+    index = CodeSmellDetector(functions).build_similarity_index(floor=0.6)
+    with pytest.raises(ValueError):
+        index.query(0.5)
+
+
+def test_bytes_round_trip(functions):
+    index = CodeSmellDetector(functions).build_similarity_index(floor=0.5)
+    restored = SimilarityIndex.from_bytes(index.to_bytes())
+    assert len(restored) == len(index) and restored.floor == index.floor
+    assert restored.query(0.75, 2) == index.query(0.75, 2)
+
+
+def test_indexed_duplicates_equal_scored_ones(functions):
+    index = CodeSmellDetector(functions).build_similarity_index(floor=0.5)
+    detection = CodeSmellDetector(functions, SIMILARITY_THRESHOLD=0.8)
+    assert list(detection.iter_indexed_duplicates(index)) == list(detection.iter_duplicate_records())
+
+
+def test_smell_index_matches_detector(functions):
+    smell_index = SmellIndex(functions)
+    for max_loc, max_params in [(1, 0), (5, 2), (15, 3), (100, 10)]:
+        expected = CodeSmellDetector(functions, MAX_LOC=max_loc, MAX_PARAMS=max_params).detect_code_smells()
+        found = smell_index.query(max_loc, max_params)
+        for kind in expected:
+            assert [(fn['name'], fn['lineno']) for fn in found[kind]] == \
+                [(fn['name'], fn['lineno']) for fn in expected[kind]]
+
+
+def test_cached_index_has_its_own_counters(tmp_path, functions):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    key = cache.make_key("corpus", {'similarity_floor': 0.5})
+    assert cache.get_similarity_index(key) is None
+    cache.put_similarity_index(key, CodeSmellDetector(functions).build_similarity_index(floor=0.5))
+    assert cache.get_similarity_index(key).query(0.75) == scored(functions, 0.75, 0)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['index_hits'], stats['index_misses']) == (0, 0, 1, 1)
+    cache.close()
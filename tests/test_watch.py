@@ -0,0 +1,137 @@
+import pytest
+
+from scanner import RepositoryScanner
+from watch import IncrementalAnalysis, PollingWatcher
+
+BASE = '''
+def total(items):
+    result = 0
+    for item in items:
+        if item > 0:
+            result += item
+    return result
+
+
+class Store:
+    def add(self, values):
+        acc = 0
+        for value in values:
+            if value > 0:
+                acc += value
+        return acc
+
+    def name(self):
+        return "store"
+
+
+def scale(a, b):
+    return [x * b for x in a]
+'''
+
+
+def snapshot(analysis, threshold=0.5):
+    records = [(fn['qualname'], fn['lineno'], fn['end_lineno'], fn['loc'], fn['fingerprint'])
+               for fn in analysis.records]
+    pairs = [(records[i][0], records[j][0], score) for i, j, score in analysis.query(threshold)]
+    return records, pairs
+
+
+EDITS = [
+    # inside one function: re-parsed on its own
+    ("            result += item\n", "            result += item * 2\n            result -= 1\n"),
+    # inside a method
+    ('        return "store"\n', '        return "store: " + str(len(self.__dict__))\n'),
+    # a new module-level function
+    ("\n\ndef scale(a, b):", "\n\ndef extra(items):\n    out = 0\n    for i in items:\n        if i > 0:\n"
+                             "            out += i\n    return out\n\n\ndef scale(a, b):"),
+    # a function removed
+    ("def scale(a, b):\n    return [x * b for x in a]\n", ""),
+    # a change outside any function: full re-parse
+    ("class Store:", "class Store(object):"),
+]
+
+
+@pytest.mark.parametrize("old, new", EDITS)
+def test_update_matches_a_fresh_analysis(tmp_path, old, new):
+    assert old in BASE
+    text = BASE.replace(old, new)
+    analysis = IncrementalAnalysis(str(tmp_path / "m.py"), BASE, floor=0.5)
+    analysis.query(0.8)  # keeps a hot set that the update must maintain
+    analysis.update(text)
+    fresh = IncrementalAnalysis(str(tmp_path / "m.py"), text, floor=0.5)
+    for threshold in (0.5, 0.8):
+        assert snapshot(analysis, threshold) == snapshot(fresh, threshold)
+
+
+def test_edit_inside_a_function_is_incremental(tmp_path):
+    analysis = IncrementalAnalysis(str(tmp_path / "m.py"), BASE)
+    update = analysis.update(BASE.replace(*EDITS[0]))
+    assert update['incremental'] and update['changed'] == 1
+
+
+def test_syntax_errors_keep_the_previous_state(tmp_path):
+    analysis = IncrementalAnalysis(str(tmp_path / "m.py"), BASE)
+    before = snapshot(analysis)
+    with pytest.raises(SyntaxError):
+        analysis.update(BASE.replace("def total(items):", "def total(items:"))
+    assert snapshot(analysis) == before
+
+
+class ScriptedWatcher:
+    """Reports the scripted batches of changed paths, then stops the watch loop."""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.closed = False
+
+    def changes(self, timeout=None):
+        if not self.batches:
+            raise KeyboardInterrupt
+        return self.batches.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+def test_scanner_watch_builds_analyses_up_front(tmp_path):
+    path = tmp_path / "m.py"
+    path.write_text(BASE)
+    results = []
+
+    class EditingWatcher(ScriptedWatcher):
+        def changes(self, timeout=None):
+            path.write_text(BASE.replace(*EDITS[0]))
+            return super().changes(timeout)
+
+    watcher = EditingWatcher([[str(path)]])
+    with pytest.raises(KeyboardInterrupt):
+        RepositoryScanner(workers=1, SIMILARITY_THRESHOLD=0.9).watch(
+            str(tmp_path), lambda file_path, result: results.append(result), watcher)
+    assert watcher.closed
+    assert len(results) == 1 and results[0]['incremental']
+
+
+def test_polling_watcher_sees_changes(tmp_path):
+    path = tmp_path / "m.py"
+    path.write_text(BASE)
+    watcher = PollingWatcher(str(tmp_path), interval=0.01)
+    path.write_text(BASE + "\n# edited, and longer\n")
+    assert watcher.changes(timeout=1) == {str(path)}
+    path.unlink()
+    assert watcher.changes(timeout=1) == {str(path)}
+    assert watcher.changes(timeout=0.05) == set()
+    watcher.close()
+
+
+def test_scanner_watch_honours_the_shard(tmp_path):
+    paths = [tmp_path / f"m{i}.py" for i in range(6)]
+    for path in paths:
+        path.write_text(BASE)
+    scanner = RepositoryScanner(workers=1, shard=(1, 2))
+    in_shard = set(scanner.iter_files(str(tmp_path)))
+    assert 0 < len(in_shard) < len(paths)
+    written = []
+    with pytest.raises(KeyboardInterrupt):
+        scanner.watch(str(tmp_path), lambda file_path, result: written.append(file_path),
+                      ScriptedWatcher([[str(path) for path in paths]]))
+    assert set(written) == in_shard
@@ -0,0 +1,384 @@
+import ast
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from collections import defaultdict
+
+import detector
+from extractor import CodeParser, FunctionExtractor, SourceFile, read_source_text
+from similarity_index import DEFAULT_FLOOR
+
+FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+
+def _watched(path, root, skip_dirs):
+    if os.path.isfile(root) or not os.path.isdir(root):
+        return os.path.abspath(path) == os.path.abspath(root)
+    parts = os.path.relpath(path, root).split(os.sep)
+    return path.endswith('.py') and not any(part in skip_dirs for part in parts[:-1])
+
+
+class PollingWatcher:
+    """Finds changed Python files under root (a directory or a single file) by comparing
+    modification times and sizes every interval seconds. Works everywhere."""
+
+    def __init__(self, root, interval=0.5, skip_dirs=frozenset()):
+        self.root = root
+        self.interval = interval
+        self.skip_dirs = skip_dirs
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        if os.path.isfile(self.root):
+            paths = [self.root]
+        else:
+            paths = []
+            for dir_path, dir_names, file_names in os.walk(self.root):
+                dir_names[:] = [d for d in dir_names if d not in self.skip_dirs]
+                paths.extend(os.path.join(dir_path, name) for name in file_names if name.endswith('.py'))
+        snapshot = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def changes(self, timeout=None):
+        """Blocks until something changed or timeout seconds passed; returns the changed paths
+        (including deleted ones)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = {path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else max(min(self.interval, deadline - time.monotonic()), 0))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify through ctypes: no polling, the kernel reports writes, renames and deletions.
+    Directories are watched rather than files, so editors that save by renaming are seen too."""
+    IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x2, 0x8, 0x40, 0x80
+    IN_CREATE, IN_DELETE, IN_ISDIR = 0x100, 0x200, 0x40000000
+    EVENT = struct.Struct('iIII')
+    SETTLE_SECONDS = 0.05  # editors write in bursts; gather a burst into one change set
+
+    def __init__(self, root, skip_dirs=frozenset()):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.skip_dirs = skip_dirs
+        self.directories = {}  # watch descriptor -> directory
+        self.mask = (self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO |
+                     self.IN_CREATE | self.IN_DELETE)
+        if os.path.isdir(root):
+            for dir_path, dir_names, _ in os.walk(root):
+                dir_names[:] = [d for d in dir_names if d not in skip_dirs]
+                self._add(dir_path)
+        else:
+            self._add(os.path.dirname(os.path.abspath(root)))
+
+    def _add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.mask)
+        if wd >= 0:
+            self.directories[wd] = directory
+
+    def _read(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            directory = self.directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and name not in self.skip_dirs:
+                    self._add(path)
+            elif _watched(path, self.root, self.skip_dirs):
+                changed.add(path)
+        return changed
+
+    def changes(self, timeout=None):
+        """Blocks until something changed or timeout seconds passed; returns the changed paths."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed = set()
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if changed:
+                remaining = self.SETTLE_SECONDS if remaining is None else min(remaining, self.SETTLE_SECONDS)
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return changed
+            changed |= self._read()
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(root, interval=0.5, skip_dirs=frozenset()):
+    """An InotifyWatcher where the platform has inotify, otherwise a PollingWatcher."""
+    if hasattr(os, 'O_CLOEXEC') and ctypes.util.find_library('c'):
+        try:
+            return InotifyWatcher(root, skip_dirs)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(root, interval, skip_dirs)
+
+
+def _function_units(tree):
+    """Top-level re-parse units: every function that is not nested in another function, i.e.
+    module-level functions and methods of (nested) classes, as [start, end, indent, prefix, class_name]."""
+    units = []
+
+    def collect(body, prefix, class_name):
+        for node in body:
+            if isinstance(node, ast.ClassDef):
+                qualname = f"{prefix}{node.name}"
+                collect(node.body, f"{qualname}.", qualname)
+            elif isinstance(node, FUNCTION_NODES):
+                start = min([decorator.lineno for decorator in node.decorator_list] + [node.lineno])
+                units.append([start, node.end_lineno, node.col_offset, prefix, class_name])
+
+    collect(tree.body, "", None)
+    return units
+
+
+def _dedent(lines, indent):
+    """Removes up to indent leading whitespace characters from every line."""
+    return [line[min(indent, len(line) - len(line.lstrip())):] for line in lines]
+
+
+class IncrementalAnalysis:
+    """Keeps one file's function records and the similarity scores between them up to date as the
+    file is edited.
+
+    update() diffs the new text against the previous one (common prefix and suffix lines). When the
+    change lies inside one re-parse unit (a module-level function or a method), only that function is
+    dedented, re-parsed and re-extracted and the records after it are shifted; otherwise the whole file
+    is parsed again. Either way, records are matched to the previous ones by qualname, class and
+    fingerprint, and only pairs involving functions that really changed are rescored. Every pair
+    scoring above floor is kept, so query() answers any threshold at or above it."""
+
+    def __init__(self, file_path, text=None, floor=DEFAULT_FLOOR, **detector_options):
+        self.file_path = file_path
+        self.floor = floor
+        self.detector_options = detector_options
+        self.records = []
+        self.ids = []  # stable id of the record at each position
+        self.fingerprints = {}
+        self.class_names = {}
+        self.pairs = {}  # (id, id) with the smaller id first -> score above floor
+        self.partners = defaultdict(set)
+        self.hot = {}  # the pairs scoring above hot_threshold, the lowest threshold queried so far
+        self.hot_threshold = None
+        self.next_id = 0
+        self.lines = []
+        self.units = []
+        self.scored = False
+        self._full_update(read_source_text(file_path) if text is None else text)
+
+    def update(self, text=None):
+        """Brings the analysis up to date with text (re-read from file_path when None).
+        Returns {'incremental': bool, 'changed': functions rescored, 'removed': ..., 'seconds': ...};
+        a file that does not parse raises SyntaxError and leaves the previous state untouched."""
+        start = time.perf_counter()
+        text = read_source_text(self.file_path) if text is None else text
+        lines = text.split('\n')
+        changed, removed = self._unit_update(lines)
+        incremental = changed is not None
+        if not incremental:
+            changed, removed = self._full_update(text)
+        return {'incremental': incremental, 'changed': changed, 'removed': removed,
+                'seconds': time.perf_counter() - start}
+
+    # --- re-extraction ------------------------------------------------------------------------
+
+    def _full_update(self, text):
+        parser = CodeParser(self.file_path, SourceFile(text, self.file_path))
+        tree = parser.get_ASTree()
+        records = FunctionExtractor(tree, self.file_path, parser.get_source()).extract_functions()
+        units = _function_units(tree)
+        for record in records:
+            record['fingerprint'] = detector.ASTAnalyzer.fingerprint(record.pop('node'))
+        result = self._replace(0, len(self.records), records)
+        self.lines, self.units = parser.get_source().lines, units
+        if not self.scored:
+            self._score_all()
+            self.scored = True
+        return result
+
+    def _unit_update(self, lines):
+        """Re-extracts the one unit containing the change. Returns (changed, removed) or (None, None)
+        when the change is not confined to a single unit and the whole file must be re-parsed."""
+        old = self.lines
+        limit = min(len(old), len(lines))
+        prefix = 0
+        while prefix < limit and old[prefix] == lines[prefix]:
+            prefix += 1
+        if prefix == len(old) == len(lines):
+            return 0, 0
+        suffix = 0
+        while suffix < limit - prefix and old[-1 - suffix] == lines[-1 - suffix]:
+            suffix += 1
+        first_changed, last_changed = prefix + 1, len(old) - suffix  # old line numbers, 1-based
+        delta = len(lines) - len(old)
+
+        unit_index = next((k for k, (start, end, *_) in enumerate(self.units)
+                           if start <= first_changed and last_changed <= end), None)
+        if unit_index is None:
+            return None, None
+        start, end, indent, prefix_name, class_name = self.units[unit_index]
+        snippet = _dedent(lines[start - 1:end + delta], indent)
+        try:
+            tree = ast.parse("\n".join(snippet))
+        except SyntaxError:
+            return None, None
+        if len(tree.body) != 1 or not isinstance(tree.body[0], FUNCTION_NODES):
+            return None, None
+        node = tree.body[0]
+        # the unchanged code after the function must not have become part of its body
+        for line in lines[end + delta:]:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('#'):
+                if len(line) - len(line.lstrip()) > indent:
+                    return None, None
+                break
+
+        source = SourceFile("\n".join(snippet), self.file_path)
+        records = FunctionExtractor(tree, self.file_path, source).extract_functions()
+        offset = start - 1
+        for record in records:
+            record['fingerprint'] = detector.ASTAnalyzer.fingerprint(record.pop('node'))
+            record['qualname'] = prefix_name + record['qualname']
+            record['class_name'] = prefix_name + record['class_name'] if record['class_name'] else class_name
+            record['lineno'] += offset
+            record['end_lineno'] += offset
+
+        first = next((k for k, fn in enumerate(self.records) if fn['lineno'] >= start), len(self.records))
+        last = next((k for k in range(first, len(self.records)) if self.records[k]['lineno'] > end),
+                    len(self.records))
+        for fn in self.records[last:]:
+            fn['lineno'] += delta
+            fn['end_lineno'] += delta
+        result = self._replace(first, last, records)
+
+        new_start = offset + min([d.lineno for d in node.decorator_list] + [node.lineno])
+        self.units[unit_index] = [new_start, offset + node.end_lineno, indent, prefix_name, class_name]
+        for unit in self.units[unit_index + 1:]:
+            unit[0] += delta
+            unit[1] += delta
+        self.lines = lines
+        return result
+
+    def _replace(self, first, last, records):
+        """Puts records in place of positions first..last, reusing the ids of unchanged functions.
+        Returns (changed, removed)."""
+        reusable = defaultdict(list)
+        for position in range(first, last):
+            fn = self.records[position]
+            reusable[(fn['qualname'], fn['class_name'], fn['fingerprint'])].append(self.ids[position])
+        new_ids, changed = [], []
+        for fn in records:
+            candidates = reusable.get((fn['qualname'], fn['class_name'], fn['fingerprint']))
+            if candidates:
+                new_ids.append(candidates.pop(0))
+            else:
+                function_id = self.next_id
+                self.next_id += 1
+                self.fingerprints[function_id] = fn['fingerprint']
+                self.class_names[function_id] = fn['class_name']
+                new_ids.append(function_id)
+                changed.append(function_id)
+        removed = [function_id for ids in reusable.values() for function_id in ids]
+        for function_id in removed:
+            self._forget(function_id)
+        self.records[first:last] = records
+        self.ids[first:last] = new_ids
+        if self.scored:
+            for function_id in changed:
+                self._score(function_id)
+        return len(changed), len(removed)
+
+    # --- similarity maintenance ---------------------------------------------------------------
+
+    def _forget(self, function_id):
+        for partner in self.partners.pop(function_id, ()):
+            self.partners[partner].discard(function_id)
+            key = (min(function_id, partner), max(function_id, partner))
+            self.pairs.pop(key, None)
+            self.hot.pop(key, None)
+        del self.fingerprints[function_id]
+        del self.class_names[function_id]
+
+    def _add_pair(self, id1, id2, score):
+        if score > self.floor:
+            key = (min(id1, id2), max(id1, id2))
+            self.pairs[key] = score
+            if self.hot_threshold is not None and score > self.hot_threshold:
+                self.hot[key] = score
+            self.partners[id1].add(id2)
+            self.partners[id2].add(id1)
+
+    def _score(self, function_id):
+        """Scores one function against every other class-compatible function."""
+        fingerprint, class_name = self.fingerprints[function_id], self.class_names[function_id]
+        self.partners.setdefault(function_id, set())
+        for other in self.ids:
+            if other == function_id or (min(function_id, other), max(function_id, other)) in self.pairs:
+                continue
+            other_class = self.class_names[other]
+            if class_name and other_class and class_name != other_class:
+                continue
+            self._add_pair(function_id, other, detector.fingerprint_similarity(fingerprint, self.fingerprints[other]))
+
+    def _score_all(self):
+        """Initial scoring of every pair, using the detector's (possibly vectorized) search."""
+        detection = detector.CodeSmellDetector(self.records, **self.detector_options)
+        index = detection.build_similarity_index(self.floor)
+        for function_id in self.ids:
+            self.partners.setdefault(function_id, set())
+        for k in range(len(index)):
+            self._add_pair(self.ids[index.first[k]], self.ids[index.second[k]], index.scores[k])
+
+    def query(self, threshold, min_complexity=0):
+        """Same as SimilarityIndex.query(threshold, min_complexity) over self.records, without building an
+        index of every pair: only the pairs above the lowest threshold queried so far are walked, and those
+        are kept up to date by every update. So the analysis itself can be passed wherever a SimilarityIndex
+        of self.records is expected (iter_findings, gui.ThresholdTuner)."""
+        if threshold < self.floor:
+            raise ValueError(f"threshold {threshold} is below the index floor {self.floor}")
+        if self.hot_threshold is None or threshold < self.hot_threshold:
+            self.hot = {key: score for key, score in self.pairs.items() if score > threshold}
+            self.hot_threshold = threshold
+        positions = {function_id: position for position, function_id in enumerate(self.ids)}
+        hits = []
+        for (id1, id2), score in self.hot.items():
+            if score > threshold and self.fingerprints[id1].node_count > min_complexity \
+                    and self.fingerprints[id2].node_count > min_complexity:
+                i, j = positions[id1], positions[id2]
+                hits.append((min(i, j), max(i, j), round(score, 2)))
+        hits.sort()
+        return hits